@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""compendia: synthetic research compendia for benchmarking
+
+Generates reconto compendia of configurable size and shape, whose steps
+are executed by `FakeExenv`, an in-process execution environment that
+only waits a tunable latency and writes the step results, so that
+builds run offline without docker or pipenv.
+"""
+import os, re, random, threading, contextlib
+from concurrent.futures import Future
+from reconto import Reconto
+from reconto.exenv import Exenv
+from reconto.waiter import ExecResult
+
+class FakeExenv(Exenv):
+    """FakeExenv object
+
+    Exenv for `bench://<name>` uids, executing a command by sleeping
+    `latency` seconds on a timer and writing its missing results.
+    """
+    _uid_regex = re.compile(r'(?P<typenv>bench)://(?P<uid>\S*)')
+    latency = 0.
+
+    @property
+    def env_working_dir(self):
+        return self.reco.path
+
+    def load_environment(self):
+        pass
+
+    def stop_environment(self):
+        pass
+
+    def submit_command(self, command, *args, log=None, timeout=None):
+        future = Future()
+        resultsdir = os.path.join(self.reco.path,'results')+os.sep
+        def execute():
+            for e in command:
+                if e.startswith(resultsdir) and not os.path.exists(e):
+                    with open(e,'wt') as f:
+                        f.write(' '.join(command))
+            if log:
+                with open(log,'wt') as f:
+                    f.write(' '.join(command))
+            future.set_result(ExecResult(0, self.latency, log, False))
+        if self.latency:
+            threading.Timer(self.latency, execute).start()
+        else:
+            execute()
+        return future
+
+@contextlib.contextmanager
+def fake_exenv(latency=0.):
+    """context in which `bench://` exenvs resolve to `FakeExenv`
+
+    Args:
+        latency (float): seconds each fake step execution takes.
+    """
+    FakeExenv.latency = latency
+    Exenv.register('bench')(FakeExenv)
+    try:
+        yield FakeExenv
+    finally:
+        Exenv.types.pop('bench', None)
+
+def workflow(steps,fanin=3,width=100,datasources=10,seed=0):
+    """synthetic workflow commands
+
+    Step `i` produces result `r<i>.txt` and consumes up to `fanin`
+    inputs, drawn from the datasources and from the results of the
+    `width` preceding steps. A small width gives deep chains of
+    dependent steps, a large width wide fan-out.
+
+    Args:
+        steps (int): number of workflow steps.
+        fanin (int): maximum number of inputs per step.
+        width (int): window of preceding steps whose results can be consumed.
+        datasources (int): number of datasource files.
+        seed (int): random seed, the same arguments give the same workflow.
+
+    Returns:
+        list of annotated commands.
+    """
+    rng = random.Random(seed)
+    commands = []
+    for i in range(steps):
+        inputs = set()
+        for _ in range(rng.randint(1,fanin)):
+            if i and rng.random() > .2:
+                inputs.add('==r{}.txt'.format(rng.randrange(max(0,i-width),i)))
+            else:
+                inputs.add('@@d{}.txt'.format(rng.randrange(datasources)))
+        commands.append(
+            ['@bench://tool@tool{}'.format(i % 7)] + sorted(inputs)
+            + ['%OUT%', '==r{}.txt'.format(i)]
+        )
+    return commands
+
+def generate(path,steps,fanin=3,width=100,datasources=10,seed=0):
+    """create a synthetic compendium
+
+    Args:
+        path (str): directory of the new compendium.
+        Other args are the same as for `workflow`.
+
+    Returns:
+        the `Reconto`.
+    """
+    reco = Reconto(path, init=True)
+    for d in range(datasources):
+        with open(os.path.join(path,'data','d{}.txt'.format(d)),'wt') as f:
+            f.write('datasource {}\n'.format(d))
+    reco.add_many(workflow(steps,fanin,width,datasources,seed))
+    return reco
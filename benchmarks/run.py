@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""run the reconto benchmarks
+
+Measures the startup time of the reconto CLI and, for synthetic
+compendia of each requested size, the time of loading a compendium
+(with and without the plan cache), parsing its yaml, compiling its plan,
+adding steps through the API and the CLI, and building it with a fake
+execution environment. Results are written as json, and can be
+compared against an earlier run to catch regressions:
+
+    python benchmarks/run.py --sizes 10 1000 10000 -o baseline.json
+    python benchmarks/run.py --sizes 10 1000 10000 --compare baseline.json
+"""
+import os, sys, json, time, shutil, argparse, platform, statistics, subprocess, tempfile
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from compendia import generate, workflow, fake_exenv
+from reconto import Reconto
+from reconto.plan import Plan, load_yaml
+
+def measure(function,repeat=3,setup=None):
+    """seconds taken by each of `repeat` calls of function
+
+    Args:
+        function (callable): the benchmarked function.
+        repeat (int): number of measurements.
+        setup (callable): called before each measurement, untimed.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup: setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter()-start)
+    return times
+
+#: modules the CLI should only import in the subcommands that need them
+HEAVY_MODULES = ('git', 'yaml', 'docker', 'plumbum')
+
+def cli(*args, cwd=None):
+    """run the reconto CLI in a new interpreter"""
+    subprocess.run(
+        [sys.executable, '-c', 'import sys; from reconto.__main__ import main; main()']
+        + list(args), cwd=cwd, check=True, stdout=subprocess.DEVNULL,
+        env=dict(os.environ, PYTHONPATH=ROOT)
+    )
+
+def benchmark_startup(args):
+    """interpreter startup, importing the CLI, and `reconto --help`
+
+    Returns:
+        dict mapping benchmark names to their measured times, and the
+        heavy modules importing the CLI loaded.
+    """
+    results = {
+        'python': measure(
+            lambda: subprocess.run([sys.executable, '-c', 'pass'], check=True),
+            args.repeat
+        ),
+        'cli_import': measure(
+            lambda: subprocess.run(
+                [sys.executable, '-c', 'import reconto.__main__'], check=True,
+                env=dict(os.environ, PYTHONPATH=ROOT)
+            ), args.repeat
+        ),
+        'cli_help': measure(lambda: cli('--help'), args.repeat)
+    }
+    loaded = subprocess.run(
+        [sys.executable, '-c', 'import sys, reconto.__main__; print(*sys.modules)'],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True,
+        env=dict(os.environ, PYTHONPATH=ROOT)
+    ).stdout.split()
+    return results, [m for m in HEAVY_MODULES if m in loaded]
+
+def benchmark_size(directory,steps,args):
+    """run all benchmarks on a synthetic compendium of `steps` steps
+
+    Returns:
+        dict mapping benchmark names to their measured times.
+    """
+    path = os.path.join(directory,'compendium-{}'.format(steps))
+    shape = dict(fanin=args.fanin, width=args.width, datasources=args.datasources, seed=args.seed)
+    results = {}
+    start = time.perf_counter()
+    reco = generate(path,steps,**shape)
+    results['add_many'] = [time.perf_counter()-start]
+    with open(reco.yamlfile,'rb') as f:
+        source = f.read()
+    results['yaml_load'] = measure(lambda: load_yaml(source), args.repeat)
+    config = load_yaml(source)
+    results['plan_compile'] = measure(
+        lambda: Plan.compile(config['workflow']), args.repeat
+    )
+    results['init_uncached'] = measure(
+        lambda: Reconto(path), args.repeat,
+        setup=lambda: os.remove(Plan.cachefile(reco))
+    )
+    results['init'] = measure(lambda: Reconto(path), args.repeat)
+
+    # adding a few steps, each rewriting the yaml file, which is restored after
+    shutil.copyfile(reco.yamlfile, reco.yamlfile+'.orig')
+    reco = Reconto(path)
+    results['add'] = [
+        t for command in workflow(steps+args.adds,**shape)[steps:]
+        for t in measure(lambda: reco.add(command), 1)
+    ]
+    results['cli_add'] = [
+        t for command in workflow(steps+args.adds,**shape)[steps:]
+        for t in measure(lambda: cli('add', *command, cwd=path), 1)
+    ]
+    os.replace(reco.yamlfile+'.orig', reco.yamlfile)
+
+    with fake_exenv(args.latency):
+        reco = Reconto(path)
+        results['build'] = measure(
+            lambda: reco.build(jobs=args.jobs, cached=False), 1
+        )
+        results['build_cached'] = measure(
+            lambda: reco.build(jobs=args.jobs), args.repeat
+        )
+    shutil.rmtree(path)
+    return results
+
+def summarize(steps,name,times,args):
+    summary = {
+        'benchmark': name, 'steps': steps, 'repeat': len(times),
+        'min': min(times), 'median': statistics.median(times)
+    }
+    if name in ('add', 'cli_add'):
+        summary['per_step'] = statistics.median(times)
+    elif name in ('add_many', 'build_cached'):
+        summary['per_step'] = min(times)/steps
+    elif name == 'build':
+        # stays flat as the compendia grow, unless the build is superlinear
+        summary['per_step'] = min(times)/steps
+        # overhead beyond the fake execution latency, if steps would
+        # execute with no other limit than the number of jobs
+        summary['overhead_per_step'] = max(
+            0., min(times) - steps*args.latency/args.jobs
+        )/steps
+    return summary
+
+def compare(results,baseline,tolerance):
+    """list the benchmarks that became slower than the baseline
+
+    Args:
+        results (list): benchmark summaries.
+        baseline (list): benchmark summaries of an earlier run.
+        tolerance (float): allowed relative slowdown.
+    """
+    earlier = {(b['benchmark'],b['steps']): b for b in baseline}
+    regressions = []
+    for result in results:
+        before = earlier.get((result['benchmark'],result['steps']))
+        if before and result['min'] > before['min']*(1+tolerance):
+            regressions.append((result, before))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='reconto benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10,100,1000,10000],
+                        help='numbers of workflow steps of the synthetic compendia')
+    parser.add_argument('--fanin', type=int, default=3, help='maximum inputs per step')
+    parser.add_argument('--width', type=int, default=100,
+                        help='window of preceding steps whose results a step can consume')
+    parser.add_argument('--datasources', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--adds', type=int, default=10,
+                        help='steps added one by one to each compendium')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='seconds each fake step execution takes')
+    parser.add_argument('-j', '--jobs', type=int, default=4)
+    parser.add_argument('-o', '--output', help='json file to write the results to')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='json results of an earlier run, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=.25,
+                        help='allowed relative slowdown compared to the baseline')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='reconto-bench-')
+    results = []
+    startup, heavy = benchmark_startup(args)
+    for name,times in startup.items():
+        results.append(summarize(0,name,times,args))
+        print('{:>7} {:<14} {:>10.4f}s'.format(0,name,min(times)), file=sys.stderr)
+    if heavy:
+        print('importing the CLI loads', *heavy, file=sys.stderr)
+    try:
+        for steps in args.sizes:
+            for name,times in benchmark_size(directory,steps,args).items():
+                summary = summarize(steps,name,times,args)
+                results.append(summary)
+                print('{:>7} {:<14} {:>10.4f}s{}'.format(
+                    steps, name, min(times), '' if 'per_step' not in summary else
+                    ' {:>10.6f}s/step'.format(summary['per_step'])
+                ), file=sys.stderr)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'arguments': vars(args),
+        'cli_imports': heavy,
+        'results': results
+    }
+    if args.output:
+        with open(args.output,'wt') as f:
+            json.dump(report,f,indent=1)
+    else:
+        json.dump(report,sys.stdout,indent=1)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for result,before in regressions:
+            print('regression: {} ({} steps) {:.4f}s -> {:.4f}s'.format(
+                result['benchmark'], result['steps'], before['min'], result['min']
+            ), file=sys.stderr)
+        if regressions or heavy:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
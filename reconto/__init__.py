@@ -5,7 +5,7 @@ Basic module, describes the reconto start class
 that defines a research project.
 
 """
-import os, logging, git, yaml, re
+import os, re
 
 class Reconto(object):
     """Reconto object
@@ -18,44 +18,101 @@ class Reconto(object):
         self.path = path
         self.default_exenv = default_exenv
 
-        if os.path.exists(self.yamlfile):
-            self.repo = git.Repo(self.path)
-        elif not init:
-            raise FileNotFoundError('reconto repo does not yet exist')
-        else:
+        if not os.path.exists(self.yamlfile):
+            if not init:
+                raise FileNotFoundError('reconto repo does not yet exist')
             try:
                 os.mkdir(path)
                 for subdir in ('data','results','exenv'):
                     os.mkdir(os.path.join(path,subdir))
             except FileNotFoundError:
+                import logging
                 logging.error(
                     'Parent directory "%s" does not exist',
                     os.path.dirname(path)
                 )
                 raise
             # initialize git repo
-            self.repo = git.Repo.init(self.path)
+            import git
+            self._repo = git.Repo.init(self.path)
             import pkgutil
             with open(self.yamlfile,'wb') as f:
                 f.write(pkgutil.get_data('reconto','templates/reconto.yml'))
-            self.repo.index.add(['reconto.yml'])
+            # build caches and logs are local to the compendium checkout
+            with open(os.path.join(self.path,'.gitignore'),'wt') as f:
+                f.write('.reconto/\n')
+            self.repo.index.add(['reconto.yml','.gitignore'])
             self.repo.index.commit('reconto yaml file added')
             
-        # read reconto yaml configuration
-        self.config = yaml.load(open(self.yamlfile))
+        # read reconto yaml configuration, or its compiled plan if unchanged
+        from reconto.plan import Plan
+        from reconto.trace import NullTracer
+        self.config, self.plan = Plan.load(self)
+        self.tracer = NullTracer()
 
     @property
     def yamlfile(self):
         return os.path.join(self.path,'reconto.yml')
 
+    @property
+    def repo(self):
+        """git repository of the compendium"""
+        if not hasattr(self,'_repo'):
+            import git
+            self._repo = git.Repo(self.path)
+        return self._repo
+
+    @property
+    def cache(self):
+        """content-addressed step cache of the compendium"""
+        if not hasattr(self,'_cache'):
+            from reconto.cache import StepCache
+            self._cache = StepCache(self)
+        return self._cache
+
+    @property
+    def hasher(self):
+        """stat-cached content hasher of the compendium"""
+        if not hasattr(self,'_hasher'):
+            from reconto.hashing import Hasher
+            self._hasher = Hasher(
+                self.path, os.path.join(self.path,'.reconto','hashindex.json')
+            )
+        return self._hasher
+
+    @property
+    def store(self):
+        """machine-wide object store of step results, or None if not configured"""
+        if not hasattr(self,'_store'):
+            from reconto.store import ObjectStore
+            self._store = ObjectStore.configured()
+        return self._store
+
+    @property
+    def fetcher(self):
+        """concurrent retriever of the compendium datasources"""
+        if not hasattr(self,'_fetcher'):
+            from reconto.fetch import Fetcher
+            self._fetcher = Fetcher(self)
+        return self._fetcher
+
+    @property
+    def publisher(self):
+        """concurrent uploader of the compendium results"""
+        if not hasattr(self,'_publisher'):
+            from reconto.publish import Publisher
+            self._publisher = Publisher(self)
+        return self._publisher
+
     annotations = {
         'script': re.compile(r'@(?P<exenv>\S+)@(?P<script>\S+)'),
         'datasource': re.compile(r'@(?P<datasource>\S*)@(?P<filepath>\S+?)(?P<include>@?)'),
         'result': re.compile(r'=(?P<result>\S*)=(?P<filepath>\S+?)(?P<include>=?)'),
-        'special': {'%IN%':'<', '%OUT%':'>', '%PIPE%':'|'}
+        'wildcard': re.compile(r'\{(?P<wildcard>\w+)(?P<gather>\*?)\}'),
+        'special': {'%IN%':'<', '%OUT%':'>', '%PIPE%':'|', '%AND%':'&&'}
     }
         
-    def add(self, command, exenv=None, datasources = [], results = []):
+    def add(self, command, exenv=None, datasources = [], results = [], transient = []):
         """add a workflow command to the reconto yml file
         this does not commit the command yet to the workflow history.
 
@@ -78,6 +135,12 @@ class Reconto(object):
             %IN%: escape for shell redirection `<`
             %OUT%: escape for shell redirection `>`
             %PIPE%: escape for shell redirection '|'
+            %AND%: escape for shell command list `&&`
+            {[name]}: wildcard in a datasource or result filepath, the step is
+              expanded into one step per value of the wildcard when building,
+              e.g. `@@reads/{sample}.fq` and `==counts/{sample}.tsv`
+            {[name]*}: gathers a wildcard, the element is expanded into one element
+              per value, e.g. `==counts/{sample*}.tsv` to consume all counts
 
         Args:
             command (str or str list): The command that should be executed.
@@ -89,6 +152,9 @@ class Reconto(object):
             datasources (str list): List of datasourses used in the workflow step.
             results (str list): List of result files or directories generated 
               in workflow step.
+            transient (str list): Result filepaths that are only intermediates,
+              which `build` streams through a named pipe to the single step
+              consuming them instead of writing them to the results folder.
 
         When commandline is fully annotated, `exenv`, `datasources` and `results` do not 
         need to be provided. If the commandline is not fully annotated, the provided strings
@@ -96,6 +162,12 @@ class Reconto(object):
         positions in the commandline. If both are provided, consistency is checked and function
         raises Exception when inconsistent.
         """
+        self.add_step(command, exenv, datasources, results, transient)
+        self.write_config()
+
+    def add_step(self, command, exenv=None, datasources = [], results = [], transient = []):
+        """add a workflow command to the configuration without writing
+        the reconto yml file, arguments are the same as for `add`"""
         # Normalizing command
         command = command.split() if type(command) is str else list(command)
         
@@ -113,24 +185,25 @@ class Reconto(object):
                 print(exenv)
             if not exenv:
                 raise Exception('no exenv provided and no default available')
-        if exenv not in self.config['exenv']:
-            self.config['exenv'].append(exenv)
-        cmdenv = [script_annot['script'] if script_annot else command[0],exenv]
-        if cmdenv not in self.config['scripts']:
-            self.config['scripts'].append(cmdenv)
+        self.register('exenv',exenv)
+        self.register('scripts',[script_annot['script'] if script_annot else command[0],exenv])
         if not script_annot:
             command[0] = '@{}@{}'.format(exenv,command[0])
             
         # Setting datasources
-        extracted_dsources = [
-            Reconto.annotations['datasource'].fullmatch(e) for e in command[1:]
-            if Reconto.annotations['datasource'].fullmatch(e)
-        ]
+        extracted_dsources, extracted_results = [], []
+        for e in command[1:]:
+            annot = Reconto.annotations['datasource'].fullmatch(e)
+            if annot:
+                extracted_dsources.append(annot)
+                continue
+            annot = Reconto.annotations['result'].fullmatch(e)
+            if annot:
+                extracted_results.append(annot)
         if extracted_dsources:
             eds_strings = [eds.string for eds in extracted_dsources]
             for eds in eds_strings:
-                if not eds in self.config['data']:
-                    self.config['data'].append(eds)
+                self.register('data',eds)
             if datasources and not (set(datasources) == set(eds_strings)):
                 raise Exception(
                     "annotated datasources and provided datasources inconsistent",
@@ -144,19 +217,13 @@ class Reconto(object):
                     if not i: continue
                     if ds_annot['filepath'] == cle:
                         command[i] = ds
-                if not ds in self.config['data']:
-                    self.config['data'].append(ds)
+                self.register('data',ds)
 
         # Setting results
-        extracted_results = [
-            Reconto.annotations['result'].fullmatch(e) for e in command[1:]
-            if Reconto.annotations['result'].fullmatch(e)
-        ]
         if extracted_results:
             er_strings = [er.string for er in extracted_results]
             for er in er_strings:
-                if not er in self.config['results']:
-                    self.config['results'].append(er)
+                self.register('results',er)
             if results and not (set(results) == set(er_strings)):
                 raise Exception(
                     "annotated results and provided results inconsistent",
@@ -170,96 +237,1162 @@ class Reconto(object):
                     if not i: continue
                     if r_annot['filepath'] == cle:
                         command[i] = r
-                if not r in self.config['results']:
-                    self.config['results'].append(r)
+                self.register('results',r)
 
-        # Output updated workflow
+        # Update workflow
         self.config['workflow'].append(command)
-        with open(self.yamlfile,'wt') as f:
-            yaml.dump(self.config,f)
+        step = self.plan.append(command)
+        self._expanded = None
+        for filepath in transient:
+            if filepath not in step.produces:
+                raise Exception('transient result not produced by step', filepath)
+            if filepath not in self.config.setdefault('transient',[]):
+                self.config['transient'].append(filepath)
+
+    def add_many(self, commands, exenv=None):
+        """add several workflow commands to the reconto yml file,
+        which is only written once after all commands have been added
+
+        Args:
+            commands (iterable): the commands, each as accepted by `add`,
+              or a dict with keyword arguments for `add`.
+            exenv (str): The execution environment for commands that do not
+              annotate or provide one.
+        """
+        for command in commands:
+            if isinstance(command,dict):
+                self.add_step(**dict({'exenv': exenv}, **command))
+            else:
+                self.add_step(command, exenv)
+        self.write_config()
+
+    @property
+    def streams(self):
+        """transient results streamed between the steps being built,
+        see `Plan.streams`"""
+        plan = self.expanded
+        transient = tuple(self.config.get('transient') or ())
+        key = (id(plan), plan.digest, len(plan), transient)
+        if getattr(self,'_streams',(None,))[0] != key:
+            if plan is not self.plan:
+                from reconto.plan import wildcard_pattern
+                patterns = [wildcard_pattern(filepath) for filepath in transient]
+                transient = tuple(
+                    filepath for filepath in plan.producers
+                    if any(pattern.fullmatch(filepath) for pattern in patterns)
+                )
+            self._streams = (key, plan.streams(transient))
+        return self._streams[1]
+
+    @property
+    def expanded(self):
+        """the plan of the steps being built, with the scatter steps
+        expanded by the last `expand`"""
+        expanded = getattr(self,'_expanded',None)
+        return self.plan if expanded is None else expanded
+
+    def expand(self):
+        """expand the scatter steps of the workflow for building them,
+        see `Plan.expand` and `wildcard_values`
+
+        Returns:
+            the expanded `Plan`, and a dict mapping each workflow step index
+            to the indices of the steps it expanded into.
+        """
+        plan, expansions = self.plan.expand(self.wildcard_values())
+        self._expanded = plan
+        return plan, expansions
+
+    def wildcard_values(self):
+        """values of the wildcards of the workflow
+
+        Declared in the `wildcards` section of `reconto.yml`, e.g.:
+
+            wildcards:
+              sample: [s1, s2, s3]
+
+        or otherwise the names of the data files and folders matching the
+        datasources with the wildcard, e.g. `@@reads/{sample}.fq`.
+
+        Returns:
+            dict mapping each wildcard name to its values, in sorted order
+            if they were matched.
+        """
+        from reconto.plan import wildcard_pattern
+        declared = self.config.get('wildcards') or {}
+        datadir = os.path.join(self.path,'data')
+        values = {}
+        for name in self.plan.wildcards:
+            if name in declared:
+                values[name] = [str(value) for value in declared[name]]
+                continue
+            matched = set()
+            for filepath in self.plan.datasources:
+                pattern = wildcard_pattern(filepath)
+                if name not in pattern.groupindex:
+                    continue
+                top = os.path.dirname(filepath[:filepath.index('{')])
+                for root,dirs,files in os.walk(os.path.join(datadir,top)):
+                    for entry in dirs + files:
+                        match = pattern.fullmatch(
+                            os.path.relpath(os.path.join(root,entry),datadir)
+                        )
+                        if match:
+                            matched.add(match.group(name))
+            if not matched:
+                raise ValueError('no values for wildcard', name)
+            values[name] = sorted(matched)
+        return values
+
+    def environments(self):
+        """uids of the execution environments of the compendium, from
+        the `exenv` and `scripts` sections"""
+        exenvs = self.config.get('exenv') or []
+        exenvs = [exenvs] if isinstance(exenvs,str) else list(exenvs)
+        for script in self.config.get('scripts') or ():
+            if isinstance(script,list) and len(script) > 1 and script[1] not in exenvs:
+                exenvs.append(script[1])
+        return exenvs
+
+    def prepare(self,workers=4,docker_client=None):
+        """prepare all execution environments of the compendium concurrently,
+        e.g. pulling docker images and creating python virtualenvs, reporting
+        each as it is prepared
+
+        Args:
+            workers (int): maximum number of environments prepared at once.
+            docker_client: docker client to use instead of `docker.from_env()`
+
+        Returns:
+            dict mapping the uids of the environments that could not be
+            prepared to their exception.
+        """
+        import time
+        from concurrent.futures import as_completed
+        from reconto.exenv import ExenvPool
+        failed, start = {}, time.time()
+        with ExenvPool(self,pooled=False,client=docker_client) as pool:
+            futures = pool.warm_up(self.environments(),workers)
+            uids = {future: uid for uid,future in futures.items()}
+            for k,future in enumerate(as_completed(uids),1):
+                uid = uids[future]
+                if future.exception() is not None:
+                    failed[uid] = future.exception()
+                print('[{}/{}] {:.1f}s {} {}'.format(
+                    k, len(uids), time.time()-start, uid,
+                    'failed: {}'.format(failed[uid]) if uid in failed else 'ready'
+                ), flush=True)
+        self.hasher.save()
+        return failed
+
+    def publish(self,targets=None,workers=4):
+        """upload the annotated results of the workflow to their external
+        locations concurrently, skipping those the remote already has,
+        reporting each as it is published
+
+        Args:
+            targets (str list): If provided, only these result filepaths are published,
+              relative to the results folder or prefixed with `results/`.
+            workers (int): maximum number of concurrent uploads.
+
+        Returns:
+            dict mapping the locations of the results that could not be published
+            to their exception, or to None for missing results.
+
+        Raises an Exception for targets that are not annotated results.
+        """
+        from concurrent.futures import as_completed
+        from reconto.fetch import Fetcher
+        plan = self.expand()[0]
+        if targets is not None:
+            annotated = {
+                filepath for step in plan for _,result,filepath,include in step.results
+                if result and filepath in step.produces
+            }
+            selected = set()
+            for target in targets:
+                filepath = os.path.normpath(target)
+                if filepath not in annotated and filepath.startswith('results'+os.sep):
+                    filepath = filepath[len('results'+os.sep):]
+                if filepath not in annotated:
+                    raise Exception('no annotated result matches target', target)
+                selected.add(filepath)
+            targets = selected
+        self.publisher.workers = workers
+        failed, futures = {}, {}
+        try:
+            for step in plan:
+                for _,result,filepath,include in step.results:
+                    if not result or filepath not in step.produces or (
+                            targets is not None and filepath not in targets
+                    ):
+                        continue
+                    if not os.path.exists(os.path.join(self.path,'results',filepath)):
+                        location = Fetcher.location(result,filepath,include)
+                        failed[location] = None
+                        print('missing', location)
+                        continue
+                    futures.update(self.publisher.publish(result,filepath,include))
+            locations = {future: location for location,future in futures.items()}
+            for future in as_completed(locations):
+                if future.exception() is not None:
+                    failed[locations[future]] = future.exception()
+                    print('failed', locations[future], future.exception(), flush=True)
+                else:
+                    print(future.result(), locations[future], flush=True)
+        finally:
+            self.publisher.close()
+            self.hasher.save()
+        return failed
+
+    @property
+    def sections(self):
+        """set indexes over the configuration sections, for
+        constant time membership checks when adding steps"""
+        if not hasattr(self,'_sections'):
+            self._sections = {
+                section: {
+                    tuple(e) if isinstance(e,list) else e
+                    for e in self.config[section]
+                } for section in ('exenv','data','scripts','results')
+            }
+        return self._sections
+
+    def register(self,section,entry):
+        """add an entry to a configuration section if it is not yet present
+
+        Args:
+            section (str): 'exenv', 'data', 'scripts' or 'results'.
+            entry (str or str list): the entry.
+        """
+        key = tuple(entry) if isinstance(entry,list) else entry
+        if key not in self.sections[section]:
+            self.sections[section].add(key)
+            self.config[section].append(entry)
+
+    def write_config(self):
+        """atomically write the configuration to the reconto yml file,
+        and update the cached plan to match it"""
+        import hashlib, tempfile
+        from reconto.plan import Plan, dump_yaml
+        source = dump_yaml(self.config).encode()
+        fd, tmpfile = tempfile.mkstemp(dir=self.path, prefix='.reconto.yml.')
+        with os.fdopen(fd,'wb') as f:
+            f.write(source)
+        os.chmod(tmpfile, os.stat(self.yamlfile).st_mode & 0o777)
+        os.replace(tmpfile,self.yamlfile)
+        self.plan.digest = hashlib.sha256(source).hexdigest()
+        Plan.save(self,self.config,self.plan)
             
-    def build(self,cached=True):
+    def build(self,cached=True,jobs=1,keep_going=False,pooled=False,docker_client=None,
+              timeout=None,targets=None,dry_run=False,steps=None,cancel=None,
+              capacity=None,workers=None,publish=False):
         """build the workflow
 
+        Steps are executed as soon as the steps producing the results they
+        consume have finished and their execution environment is prepared,
+        independent steps run concurrently. All execution environments are
+        prepared concurrently when the build starts, see `ExenvPool.warm_up`. Steps
+        connected by streamed transient results run together as one pipeline.
+        The output of each step is streamed to `.reconto/logs/<step index>.log`,
+        and the timing of each step phase is traced to `.reconto/traces/`.
+
+        Args:
+            cached (bool): If True, does not reexecute earlier build steps whose command,
+              exenv and inputs did not change
+            jobs (int): Maximum number of steps executing concurrently
+            keep_going (bool): If True, keep building steps that do not depend on
+              a failed step, otherwise stop starting new steps after the first failure
+            pooled (bool): If True, docker steps are executed in one warm container
+              per exenv instead of a new container per step
+            docker_client: docker client to use instead of `docker.from_env()`
+            timeout (float): Seconds after which a step gets killed and fails
+            targets (str list): If provided, only the steps needed to produce these
+              result filepaths are built
+            dry_run (bool): If True, only print the steps that would be built,
+              with their cache status
+            steps (set): If provided, only the steps with these indices are built
+            cancel (threading.Event): When set from another thread, the running
+              steps are killed and the build raises RuntimeError
+            capacity (Resources): cpus and memory the steps declaring resources
+              are packed in, defaults to the machine's
+            workers (str list): addresses of `reconto worker`s to execute the steps
+              on instead of locally, `jobs` and `capacity` then default to their
+              total. Steps connected by streamed results still execute locally
+            publish (bool): If True, the annotated results of each executed step are
+              uploaded to their locations while the build goes on, see `publish`
+
+        Scatter steps are expanded into one step per wildcard value, see
+        `expand`. Expanded steps are numbered after their position in the
+        expanded workflow, and with a `batch` size declared, executed by
+        batches of one command each.
+
+        Returns:
+            dict mapping the built step indices to their `ExecResult`, or None
+            for cached steps. For a dry run, the status of each step.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from reconto.exenv import ExenvPool
+        from reconto.scheduler import Scheduler
+        from reconto.trace import Tracer
+        plan, expansions = self.expand()
+        selection = {e for i in steps for e in expansions[i]} if steps is not None else (
+            plan.closure(targets) if targets else set(range(len(plan)))
+        )
+        steps = plan
+        if dry_run:
+            return self.dry_run(selection,cached,docker_client)
+        self.cache, self.hasher # loaded before steps are built concurrently
+        self.tracer = tracer = Tracer()
+        buildspan = tracer.span('build', jobs=jobs)
+        for i in selection:
+            tracer.add_step(steps[i])
+        hashed, fetched = dict(self.hasher.stats), dict(self.fetcher.stats)
+        published = dict(self.publisher.stats) if publish else {}
+        # missing datasources are retrieved while the first steps execute
+        self.fetcher.fetch_missing(steps[i] for i in sorted(selection))
+        os.makedirs(os.path.join(self.path,'.reconto','logs'), exist_ok=True)
+        logfile = lambda i: os.path.join(self.path,'.reconto','logs','{}.log'.format(i))
+        self.cancelled, self.executions = cancel, set()
+        self.publishing = publish
+        coordinator = None
+        try:
+            if workers:
+                from reconto.worker import Coordinator
+                coordinator = Coordinator(self,workers)
+                jobs, capacity = coordinator.jobs, capacity or coordinator.capacity
+            pipelines = steps.pipelines(self.streams,selection)
+            batches = {} if coordinator is not None else self.batches(selection,pipelines)
+            resources = {i: self.step_resources(steps[i]) for i in selection}
+            for i,members in pipelines.items():
+                for m in members[1:]:
+                    resources[i] += resources.pop(m)
+            for i,members in batches.items(): # executed one after the other
+                for m in members[1:]:
+                    resources.pop(m)
+            scheduler = Scheduler(
+                steps.dependencies(selection,{**pipelines,**batches}), jobs=jobs,
+                keep_going=keep_going,
+                resources={i: r for i,r in resources.items() if any(r)}, capacity=capacity
+            )
+            # the processes of a pipeline run together, as one scheduled job
+            processes = scheduler.jobs + sum(len(m)-1 for m in pipelines.values())
+            with ExenvPool(self,pooled=pooled,client=docker_client,processes=processes) as pool, \
+                 ThreadPoolExecutor(max_workers=scheduler.jobs) as executor:
+                # steps start as soon as their environments are prepared
+                nodes = {**pipelines, **batches}
+                warmup = {} if coordinator is not None else pool.warm_up(
+                    {steps[i].exenv for i in selection}
+                )
+                results = scheduler.run(
+                    lambda i: self.submit_pipeline(
+                        [steps[m] for m in pipelines[i]], executor, cached, pool,
+                        timeout, [logfile(m) for m in pipelines[i]]
+                    ) if i in pipelines else self.submit_batch(
+                        [steps[m] for m in batches[i]], executor, cached, pool,
+                        timeout, logfile(i)
+                    ) if i in batches else self.submit_step(
+                        steps[i], executor, cached, pool, timeout, logfile(i), coordinator
+                    ),
+                    cancel = cancel,
+                    on_cancel = lambda: [e.cancel() for e in list(self.executions)],
+                    waiting = lambda i: [
+                        warmup[steps[m].exenv] for m in nodes.get(i,(i,))
+                        if steps[m].exenv in warmup
+                    ]
+                )
+                for i in list(pipelines) + list(batches):
+                    results.update(results.pop(i))
+                if publish:
+                    self.publisher.wait()
+                return results
+        finally:
+            if coordinator is not None:
+                coordinator.close()
+            if tracer.counters.get('steps_stored') and self.store.size:
+                self.store.gc()
+            self.publishing = False
+            self.fetcher.close()
+            if hasattr(self,'_publisher'):
+                self.publisher.close()
+            self.cache.save()
+            self.hasher.save()
+            buildspan.end()
+            for counter,value in self.hasher.stats.items():
+                tracer.count('hash_'+counter, value-hashed[counter])
+            for counter,value in self.fetcher.stats.items():
+                tracer.count(counter, value-fetched[counter])
+            for counter,value in published.items():
+                tracer.count(counter, self.publisher.stats[counter]-value)
+            tracer.save(os.path.join(self.path,'.reconto','traces'))
+
+    def step_resources(self,step):
+        """cpus and memory a workflow step declares it needs
+
+        Declared in the `resources` section of `reconto.yml`, for one of the
+        results the step produces, for its exenv, or as `default`, e.g.:
+
+            resources:
+              default: {cpus: 1}
+              docker://aligner: {cpus: 8, memory: 16g}
+              counts.tsv: {memory: 512m}
+
+        The declaration for a result completes the one for the exenv, which
+        completes the default.
+
+        Args:
+            step (Step): compiled workflow step.
+
+        Returns:
+            the `Resources`, 0 for what is not declared.
+        """
+        from reconto.scheduler import Resources
+        declared = self.config.get('resources') or {}
+        resources = Resources.parse(declared.get('default') or {})
+        resources = Resources.parse(declared.get(step.exenv) or {}, resources)
+        for filepath in self.step_template(step).produces:
+            if filepath in declared:
+                resources = Resources.parse(declared[filepath], resources)
+        return resources
+
+    def step_template(self,step):
+        """the workflow step a step was expanded from, or the step itself"""
+        return step if step.template is None else self.plan[step.template]
+
+    def step_batch(self,step):
+        """number of expansions of a scatter step to execute as one command
+
+        Declared in the `batch` section of `reconto.yml`, like the resources,
+        for one of the results the step produces, for its exenv, or as
+        `default`, e.g. to amortize the start of a container over many tiny
+        steps:
+
+            batch:
+              docker://tools: 50
+
+        Args:
+            step (Step): compiled workflow step.
+        """
+        declared = self.config.get('batch') or {}
+        size = declared.get(step.exenv, declared.get('default',1))
+        for filepath in step.produces:
+            size = declared.get(filepath,size)
+        return max(1,int(size))
+
+    def batches(self,selection,pipelines=None):
+        """group the selected expansions of each scatter step into batches
+
+        Args:
+            selection (set): indices of the expanded steps being built.
+            pipelines (dict): as returned by `Plan.pipelines`, their steps are
+              not batched.
+
+        Returns:
+            dict mapping the first step of each batch to its sorted step indices.
+        """
+        if not self.config.get('batch'):
+            return {}
+        plan = self.expanded
+        piped = {m for members in (pipelines or {}).values() for m in members}
+        scattered = {}
+        for i in sorted(selection):
+            if plan[i].template is not None and i not in piped:
+                scattered.setdefault(plan[i].template,[]).append(i)
+        batches = {}
+        for template,members in scattered.items():
+            size = self.step_batch(self.plan[template])
+            for k in range(0,len(members),size):
+                if len(members[k:k+size]) > 1:
+                    batches[members[k]] = members[k:k+size]
+        return batches
+
+    def dry_run(self,selection,cached=True,docker_client=None):
+        """print the plan of a build without executing it
+
+        Each step is reported as a cache `hit`, a `restore` from the object
+        store, a `miss`, or a miss because of a `missing` input or an upstream miss.
+        Docker images are not pulled, steps whose image is not available
+        locally are reported as a `miss`.
+
+        Args:
+            selection (set): indices of the steps that would be built.
+            cached (bool): If False, all steps are reported as misses.
+            docker_client: docker client to use instead of `docker.from_env()`
+
+        Returns:
+            dict mapping the step indices to their status.
+        """
+        from reconto.exenv import ExenvPool
+        status, restored = {}, {}
+        with ExenvPool(self,pooled=False,client=docker_client,pull=False) as pool:
+            for i in sorted(selection):
+                step = self.expanded[i]
+                if not cached:
+                    status[i] = 'miss'
+                elif any(status[d] not in ('hit','restore') for d in step.dependencies):
+                    status[i] = 'upstream'
+                else:
+                    status[i] = self.step_status(step,pool,restored)
+                print('{:>5} {:<8} {}'.format(i,status[i],' '.join(step.annotated)))
+        self.hasher.save()
+        return status
+
+    def step_status(self,step,pool,restored):
+        """cache status of a step whose upstream steps are cached, see `dry_run`
+
+        Args:
+            step (Step): compiled workflow step.
+            pool (ExenvPool): exenv state of the dry run, not pulling images.
+            restored (dict): digests of the results the steps reported as
+              `restore` would restore, updated with those of this step.
+        """
+        try:
+            fingerprint = self.step_fingerprint(
+                step, pool.get_env(step.exenv), fetch=False, known=restored
+            )
+        except LookupError: # image not pulled, its digest is not known
+            return 'miss'
+        if fingerprint is None:
+            return 'missing'
+        if self.cache.hit(fingerprint,step.produces):
+            return 'hit'
+        if self.store is not None and self.store.has(fingerprint,step.produces):
+            restored.update(self.store.get(fingerprint)['digests'])
+            return 'restore'
+        return 'miss'
+
+    def prepare_step(self,step,cached=True,pool=None):
+        """prepare the execution of a parsed workflow step
+
         Args:
-            cached (bool): If True, does not reexecute earlier build steps
+            step (Step): compiled workflow step.
+            cached (bool): If True, the step is not prepared when a step with the same
+              fingerprint has been built before and its results are unaltered
+            pool (ExenvPool): exenv state shared during the build
+
+        Returns:
+            None if the step is cached, otherwise the step's exenv, the
+            command with its paths mapped in the exenv and the step fingerprint.
         """
         from reconto.exenv import Exenv
-        for step in self.config['workflow']:
-            env, command = Reconto.annotations['script'].fullmatch(step[0]).groups()
-            step[0] = command
-            exenv = Exenv.get_env(env,self)
-            datasources = {
-                i: Reconto.annotations['datasource'].fullmatch(se).groupdict()
-                for i,se in enumerate(step) if i and
-                Reconto.annotations['datasource'].fullmatch(se)
-            }
-            results = {
-                i: Reconto.annotations['result'].fullmatch(se).groupdict()
-                for i,se in enumerate(step) if i and
-                Reconto.annotations['result'].fullmatch(se)
-            }
-            for ds in datasources:
-                if not os.path.exists(
-                        os.path.join(self.path,'data',datasources[ds]['filepath'])
-                ):
-                    #TODO retrieve datasource
-                    raise FileNotFoundError('datasource not available',datasources[ds])
-                step[ds] = exenv.get_env_data_filepath(datasources[ds]['filepath'])
-            all_resultfiles_present = True
-            for r in results:
-                step[r] = exenv.get_env_result_filepath(results[r]['filepath'])
-                if not os.path.exists(
-                        os.path.join(self.path,'results',results[r]['filepath'])
-                ):
-                    all_resultfiles_present = False
-            if cached and all_resultfiles_present:
-                #TODO check if scriptfile has not changed
+        span = self.tracer.span('prepare', step.index)
+        exenv = Exenv.get_env(step.exenv,self,pool)
+        exenv.step = step.index
+        exenv.resources = self.step_resources(step)
+        command = self.step_command(step,exenv)
+        fingerprint = self.step_fingerprint(step,exenv)
+        if cached and self.cache.hit(fingerprint,step.produces):
+            span.end(cached=True)
+            self.tracer.count('steps_cached')
+            return None
+        if cached and self.restore_step(step,fingerprint):
+            span.end(cached=True, restored=True)
+            self.tracer.count('steps_restored')
+            return None
+        self.prepare_results(step)
+        span.end(cached=False)
+        return exenv, command, fingerprint
+
+    def prepare_results(self,step):
+        """prepare the results folder for the execution of a step: create the
+        folders of its results, and unshare the results linked to the object store"""
+        for filepath in step.produces:
+            path = os.path.join(self.path,'results',filepath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.store is not None:
+                from reconto.store import unshare
+                unshare(path)
+
+    def restore_step(self,step,fingerprint):
+        """restore the results of a step from the object store, if a step
+        with the same fingerprint was built before in any compendium
+
+        Args:
+            step (Step): compiled workflow step.
+            fingerprint (str): the step fingerprint.
+
+        Returns:
+            True if the results were restored.
+        """
+        if self.store is None:
+            return False
+        entry = self.store.restore(
+            fingerprint, os.path.join(self.path,'results'), step.produces, self.hasher
+        )
+        if entry is None:
+            return False
+        self.cache.record(
+            fingerprint, step.produces, entry['wall_time'], digests=entry['digests']
+        )
+        return True
+
+    def record_step(self,step,fingerprint,wall_time=None,streamed=()):
+        """record the results of a built step in the step cache, and in
+        the object store if it is configured and none were streamed
+
+        Args:
+            step (Step): compiled workflow step.
+            fingerprint (str): the step fingerprint.
+            wall_time (float): seconds the step execution took.
+            streamed (iterable): results the step streamed to their consumer.
+        """
+        entry = self.cache.record(fingerprint,step.produces,wall_time,streamed)
+        if self.store is None or streamed:
+            return
+        try:
+            with self.tracer.span('store', step.index):
+                self.store.put(
+                    fingerprint, os.path.join(self.path,'results'), entry['outputs'],
+                    self.hasher, wall_time
+                )
+            self.tracer.count('steps_stored')
+        except OSError as e:
+            import logging
+            logging.warning('results of step %s not stored: %s', step.index, e)
+
+    @staticmethod
+    def step_command(step,exenv):
+        """the command of a workflow step with its paths mapped in the exenv"""
+        command = list(step.command)
+        for i,datasource,filepath,include in step.datasources:
+            command[i] = exenv.get_env_data_filepath(filepath)
+        for i,result,filepath,include in step.results:
+            command[i] = exenv.get_env_result_filepath(filepath)
+        return command
+
+    def step_fingerprint(self,step,exenv,fetch=True,known=None):
+        """fingerprint of a workflow step for the step cache
+
+        Args:
+            step (Step): compiled workflow step.
+            exenv (Exenv): the step execution environment.
+            fetch (bool): see `input_digests`.
+            known (dict): see `input_digests`.
+
+        Returns:
+            the fingerprint, or None if an input is missing and `fetch` is False.
+        """
+        digests = self.input_digests(step,fetch,known)
+        if digests is None:
+            return None
+        for filepath in step.consumes:
+            if filepath in self.streams:
+                # a streamed result is never stored, it is identified by its producer
+                producer = self.expanded[self.streams[filepath][0]]
+                fingerprint = self.step_fingerprint(
+                    producer, exenv.pool.get_env(producer.exenv), fetch, known
+                )
+                if fingerprint is None:
+                    return None
+                digests['results/'+filepath] = 'stream:'+fingerprint
+        return self.cache.fingerprint(step.annotated, exenv.fingerprint(), digests)
+
+    def input_digests(self,step,fetch=True,known=None):
+        """content digests of the datasources, upstream results and, if it is
+        kept in the compendium, the script of a step
+
+        Args:
+            step (Step): compiled workflow step.
+            fetch (bool): If True, missing datasources are retrieved and missing
+              upstream results raise FileNotFoundError, otherwise None is returned
+              when an input is missing.
+            known (dict): digests of upstream results that are not yet in the
+              results folder, or that will be replaced, keyed by their filepath.
+
+        Returns:
+            dict mapping the inputs, prefixed by their folder, to their digests,
+            without the streamed results. The script is keyed by its path.
+        """
+        digests = {}
+        for i,datasource,filepath,include in step.datasources:
+            if fetch:
+                digests['data/'+filepath] = self.prepare_datasource(
+                    datasource,filepath,include
+                )
+            elif os.path.exists(os.path.join(self.path,'data',filepath)):
+                digests['data/'+filepath] = self.cache.hash_file('data',filepath)
+            else:
+                return None
+        script = os.path.join(self.path,step.command[0])
+        if os.path.isfile(script):
+            # scripts kept in the compendium are inputs as well
+            digests[os.path.normpath(step.command[0])] = self.hasher.hash(script)
+        for filepath in step.consumes:
+            if filepath in self.streams:
                 continue
-            with exenv:
-                exenv.execute_command(step)
-            # Check if all result files have been generated after executing step
-            #TODO exenv should also return exit code for checking
-            all_resultfiles_present = True
-            for r in results:
-                if not os.path.exists(
-                        os.path.join(self.path,'results',results[r]['filepath'])
-                ):
-                    all_resultfiles_present = False
-            if not all_resultfiles_present:
-                raise RuntimeError('workflow step has failed to produce all expected result files',step)
-
-    def commit(self,message):
+            if known and filepath in known:
+                digests['results/'+filepath] = known[filepath]
+                continue
+            if not os.path.exists(os.path.join(self.path,'results',filepath)):
+                if not fetch:
+                    return None
+                raise FileNotFoundError('upstream result not available',filepath)
+            digests['results/'+filepath] = self.cache.hash_file('results',filepath)
+        return digests
+
+    def finish_step(self,step,command,fingerprint,result,streamed=()):
+        """check the execution of a workflow step and record it in the step cache
+
+        Args:
+            step (Step): the compiled step.
+            command (str list): the executed command.
+            fingerprint (str): the step fingerprint.
+            result (ExecResult): the result of the execution.
+            streamed (iterable): results the step streamed to their consumer.
+
+        Returns:
+            the `ExecResult`.
+        """
+        span = self.tracer.span('check_result', step.index)
+        if result.log and os.path.exists(result.log):
+            self.tracer.count('log_bytes', os.path.getsize(result.log))
+        self.tracer.count('steps_executed')
+        if result.timed_out:
+            raise RuntimeError('workflow step timed out',command,result)
+        if result.exit_code:
+            raise RuntimeError('workflow step failed',command,result)
+        # Check if all result files have been generated after executing step
+        for filepath in step.produces:
+            if filepath in streamed:
+                continue
+            if not os.path.exists(os.path.join(self.path,'results',filepath)):
+                raise RuntimeError(
+                    'workflow step has failed to produce all expected result files',command
+                )
+        self.record_step(step,fingerprint,result.wall_time,streamed)
+        if getattr(self,'publishing',False):
+            self.publisher.publish_step(step,streamed)
+        span.end()
+        return result
+
+    def build_step(self,step,cached=True,pool=None,timeout=None,log=None):
+        """build a single parsed workflow step, waiting for its execution
+
+        Args:
+            step (Step): compiled workflow step.
+            cached (bool): If True, does not reexecute the step when a step with the same
+              fingerprint has been built before and its results are unaltered
+            pool (ExenvPool): exenv state shared during the build
+            timeout (float): seconds after which the step gets killed
+            log (str): file to stream the step output to
+
+        Returns:
+            the `ExecResult` of the step, or None if it was cached.
+        """
+        prepared = self.prepare_step(step,cached,pool)
+        if prepared is None:
+            return None
+        exenv, command, fingerprint = prepared
+        with self.tracer.span('load_environment', step.index):
+            exenv.load_environment()
+        try:
+            with self.tracer.span('execute_command', step.index) as span:
+                result = exenv.execute_command(command, log=log, timeout=timeout)
+                span.end(exit_code=result.exit_code)
+        finally:
+            with self.tracer.span('stop_environment', step.index):
+                exenv.stop_environment()
+        return self.finish_step(step,command,fingerprint,result)
+
+    def submit_step(self,step,executor,cached=True,pool=None,timeout=None,log=None,
+                    coordinator=None):
+        """start building a parsed workflow step without waiting on its execution
+
+        Preparing and checking the step run on `executor`, while the exenv
+        waits asynchronously on the execution itself.
+
+        Args:
+            executor (concurrent.futures.Executor): runs the step preparation and checks.
+            coordinator (Coordinator): if provided, the step is executed on a worker.
+            Other args are the same as for `build_step`.
+
+        Returns:
+            a `concurrent.futures.Future` resolving to the result of `build_step`.
+        """
+        from concurrent.futures import Future
+        future = Future()
+        tracer = self.tracer
+        def finish(exenv,command,fingerprint,execution):
+            try:
+                with tracer.span('stop_environment', step.index):
+                    exenv.stop_environment()
+                future.set_result(
+                    self.finish_step(step,command,fingerprint,execution.result())
+                )
+            except BaseException as e:
+                future.set_exception(e)
+        def start():
+            try:
+                prepared = self.prepare_step(step,cached,pool)
+                if prepared is None:
+                    future.set_result(None)
+                    return
+                exenv, command, fingerprint = prepared
+                if coordinator is not None:
+                    exenv = coordinator.exenv(step,exenv,fingerprint)
+                with tracer.span('load_environment', step.index):
+                    exenv.load_environment()
+                span = tracer.span('execute_command', step.index)
+                try:
+                    execution = exenv.submit_command(command, log=log, timeout=timeout)
+                except BaseException:
+                    exenv.stop_environment()
+                    raise
+                self.track(execution)
+                def done(execution):
+                    span.end()
+                    executor.submit(finish, exenv, command, fingerprint, execution)
+                execution.add_done_callback(done)
+            except BaseException as e:
+                future.set_exception(e)
+        executor.submit(start)
+        return future
+
+    def track(self,execution):
+        """keep track of a running step execution, to kill it when the
+        build gets cancelled"""
+        executions = getattr(self,'executions',None)
+        if executions is None:
+            return
+        executions.add(execution)
+        execution.add_done_callback(executions.discard)
+        if self.cancelled is not None and self.cancelled.is_set():
+            execution.cancel()
+
+    def submit_batch(self,steps,executor,cached=True,pool=None,timeout=None,log=None):
+        """start building expansions of a scatter step with one command,
+        their commands chained with `%AND%` in a single execution of their exenv
+
+        Each step is cached on its own, only the steps that are not cached
+        are executed. A batch fails as a whole when one of its commands fails.
+
+        Args:
+            steps (Step list): expanded steps of the same scatter step.
+            log (str): file to stream the output of the batch to.
+            Other args are the same as for `submit_step`.
+
+        Returns:
+            a `concurrent.futures.Future` resolving to a dict mapping the step
+            indices to their `ExecResult`, or None if they were cached.
+        """
+        from concurrent.futures import Future
+        future = Future()
+        tracer = self.tracer
+        def finish(exenv,prepared,execution,results):
+            try:
+                with tracer.span('stop_environment', prepared[0][0].index):
+                    exenv.stop_environment()
+                result = execution.result()
+                # the steps share the execution time
+                result = result._replace(wall_time=result.wall_time/len(prepared))
+                for step,(_,command,fingerprint) in prepared:
+                    results[step.index] = self.finish_step(step,command,fingerprint,result)
+                future.set_result(results)
+            except BaseException as e:
+                future.set_exception(e)
+        def start():
+            try:
+                results, prepared = {}, []
+                for step in steps:
+                    preparation = self.prepare_step(step,cached,pool)
+                    if preparation is None:
+                        results[step.index] = None
+                    else:
+                        prepared.append((step,preparation))
+                if not prepared:
+                    future.set_result(results)
+                    return
+                head, (exenv, _, _) = prepared[0]
+                command = []
+                for step,(_,stepcommand,_) in prepared:
+                    command += (['%AND%'] if command else []) + stepcommand
+                with tracer.span('load_environment', head.index):
+                    exenv.load_environment()
+                span = tracer.span('execute_command', head.index, batch=len(prepared))
+                try:
+                    execution = exenv.submit_command(command, log=log, timeout=timeout)
+                except BaseException:
+                    exenv.stop_environment()
+                    raise
+                self.track(execution)
+                def done(execution):
+                    span.end()
+                    executor.submit(finish, exenv, prepared, execution, results)
+                execution.add_done_callback(done)
+            except BaseException as e:
+                future.set_exception(e)
+        executor.submit(start)
+        return future
+
+    def submit_pipeline(self,steps,executor,cached=True,pool=None,timeout=None,logs=None):
+        """start building workflow steps connected by streamed results,
+        executing them all at the same time
+
+        The streamed results are named pipes in the results folder, removed
+        as soon as the step at either end exits, so that the other end is not
+        left blocking. The steps are cached together: if any of them has to
+        be executed, all are.
+
+        Args:
+            steps (Step list): compiled workflow steps, in workflow order.
+            logs (str list): files to stream the output of each step to.
+            Other args are the same as for `submit_step`.
+
+        Returns:
+            a `concurrent.futures.Future` resolving to a dict mapping the step
+            indices to their `ExecResult`, or None if they were cached.
+        """
+        import threading
+        from concurrent.futures import Future, wait
+        future = Future()
+        tracer = self.tracer
+        members = {step.index for step in steps}
+        streams = {
+            filepath: ends for filepath,ends in self.streams.items()
+            if ends[0] in members and ends[1] in members
+        }
+        fifo = lambda filepath: os.path.join(self.path,'results',filepath)
+        def release(step):
+            for filepath,(producer,consumer) in streams.items():
+                if step.index not in (producer,consumer):
+                    continue
+                try: # opening the other end unblocks a step waiting to open it
+                    fd = os.open(fifo(filepath), os.O_NONBLOCK | (
+                        os.O_WRONLY if step.index == producer else os.O_RDONLY
+                    ))
+                except OSError:
+                    fd = None
+                try:
+                    os.remove(fifo(filepath))
+                except FileNotFoundError:
+                    pass
+                if fd is not None:
+                    os.close(fd)
+        def finish(prepared,executions):
+            try:
+                for step,(exenv,command,fingerprint) in zip(steps,prepared):
+                    with tracer.span('stop_environment', step.index):
+                        exenv.stop_environment()
+                results = {
+                    step.index: execution.result() for step,execution in zip(steps,executions)
+                }
+                failed = {
+                    i: result for i,result in results.items()
+                    if result.timed_out or result.exit_code
+                }
+                if failed:
+                    raise RuntimeError('workflow pipeline failed',failed)
+                future.set_result({
+                    step.index: self.finish_step(
+                        step, command, fingerprint, results[step.index],
+                        [f for f,ends in streams.items() if ends[0] == step.index]
+                    ) for step,(exenv,command,fingerprint) in zip(steps,prepared)
+                })
+            except BaseException as e:
+                future.set_exception(e)
+        def start():
+            prepared, executions = [], []
+            try:
+                prepared = [self.prepare_step(step,cached,pool) for step in steps]
+                if all(p is None for p in prepared):
+                    future.set_result({step.index: None for step in steps})
+                    return
+                prepared = [
+                    p if p is not None else self.prepare_step(step,False,pool)
+                    for step,p in zip(steps,prepared)
+                ]
+                for filepath in streams:
+                    if os.path.lexists(fifo(filepath)):
+                        os.remove(fifo(filepath))
+                    os.mkfifo(fifo(filepath))
+                lock, running = threading.Lock(), [len(steps)]
+                def done(step,span):
+                    span.end()
+                    release(step)
+                    with lock:
+                        running[0] -= 1
+                        if not running[0]:
+                            executor.submit(finish, prepared, executions)
+                spans = []
+                for step,(exenv,command,fingerprint),log in zip(steps,prepared,logs):
+                    with tracer.span('load_environment', step.index):
+                        exenv.load_environment()
+                    spans.append(tracer.span('execute_command', step.index))
+                    try:
+                        execution = exenv.submit_command(command, log=log, timeout=timeout)
+                    except BaseException:
+                        exenv.stop_environment()
+                        raise
+                    executions.append(execution)
+                    self.track(execution)
+                # once all are started, so that the steps are only released on failure
+                for step,span,execution in zip(steps,spans,executions):
+                    execution.add_done_callback(
+                        lambda execution, step=step, span=span: done(step,span)
+                    )
+            except BaseException as e:
+                # let the started steps end, as their pipes are gone
+                for step in steps:
+                    release(step)
+                wait(executions)
+                for (exenv,command,fingerprint),execution in zip(prepared,executions):
+                    exenv.stop_environment()
+                future.set_exception(e)
+        executor.submit(start)
+        return future
+
+    def commit(self,message,jobs=1,keep_going=False,pooled=False,docker_client=None,
+               timeout=None):
         """commit new workflow steps to the research compendium
         if they properly execute. This step will take as much time
-        as is needed for the execution of the workflow steps to complete
+        as is needed for the execution of the new or changed workflow
+        steps, and the steps depending on them, to complete.
+
+        The fingerprint and execution time of each step are recorded
+        in `reconto.lock`, committed together with `reconto.yml`.
 
         Args:
             message (str): Commit message to include
+            Other args are the same as for `build`.
+
+        Returns:
+            the indices of the new or changed workflow steps.
         """
         # check if there are workflow changes compared to last commit
+        changed = self.workflow_changes()
 
-        # build the new steps
+        # build the new steps and their downstream steps
         # in a commit step it is not part of design to reexecute what has been committed earlier
-        self.build(cached=True)
+        selection = self.plan.downstream(changed)
+        if selection:
+            self.build(
+                cached=True, jobs=jobs, keep_going=keep_going, pooled=pooled,
+                docker_client=docker_client, timeout=timeout,
+                steps=self.plan.upstream(selection)
+            )
+        self.write_lock(selection,docker_client)
 
         # commit new workflow
+        self.repo.index.add(['reconto.yml','reconto.lock'])
+        if self.repo.head.is_valid() and not self.repo.index.diff('HEAD'):
+            print('nothing to commit')
+        else:
+            self.repo.index.commit(message)
+        return changed
+
+    def workflow_changes(self,rev='HEAD'):
+        """workflow steps that are new or changed compared to a commit
+
+        A step has changed if its command, its script execution environment,
+        or the location or checksum of one of its datasources changed.
+
+        Args:
+            rev (str): the git revision to compare with.
+
+        Returns:
+            set of step indices.
+        """
+        from reconto.plan import load_yaml
+        try:
+            committed = load_yaml(
+                self.repo.commit(rev).tree['reconto.yml'].data_stream.read()
+            )
+        except (ValueError, KeyError):
+            # no commit or no committed reconto.yml yet
+            return set(range(len(self.plan)))
+        steps = {tuple(step) for step in committed.get('workflow') or ()}
+        data = set(committed.get('data') or ())
+        scripts = {tuple(script) for script in committed.get('scripts') or ()}
+        checksums = committed.get('checksums') or {}
+        current_checksums = self.config.get('checksums') or {}
+        changed = set()
+        for step in self.plan:
+            if step.annotated not in steps or (step.command[0],step.exenv) not in scripts:
+                changed.add(step.index)
+            elif any(
+                step.annotated[i] not in data or
+                checksums.get(filepath) != current_checksums.get(filepath)
+                for i,_,filepath,_ in step.datasources
+            ):
+                changed.add(step.index)
+        return changed
+
+    @property
+    def lockfile(self):
+        return os.path.join(self.path,'reconto.lock')
+
+    def write_lock(self,selection,docker_client=None):
+        """update the fingerprints and execution times in `reconto.lock`
+
+        Args:
+            selection (set): indices of the workflow steps that have been (re)built,
+              the entries of the other steps are kept as they are. Scatter steps
+              have an entry per expansion.
+            docker_client: docker client to use instead of `docker.from_env()`
+        """
+        import json
+        from reconto.exenv import ExenvPool
+        try:
+            with open(self.lockfile) as f:
+                previous = json.load(f)
+        except FileNotFoundError:
+            previous = {}
+        lock = {}
+        plan, expansions = self.expand()
+        selection = {e for i in selection for e in expansions[i]}
+        with ExenvPool(self,pooled=False,client=docker_client) as pool:
+            for step in plan:
+                key = ' '.join(step.annotated)
+                if step.index not in selection and key in previous:
+                    lock[key] = previous[key]
+                    continue
+                fingerprint = self.step_fingerprint(step,pool.get_env(step.exenv))
+                entry = self.cache.get(fingerprint) or {}
+                lock[key] = {
+                    'fingerprint': fingerprint,
+                    'wall_time': entry.get('wall_time'),
+                    'outputs': entry.get('outputs',{})
+                }
+        self.hasher.save()
+        with open(self.lockfile,'wt') as f:
+            json.dump(lock,f,indent=1,sort_keys=True)
 
     def prepare_datasource(self,datasource,filepath,include):
-        # if include
-        datasource+=filepath
+        """make a datasource available in the reco data folder,
+        retrieving it from its external location if needed
+
+        Args:
+            datasource (str): external location of the datasource, can be empty.
+            filepath (str): relative path in the data folder.
+            include (str): if not empty, `filepath` completes the `datasource` location.
+
+        Returns:
+            the content digest of the datasource.
+        """
         # if no datasource but only filepath, file should already be available
         complete_filepath = os.path.join(self.path, 'data', filepath)
         source_present = os.path.exists(complete_filepath)
         if not source_present:
-            if datasource:
-                pass #TODO retrieve datasource logic, incorporate lostdata package
-            else:
-                raise FileNotFoundError('datasource not available in reco data folder')
+            if not datasource:
+                raise FileNotFoundError(
+                    'datasource not available in reco data folder', filepath
+                )
+            self.fetcher.fetch(datasource,filepath,include).result()
+        return self.hasher.hash(complete_filepath)
+
+    def check_result(self,result,filepath,include,digest=None):
+        """check if a result is present in the reco results folder
 
-    def check_result(self,result,filepath,include):
-        # if include
-        result+=filepath
+        Args:
+            result (str): external location of the result, can be empty.
+            filepath (str): relative path in the results folder.
+            include (str): if not empty, `filepath` completes the `result` location.
+            digest (str): if provided, the result content should also match this digest.
+        """
+        if include:
+            result+=filepath
         complete_filepath = os.path.join(self.path, 'results', filepath)
         source_present = os.path.exists(complete_filepath)
+        if source_present and digest:
+            return self.hasher.hash(complete_filepath) == digest
         return source_present
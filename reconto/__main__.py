@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
-"""reconto module defining CLI interface"""
+"""reconto module defining CLI interface
+
+Subcommands import the modules they need when they run, so that
+frequent invocations such as `reconto add` start fast.
+"""
 import argparse, os
 from reconto import Reconto
 
@@ -26,9 +30,13 @@ def prepareParser():
     )
     addparser.set_defaults(selectedparser='add')
     addparser.add_argument(
-        'command', nargs='+',
+        'command', nargs='*',
         help='command to execute in workflow'
     )
+    addparser.add_argument(
+        '--from', dest='fromfile', metavar='FILE',
+        help='add the commands listed in FILE (`-` for stdin), one per line, writing `reconto.yml` only once'
+    )
     addparser.add_argument(
         '--path',
         help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
@@ -45,18 +53,255 @@ def prepareParser():
         '--results',
         help='workflow step generated result files (can be one item or `,` separated list)'
     )
+    addparser.add_argument(
+        '--transient',
+        help='generated result files only used as input of one next step, streamed instead of written (can be one item or `,` separated list)'
+    )
+    buildparser = subparsers.add_parser(
+        'build',
+        help='reconto build -h'
+    )
+    buildparser.set_defaults(selectedparser='build')
+    buildparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    buildparser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of workflow steps to execute concurrently'
+    )
+    buildparser.add_argument(
+        '-k', '--keep-going', action='store_true',
+        help='keep executing steps that do not depend on a failed step'
+    )
+    buildparser.add_argument(
+        '--no-cache', dest='cached', action='store_false',
+        help='reexecute all steps, even if their results are present'
+    )
+    buildparser.add_argument(
+        '-t', '--target', dest='targets', action='append',
+        help='result to build, only its upstream steps are executed (can be repeated)'
+    )
+    buildparser.add_argument(
+        '-n', '--dry-run', action='store_true',
+        help='print the steps that would be built with their cache status'
+    )
+    buildparser.add_argument(
+        '--timeout', type=float,
+        help='seconds after which a workflow step gets killed'
+    )
+    buildparser.add_argument(
+        '--reuse-containers', dest='pooled', action='store_true',
+        help='execute docker steps in one warm container per exenv'
+    )
+    buildparser.add_argument(
+        '--cpus', type=float,
+        help='cores available to steps declaring resources, defaults to all cores'
+    )
+    buildparser.add_argument(
+        '--memory',
+        help='memory available to steps declaring resources (e.g. `16g`), defaults to all memory'
+    )
+    buildparser.add_argument(
+        '-w', '--worker', dest='workers', action='append', metavar='ADDRESS',
+        help='`host:port` or socket path of a `reconto worker` to execute steps on (can be repeated)'
+    )
+    buildparser.add_argument(
+        '--publish', action='store_true',
+        help='upload the annotated results of each executed step to their locations'
+    )
+    publishparser = subparsers.add_parser(
+        'publish',
+        help='reconto publish -h'
+    )
+    publishparser.set_defaults(selectedparser='publish')
+    publishparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    publishparser.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help='number of concurrent uploads'
+    )
+    publishparser.add_argument(
+        '-t', '--target', dest='targets', action='append',
+        help='result to publish, defaults to all annotated results (can be repeated)'
+    )
+    workerparser = subparsers.add_parser(
+        'worker',
+        help='reconto worker -h'
+    )
+    workerparser.set_defaults(selectedparser='worker')
+    workerparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    workerparser.add_argument(
+        '--listen', default='127.0.0.1:0', metavar='ADDRESS',
+        help='`host:port` or socket path to accept coordinating builds on, port 0 picks a free port'
+    )
+    workerparser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of workflow steps to execute concurrently'
+    )
+    workerparser.add_argument(
+        '--cpus', type=float,
+        help='cores offered to steps declaring resources, defaults to all cores'
+    )
+    workerparser.add_argument(
+        '--memory',
+        help='memory offered to steps declaring resources (e.g. `16g`), defaults to all memory'
+    )
+    workerparser.add_argument(
+        '--reuse-containers', dest='pooled', action='store_true',
+        help='execute docker steps in one warm container per exenv'
+    )
+    watchparser = subparsers.add_parser(
+        'watch',
+        help='reconto watch -h'
+    )
+    watchparser.set_defaults(selectedparser='watch')
+    watchparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    watchparser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of workflow steps to execute concurrently'
+    )
+    watchparser.add_argument(
+        '-k', '--keep-going', action='store_true',
+        help='keep building steps that do not depend on a failed step'
+    )
+    watchparser.add_argument(
+        '--timeout', type=float,
+        help='seconds after which a workflow step gets killed'
+    )
+    watchparser.add_argument(
+        '--debounce', type=float, default=.3,
+        help='seconds without file changes after which a rebuild starts'
+    )
+    watchparser.add_argument(
+        '--poll', action='store_true',
+        help='poll file stats instead of using inotify'
+    )
+    fetchparser = subparsers.add_parser(
+        'fetch',
+        help='reconto fetch -h'
+    )
+    fetchparser.set_defaults(selectedparser='fetch')
+    fetchparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    fetchparser.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help='number of concurrent downloads'
+    )
+    prepareparser = subparsers.add_parser(
+        'prepare',
+        help='reconto prepare -h'
+    )
+    prepareparser.set_defaults(selectedparser='prepare')
+    prepareparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    prepareparser.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help='number of execution environments prepared concurrently'
+    )
+    hashparser = subparsers.add_parser(
+        'hash',
+        help='reconto hash -h'
+    )
+    hashparser.set_defaults(selectedparser='hash')
+    hashparser.add_argument(
+        'paths', nargs='*',
+        help='files or directories to hash, defaults to the data and results folders'
+    )
+    hashparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    hashparser.add_argument(
+        '--stats', action='store_true',
+        help='report the number of files and bytes read versus skipped thanks to the hash index'
+    )
+    profileparser = subparsers.add_parser(
+        'profile',
+        help='reconto profile -h'
+    )
+    profileparser.set_defaults(selectedparser='profile')
+    profileparser.add_argument(
+        'trace', nargs='?',
+        help='build trace file, defaults to the trace of the last build'
+    )
+    profileparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    profileparser.add_argument(
+        '--top', type=int, default=10,
+        help='number of slowest steps to report'
+    )
+    profileparser.add_argument(
+        '--chrome', metavar='FILE',
+        help='export the trace as Chrome trace-event JSON to FILE'
+    )
+    cacheparser = subparsers.add_parser(
+        'cache',
+        help='reconto cache -h'
+    )
+    cacheparser.set_defaults(selectedparser='cache')
+    cacheparser.add_argument(
+        'action', choices=('gc','stats'),
+        help='`gc` evicts the least recently used objects of the machine-wide result store and removes incomplete entries, `stats` reports its size'
+    )
+    cacheparser.add_argument(
+        '--store',
+        help='object store directory, defaults to `RECONTO_STORE`'
+    )
+    cacheparser.add_argument(
+        '--size',
+        help='size to evict the store down to (e.g. `50g`), defaults to `RECONTO_STORE_SIZE`'
+    )
     commitparser = subparsers.add_parser(
         'commit',
         help='reconto commit -h'
     )
+    commitparser.set_defaults(selectedparser='commit')
     commitparser.add_argument(
         'msg',
-        help='commit message. A reconto commit executes a full (cached) workflow before commiting the changes to the git repo'
+        help='commit message. A reconto commit executes the new or changed workflow steps, and the steps depending on them, before commiting the changes to the git repo'
+    )
+    commitparser.add_argument(
+        '--path',
+        help='research compendium. if not provided takes current location, or first upstream location containing `reconto.yml`'
+    )
+    commitparser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of workflow steps to execute concurrently'
+    )
+    commitparser.add_argument(
+        '--timeout', type=float,
+        help='seconds after which a workflow step gets killed'
     )
     return parser
 
 def search_reco():
-    path = os.getcwd()
+    """path of the research compendium to work on
+
+    `RECONTO_PATH` if set in the environment, which spares generator
+    scripts invoking reconto many times the upstream search, otherwise the
+    current directory or the first upstream directory with a `reconto.yml`.
+    """
+    if os.environ.get('RECONTO_PATH'):
+        return os.environ['RECONTO_PATH']
+    return upstream_reco(os.getcwd())
+
+def upstream_reco(path):
+    """first directory from path upwards containing a `reconto.yml`"""
     while not os.path.exists(os.path.join(path,'reconto.yml')):
         if path == '/':
             raise FileNotFoundError(
@@ -65,24 +310,154 @@ def search_reco():
         path = os.path.dirname(path)
     return path
                 
+def parse_capacity(args):
+    """the `Resources` given with `--cpus` and `--memory`, completed with
+    the machine's, or None if neither is given"""
+    if not (args.cpus or args.memory):
+        return None
+    from reconto.scheduler import Resources
+    return Resources.parse(
+        {k: v for k,v in (('cpus',args.cpus),('memory',args.memory)) if v},
+        Resources.available()
+    )
+                
 def main(args=None):
     parser = prepareParser()
     args = parser.parse_args(args)
-    if args.selectedparser == 'new':
+    if not getattr(args,'selectedparser',None):
+        parser.print_help()
+    elif args.selectedparser == 'new':
         reco = Reconto(path = args.path, init = True)
         print(reco)
     elif args.selectedparser == 'add':
         if not args.path:
             args.path = search_reco()
         reco = Reconto(path = args.path)
+        if args.fromfile:
+            import sys
+            f = sys.stdin if args.fromfile == '-' else open(args.fromfile)
+            with f:
+                reco.add_many(
+                    (line.split() for line in f
+                     if line.strip() and not line.lstrip().startswith('#')),
+                    exenv = args.exenv
+                )
+            return
+        if not args.command:
+            parser.error('a command or --from is required')
         reco.add(
             command = args.command,
             exenv = args.exenv,
             datasources = args.datasources.split(',') if args.datasources else [],
-            results = args.results.split(',') if args.results else []
+            results = args.results.split(',') if args.results else [],
+            transient = args.transient.split(',') if args.transient else []
+        )
+    elif args.selectedparser == 'build':
+        if not args.path:
+            args.path = search_reco()
+        reco = Reconto(path = args.path)
+        reco.build(
+            cached = args.cached,
+            jobs = args.jobs,
+            keep_going = args.keep_going,
+            pooled = args.pooled,
+            timeout = args.timeout,
+            targets = args.targets,
+            dry_run = args.dry_run,
+            capacity = parse_capacity(args),
+            workers = args.workers,
+            publish = args.publish
+        )
+    elif args.selectedparser == 'worker':
+        from reconto.worker import Worker
+        if not args.path:
+            args.path = search_reco()
+        worker = Worker(
+            Reconto(path = args.path), jobs = args.jobs,
+            capacity = parse_capacity(args), pooled = args.pooled
+        )
+        import signal
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            worker.serve(args.listen, ready = lambda address: print(
+                'reconto worker listening on {}'.format(
+                    '{}:{}'.format(*address) if isinstance(address,tuple) else address
+                ), flush = True
+            ))
+        except KeyboardInterrupt:
+            pass
+    elif args.selectedparser == 'watch':
+        from reconto.watch import watch
+        if not args.path:
+            args.path = search_reco()
+        watch(
+            Reconto(path = args.path), debounce = args.debounce, poll = args.poll,
+            jobs = args.jobs, keep_going = args.keep_going, timeout = args.timeout
         )
+    elif args.selectedparser == 'fetch':
+        if not args.path:
+            args.path = search_reco()
+        reco = Reconto(path = args.path)
+        reco.fetcher.workers = args.jobs
+        for filepath,future in reco.fetcher.fetch_missing(reco.expand()[0]).items():
+            print(filepath, future.result())
+        reco.fetcher.close()
+    elif args.selectedparser == 'publish':
+        if not args.path:
+            args.path = search_reco()
+        reco = Reconto(path = args.path)
+        if reco.publish(targets = args.targets, workers = args.jobs):
+            parser.exit(1)
+    elif args.selectedparser == 'prepare':
+        if not args.path:
+            args.path = search_reco()
+        reco = Reconto(path = args.path)
+        if reco.prepare(workers = args.jobs):
+            parser.exit(1)
+    elif args.selectedparser == 'hash':
+        if not args.path:
+            args.path = search_reco()
+        reco = Reconto(path = args.path)
+        paths = args.paths or [
+            os.path.join(reco.path,'data'), os.path.join(reco.path,'results')
+        ]
+        for path,digest in reco.hasher.hash_many(paths).items():
+            print(digest, path)
+        reco.hasher.close()
+        if args.stats:
+            stats = reco.hasher.stats
+            print('files hashed: {files_hashed}, files skipped: {files_skipped}'.format(**stats))
+            print('bytes read: {bytes_read}, bytes skipped: {bytes_skipped}'.format(**stats))
+    elif args.selectedparser == 'profile':
+        import json
+        from reconto import trace
+        tracefile = args.trace
+        if not tracefile:
+            if not args.path:
+                args.path = search_reco()
+            tracefile = trace.latest_trace(os.path.join(args.path,'.reconto','traces'))
+        with open(tracefile) as f:
+            buildtrace = json.load(f)
+        trace.report(buildtrace, top = args.top)
+        if args.chrome:
+            with open(args.chrome,'wt') as f:
+                json.dump({'traceEvents': trace.chrome_events(buildtrace)}, f)
+    elif args.selectedparser == 'cache':
+        from reconto.store import ObjectStore
+        from reconto.scheduler import parse_size
+        store = ObjectStore.configured()
+        if args.store:
+            store = ObjectStore(args.store, store.size if store else 0)
+        if store is None:
+            parser.error('no object store, set RECONTO_STORE or use --store')
+        if args.action == 'gc':
+            removed = store.gc(parse_size(args.size) if args.size else None)
+            print('removed {objects} objects ({bytes} bytes) and {steps} step entries'.format(
+                **removed
+            ))
+        print('{steps} step entries, {objects} objects, {bytes} bytes'.format(**store.stats()))
     elif args.selectedparser == 'commit':
         if not args.path:
             args.path = search_reco()
         reco = Reconto(path = args.path)
-        reco.commit(args.message)
+        reco.commit(args.msg, jobs = args.jobs, timeout = args.timeout)
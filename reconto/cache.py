@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""cache: content-addressed workflow step cache
+
+A step is fingerprinted on its normalized command, its execution
+environment (uid and resolved image digest) and the content hashes of
+all its inputs (datasources and upstream results). The manifest stored
+under `.reconto/cache` maps fingerprints to the digests of the results
+the step produced, so a step is only reexecuted when something it
+depends on changed, or when its results were removed or altered.
+
+Recorded steps are appended to a journal next to the manifest, which
+is compacted into the manifest when the cache is saved at the end of
+a build.
+"""
+import os, json, hashlib, threading, tempfile
+
+class StepCache(object):
+    """StepCache object
+
+    Persistent manifest of successfully built workflow steps.
+
+    Args:
+        reco (Reconto): the research compendium whose steps are cached.
+    """
+    def __init__(self,reco):
+        self.reco = reco
+        self.cachedir = os.path.join(reco.path,'.reconto','cache')
+        self.manifestfile = os.path.join(self.cachedir,'manifest.json')
+        self.journalfile = os.path.join(self.cachedir,'journal.jsonl')
+        self.lock = threading.Lock()
+        self._journal = None
+        try:
+            with open(self.manifestfile) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+        try:
+            with open(self.journalfile) as f:
+                for line in f:
+                    try:
+                        fingerprint, entry = json.loads(line)
+                    except ValueError:
+                        break # torn last line of an interrupted build
+                    self.manifest[fingerprint] = entry
+        except FileNotFoundError:
+            pass
+
+    def hash_file(self,folder,filepath):
+        """content hash of a data or result file
+
+        Args:
+            folder (str): 'data' or 'results'
+            filepath (str): relative path in folder
+        """
+        return self.reco.hasher.hash(os.path.join(self.reco.path,folder,filepath))
+
+    @staticmethod
+    def fingerprint(command, exenv_fingerprint, input_digests):
+        """fingerprint of a workflow step
+
+        Args:
+            command (str list): the annotated workflow step.
+            exenv_fingerprint (str): identifies the resolved execution environment.
+            input_digests (dict): content digest for each input, keyed by its
+              folder relative path.
+        """
+        return hashlib.sha256(json.dumps(
+            [[e.strip() for e in command], exenv_fingerprint, sorted(input_digests.items())]
+        ).encode()).hexdigest()
+
+    def get(self,fingerprint):
+        """manifest entry of a built step, or None"""
+        with self.lock:
+            return self.manifest.get(fingerprint)
+
+    def hit(self,fingerprint,outputs):
+        """check if a step with `fingerprint` has been built and its
+        results are still present and unaltered
+
+        Args:
+            fingerprint (str): step fingerprint.
+            outputs (iterable): result filepaths the step produces.
+        """
+        with self.lock:
+            entry = self.manifest.get(fingerprint)
+        if entry is None or set(entry['outputs']) != set(outputs):
+            return False
+        for filepath,digest in entry['outputs'].items():
+            if digest is None:
+                continue # streamed, never written to the results
+            if not os.path.exists(os.path.join(self.reco.path,'results',filepath)):
+                return False
+            if self.hash_file('results',filepath) != digest:
+                return False
+        return True
+
+    def record(self,fingerprint,outputs,wall_time=None,streamed=(),digests=None):
+        """record a successfully built step
+
+        Args:
+            fingerprint (str): step fingerprint.
+            outputs (iterable): result filepaths the step produced.
+            wall_time (float): seconds the step execution took.
+            streamed (iterable): outputs that were streamed to their consumer,
+              recorded without digest.
+            digests (dict): known digests of the outputs, which are then not hashed.
+
+        Returns:
+            the recorded manifest entry.
+        """
+        digests = digests or {}
+        entry = {'outputs': {
+            filepath: None if filepath in streamed else
+            digests.get(filepath) or self.hash_file('results',filepath)
+            for filepath in outputs
+        }, 'wall_time': wall_time}
+        line = json.dumps([fingerprint,entry])+'\n'
+        with self.lock:
+            self.manifest[fingerprint] = entry
+            if self._journal is None:
+                os.makedirs(self.cachedir, exist_ok=True)
+                self._journal = open(self.journalfile,'at')
+            self._journal.write(line)
+            self._journal.flush()
+        return entry
+
+    def save(self):
+        """atomically write the manifest, compacting the journal into it"""
+        os.makedirs(self.cachedir, exist_ok=True)
+        with self.lock:
+            fd, tmpfile = tempfile.mkstemp(dir=self.cachedir, suffix='.tmp')
+            with os.fdopen(fd,'wt') as f:
+                json.dump(self.manifest,f)
+            os.replace(tmpfile,self.manifestfile)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.journalfile):
+                os.remove(self.journalfile)
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 """exenv: module defining the execution environment object
 
-Defines a python and a docker execution environment
-
-TODO: allow a way to register 3rd party execution environments
+Defines a local subprocess, a python and a docker execution environment.
+Execution environment types are registered by the type prefix of their
+uids, with `Exenv.register` or by 3rd party packages through the
+`reconto.exenvs` entry point group.
 """
-import abc, re, os
+import abc, re, os, math, threading, uuid
 
 class Exenv(abc.ABC):
     """Exenv object
@@ -18,21 +19,64 @@ class Exenv(abc.ABC):
     Args:
         uid (str): The string that uniquely identifies the execution environment.
         reco (Reconto): the research compendium that depends on this environment.
+        pool (ExenvPool): state shared by the exenvs of a build, if None the
+          exenv gets a private unpooled one.
     """
-    def __init__(self,uid,reco):
+    #: registered exenv classes, by the type prefix of their uids
+    types = {}
+
+    def __init__(self,uid,reco,pool=None):
         regex_attributes = self._uid_regex.fullmatch(uid).groupdict()
         for key in regex_attributes:
             setattr(self, key, regex_attributes[key])
+        self.envuid = uid
         self.reco = reco
+        self.step = None # index of the workflow step being executed, for tracing
+        self.resources = None # `Resources` declared by the step being executed
+        self.pool = pool if pool is not None else ExenvPool(reco,pooled=False)
+
+    def fingerprint(self):
+        """string that identifies the resolved execution environment,
+        used to fingerprint workflow steps for the step cache.
+        Inheriting Exenv's should extend it with whatever the uid
+        does not pin down (e.g. the digest of a floating image tag).
+        """
+        return self.envuid
         
+    def prepare_environment(self):
+        """make the environment available without loading it, e.g. pull
+        its image, so that environments can be prepared concurrently
+        before the steps using them start"""
+        pass
+
     @abc.abstractmethod
     def load_environment(self):
         pass
 
     @abc.abstractmethod
-    def execute_command(self, command, *args):
+    def submit_command(self, command, *args, log=None, timeout=None):
+        """start executing a command in the environment
+
+        Args:
+            command (str or str[]): the command.
+            log (str): file path to stream stdout and stderr to.
+            timeout (float): seconds after which the command gets killed.
+
+        Returns:
+            a `concurrent.futures.Future` resolving to an `ExecResult`.
+        """
         pass
 
+    def execute_command(self, command, *args, log=None, timeout=None):
+        """execute a command in the environment and wait for it to exit
+
+        Args are the same as for `submit_command`.
+
+        Returns:
+            the `ExecResult` of the command.
+        """
+        return self.submit_command(command, *args, log=log, timeout=timeout).result()
+
     @abc.abstractmethod
     def stop_environment(self):
         pass
@@ -42,6 +86,20 @@ class Exenv(abc.ABC):
     def env_working_dir(self):
         pass
 
+    def resource_environment(self):
+        """environment variables with the resources declared by the step,
+        so that its tools can size their thread pools and memory use"""
+        env = {}
+        if self.resources and self.resources.cpus:
+            threads = str(max(1,math.ceil(self.resources.cpus)))
+            env['RECONTO_CPUS'] = str(self.resources.cpus)
+            for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                             'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS'):
+                env[variable] = threads
+        if self.resources and self.resources.memory:
+            env['RECONTO_MEMORY'] = str(self.resources.memory)
+        return env
+
     def get_env_filepath(self,filepath):
         """get an absolute filepath for set environment
 
@@ -104,45 +162,402 @@ class Exenv(abc.ABC):
         self.stop_environment()
 
     @staticmethod
-    def get_env(uid,reco):
-        if uid.startswith('pyenv'): return Pyenv(uid,reco)
-        elif uid.startswith('docker'): return Docker(uid,reco)
-        else: raise NotImplementedError('in future should allow registering 3rd party env')
+    def register(typenv):
+        """class decorator registering an Exenv for the uids `<typenv>://...`"""
+        def register(exenv):
+            Exenv.types[typenv] = exenv
+            return exenv
+        return register
+
+    @staticmethod
+    def load_entry_points():
+        """register the exenvs of installed packages, declared as
+        `<typenv> = <module>:<Exenv class>` in the `reconto.exenvs` group"""
+        from importlib.metadata import entry_points
+        eps = entry_points()
+        eps = eps.select(group='reconto.exenvs') if hasattr(eps,'select') \
+            else eps.get('reconto.exenvs',())
+        for ep in eps:
+            Exenv.types.setdefault(ep.name, ep.load())
+
+    @staticmethod
+    def get_env(uid,reco,pool=None):
+        typenv = uid.split('://',1)[0]
+        if typenv not in Exenv.types:
+            Exenv.load_entry_points()
+        if typenv not in Exenv.types:
+            raise NotImplementedError('no execution environment registered for uid', uid)
+        return Exenv.types[typenv](uid,reco,pool)
+
+class ExenvPool(object):
+    """ExenvPool object
+
+    State shared by all execution environments of one build: a single
+    docker client, memos of resolved docker images and python
+    virtualenvs, the environments being prepared and, in pooled mode,
+    one long-lived container per docker exenv in which the workflow steps
+    are executed with `exec`, instead of a new container per step. Warm
+    containers are not resource limited, the resources declared by the
+    steps are then only respected by the scheduler.
+
+    Args:
+        reco (Reconto): the research compendium being built.
+        pooled (bool): keep a warm container per docker exenv.
+        client: docker client to use, defaults to a process wide
+          `docker.from_env()` client. Allows injecting a fake client.
+        processes (int): maximum number of concurrent `local://` processes,
+          defaults to the cpu count.
+        pull (bool): pull the docker images that are not available locally,
+          if False resolving them raises LookupError.
+    """
+    _shared_client = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self,reco,pooled=True,client=None,processes=None,pull=True):
+        self.reco = reco
+        self.pooled = pooled
+        self.pull = pull
+        self._client = client
+        self.processes = threading.BoundedSemaphore(processes or os.cpu_count() or 1)
+        self.images = {}
+        self.virtualenvs = {}
+        self.containers = {}
+        self.warmups = {}
+        self.warmer = None
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            with ExenvPool._shared_lock:
+                if ExenvPool._shared_client is None:
+                    import docker
+                    ExenvPool._shared_client = docker.from_env()
+            self._client = ExenvPool._shared_client
+        return self._client
+
+    def keylock(self,key):
+        """lock serializing the preparation of a shared resource"""
+        with self.lock:
+            return self.locks.setdefault(key,threading.Lock())
+
+    def get_env(self,uid):
+        """get an execution environment sharing this pool"""
+        return Exenv.get_env(uid,self.reco,self)
+
+    def warm_up(self,uids,workers=4):
+        """start preparing execution environments concurrently, e.g.
+        pulling docker images and creating python virtualenvs, see
+        `Exenv.prepare_environment`. Each environment is only prepared
+        once per pool.
+
+        Args:
+            uids (iterable): uids of the execution environments.
+            workers (int): maximum number of environments prepared at once.
+
+        Returns:
+            dict mapping the uids to futures resolving once they are prepared.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        uids = list(uids)
+        with self.lock:
+            if self.warmer is None:
+                self.warmer = ThreadPoolExecutor(max_workers=workers)
+            for uid in uids:
+                if uid not in self.warmups:
+                    self.warmups[uid] = self.warmer.submit(self.prepare, uid)
+            return {uid: self.warmups[uid] for uid in uids}
+
+    def prepare(self,uid):
+        """prepare an execution environment, see `warm_up`"""
+        exenv = self.get_env(uid)
+        with self.reco.tracer.span('prepare_environment', env=uid):
+            exenv.prepare_environment()
+        return uid
+
+    def resolve_image(self,name):
+        """get a docker image, pulling it if not yet available.
+        Each image is only resolved once per pool.
+
+        Args:
+            name (str): docker image name.
+        """
+        with self.keylock(('image',name)):
+            if name not in self.images:
+                from docker.errors import ImageNotFound
+                try:
+                    with self.reco.tracer.span('image_get', image=name):
+                        self.images[name] = self.client.images.get(name)
+                except ImageNotFound:
+                    if not self.pull:
+                        raise LookupError('docker image not available locally', name)
+                    with self.reco.tracer.span('image_pull', image=name):
+                        self.images[name] = self.client.images.pull(name)
+            return self.images[name]
+
+    def virtualenv(self,exenv):
+        """get the virtualenv directory of a python exenv, creating it if
+        needed. Each virtualenv is only resolved once per pool.
+
+        Args:
+            exenv (Pyenv): the python execution environment.
+        """
+        with self.keylock(('virtualenv',exenv.envdir)):
+            if exenv.envdir not in self.virtualenvs:
+                self.virtualenvs[exenv.envdir] = exenv.resolve_virtualenv()
+            return self.virtualenvs[exenv.envdir]
+
+    def container(self,exenv):
+        """get the warm container of a docker exenv, starting it if needed.
+        The container keeps running idle with the reco `data` and `results`
+        folders mounted until the pool is closed.
+
+        Args:
+            exenv (Docker): the docker execution environment.
+        """
+        with self.keylock(('container',exenv.envuid)):
+            if exenv.envuid not in self.containers:
+                image = self.resolve_image(exenv.uid)
+                with self.reco.tracer.span('container_start', exenv.step, pooled=True):
+                    self.containers[exenv.envuid] = self.client.containers.run(
+                        image.id,
+                        entrypoint=['tail','-f','/dev/null'],
+                        volumes=exenv.volumes,
+                        working_dir=exenv.env_working_dir,
+                        labels={'reconto.path': self.reco.path},
+                        detach=True
+                    )
+            return self.containers[exenv.envuid]
+
+    def close(self):
+        """stop preparing environments, and remove all warm containers"""
+        if self.warmer is not None:
+            self.warmer.shutdown(cancel_futures=True)
+        with self.lock:
+            containers, self.containers = list(self.containers.values()), {}
+        for container in containers:
+            container.remove(force=True)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+@Exenv.register('local')
+class Local(Exenv):
+    """Local execution environment
+
+    Executes steps as direct subprocesses in the compendium, e.g.
+    `local://` for cheap `sort` or `cat` steps that do not need an
+    isolated environment, at most `ExenvPool.processes` at a time.
+    """
+    _uid_regex = re.compile(r'(?P<typenv>local)://(?P<uid>\S*)')
+
+    @property
+    def env_working_dir(self):
+        return self.reco.path
+
+    def load_environment(self):
+        pass
+
+    def submit_command(self, command, *args, log=None, timeout=None):
+        import subprocess
+        from reconto.waiter import Waiter, ProcessJob
+        if type(command) is str:
+            command = (command,)
+        command = list(command) + list(args)
+        if self.contains_escaped_annotations(command):
+            command = ['sh','-c',' '.join(self.reset_escaped_annotations(command))]
+        env = dict(os.environ, **self.resource_environment())
+        self.pool.processes.acquire()
+        try:
+            execution = Waiter.shared().watch(ProcessJob(
+                lambda stdout: subprocess.Popen(
+                    command, cwd=self.env_working_dir, env=env, stdout=stdout,
+                    stderr=subprocess.STDOUT, start_new_session=True
+                ), log, timeout
+            ))
+        except BaseException:
+            self.pool.processes.release()
+            raise
+        execution.add_done_callback(lambda execution: self.pool.processes.release())
+        return execution
+
+    def stop_environment(self):
+        pass
+
+def clone_virtualenv(template,origin,destination,location=None):
+    """clone a virtualenv, hardlinking its packages
+
+    Virtualenvs are not relocatable, the scripts and configuration
+    referencing the directory the template was created in are copied
+    with that path replaced by the location of the clone.
+
+    Args:
+        template (str): virtualenv directory to clone.
+        origin (str): directory the template virtualenv was created in.
+        destination (str): virtualenv directory to create.
+        location (str): directory the clone will be used from, once moved,
+          defaults to destination.
+    """
+    from reconto.store import clone
+    location = location or destination
+    for root,dirs,files in os.walk(template):
+        target = os.path.join(destination,os.path.relpath(root,template))
+        os.makedirs(target, exist_ok=True)
+        for name in dirs + files:
+            source, path = os.path.join(root,name), os.path.join(target,name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source).replace(origin,location), path)
+            elif name in files:
+                if root == template or os.path.basename(root) in ('bin','Scripts'):
+                    with open(source,'rb') as f:
+                        content = f.read()
+                    if origin.encode() in content:
+                        with open(path,'wb') as f:
+                            f.write(content.replace(origin.encode(),location.encode()))
+                        os.chmod(path, os.stat(source).st_mode)
+                        continue
+                clone(source,path)
+
+@Exenv.register('pyenv')
 class Pyenv(Exenv):
-    """Python execution environment"""
-    _uid_regex = re.compile(r'(?P<typenv>pyenv)://(?P<pyver>py\d\.\d)/(?P<uid>\w\S+)')
+    """Python execution environment
+
+    Commands are executed with the bin folder of the environment's
+    virtualenv first on the PATH, as `pipenv run` would, without starting
+    pipenv for every step. New virtualenvs are cloned from a template per
+    python version and `Pipfile.lock`, kept under `RECONTO_PYENV_CACHE`
+    (default `~/.cache/reconto/pyenv`), so that the packages of a lockfile
+    are only installed once per machine.
+    """
+    _uid_regex = re.compile(r'(?P<typenv>pyenv)://(?P<pyver>py\d\.\d+)/(?P<uid>\w\S+)')
 
     @property
     def env_working_dir(self):
         return self.reco.path
     
-    def load_environment(self):
-        import plumbum as pb
+    def fingerprint(self):
+        lockfile = os.path.join(
+            self.reco.path,'exenv',self.pyver,self.uid,'Pipfile.lock'
+        )
+        if not os.path.exists(lockfile):
+            return self.envuid
+        return '{}@{}'.format(self.envuid,self.reco.hasher.hash(lockfile))
+
+    def prepare_environment(self):
         self.envdir = os.path.join(self.reco.path,'exenv',self.pyver,self.uid)
-        if not os.path.exists(self.envdir):
-            if not os.path.exists(os.path.join(self.reco.path,'exenv')):
-                os.mkdir(os.path.join(self.reco.path,'exenv'))
-            if not os.path.exists(os.path.join(self.reco.path,'exenv',self.pyver)):
-                os.mkdir(os.path.join(self.reco.path,'exenv',self.pyver))
-            os.mkdir(self.envdir)
-            with pb.local.env(PIPENV_IGNORE_VIRTUALENVS=1):
-                with pb.local.cwd(self.envdir):
-                    pb.local['pipenv']('--python','python'+self.pyver[2:])
-
-    def execute_command(self, command, *args):
+        os.makedirs(self.envdir, exist_ok=True)
+        self.pool.virtualenv(self)
+
+    def load_environment(self):
+        self.prepare_environment()
+        self.venv = self.pool.virtualenv(self)
+
+    def pipenv(self,*args,cwd=None):
+        """run pipenv for the environment, with in-project virtualenvs"""
         import plumbum as pb
+        with pb.local.env(PIPENV_IGNORE_VIRTUALENVS=1, PIPENV_VENV_IN_PROJECT=1):
+            with pb.local.cwd(cwd or self.envdir):
+                return pb.local['pipenv'](*args)
+
+    def resolve_virtualenv(self):
+        """the virtualenv directory of the environment: its in-project
+        `.venv`, the virtualenv pipenv already has for it, or a new
+        `.venv` cloned from the template for its python and lockfile"""
+        import shutil
+        from reconto.store import remove
+        venv = os.path.join(self.envdir,'.venv')
+        if os.path.exists(os.path.join(venv,'bin','python')):
+            return venv
+        if os.path.exists(os.path.join(self.envdir,'Pipfile')):
+            import plumbum as pb
+            try:
+                existing = self.pipenv('--venv').strip()
+                if os.path.exists(os.path.join(existing,'bin','python')):
+                    return existing
+            except (pb.ProcessExecutionError, pb.CommandNotFound):
+                pass # no virtualenv yet
+        template = self.template()
+        with open(os.path.join(template,'origin')) as f:
+            origin = f.read()
+        with self.reco.tracer.span('pipenv_clone', self.step, env=self.envuid):
+            tmpdir = '{}.{}.tmp'.format(venv,uuid.uuid4().hex)
+            clone_virtualenv(os.path.join(template,'.venv'),origin,tmpdir,venv)
+            try:
+                os.rename(tmpdir,venv)
+            except OSError:
+                remove(tmpdir) # cloned meanwhile by another build
+        if not os.path.exists(os.path.join(self.envdir,'Pipfile')):
+            shutil.copyfile(os.path.join(template,'Pipfile'),os.path.join(self.envdir,'Pipfile'))
+        elif not os.path.exists(os.path.join(self.envdir,'Pipfile.lock')):
+            # cloned from the empty template, the packages are not locked yet
+            with self.reco.tracer.span('pipenv_install', self.step, env=self.envuid):
+                self.pipenv('install')
+        return venv
+
+    def template(self):
+        """the template directory for the environment's python and lockfile,
+        created with pipenv if not yet cached. Environments without lockfile
+        share an empty template, with the default `Pipfile` of pipenv"""
+        import shutil
+        from reconto.store import remove
+        lockfile = os.path.join(self.envdir,'Pipfile.lock')
+        key = self.reco.hasher.hash(lockfile) if os.path.exists(lockfile) else 'empty'
+        cache = os.path.expanduser(
+            os.environ.get('RECONTO_PYENV_CACHE') or '~/.cache/reconto/pyenv'
+        )
+        template = os.path.join(cache,self.pyver,key)
+        if os.path.exists(os.path.join(template,'origin')):
+            return template
+        tmpdir = '{}.{}.tmp'.format(template,uuid.uuid4().hex)
+        os.makedirs(tmpdir)
+        try:
+            with self.reco.tracer.span('pipenv_create', self.step, env=self.envuid):
+                for name in ('Pipfile','Pipfile.lock'):
+                    if key != 'empty' and os.path.exists(os.path.join(self.envdir,name)):
+                        shutil.copyfile(os.path.join(self.envdir,name),os.path.join(tmpdir,name))
+                self.pipenv('--python','python'+self.pyver[2:],cwd=tmpdir)
+                if key != 'empty':
+                    self.pipenv('sync',cwd=tmpdir)
+            with open(os.path.join(tmpdir,'origin'),'w') as f:
+                f.write(os.path.join(tmpdir,'.venv'))
+            try:
+                os.rename(tmpdir,template)
+            except OSError:
+                remove(tmpdir) # created meanwhile by another build
+        except BaseException:
+            remove(tmpdir)
+            raise
+        return template
+
+    def submit_command(self, command, *args, log=None, timeout=None):
+        import subprocess
+        from reconto.waiter import Waiter, ProcessJob
         if type(command) is str:
             command = (command,)
-        with pb.local.env(PIPENV_IGNORE_VIRTUALENVS=1):
-            with pb.local.cwd(self.envdir):
-                pb.local['pipenv'].bound_command(
-                    'run',*command,*args
-                ) & pb.FG
+        command = list(command) + list(args)
+        if self.contains_escaped_annotations(command):
+            command = ['sh','-c',' '.join(self.reset_escaped_annotations(command))]
+        env = dict(
+            os.environ, VIRTUAL_ENV=self.venv, PIPENV_ACTIVE='1',
+            PATH=os.pathsep.join((os.path.join(self.venv,'bin'),os.environ.get('PATH',os.defpath))),
+            **self.resource_environment()
+        )
+        env.pop('PYTHONHOME', None)
+        return Waiter.shared().watch(ProcessJob(
+            lambda stdout: subprocess.Popen(
+                command, cwd=self.envdir, env=env,
+                stdout=stdout, stderr=subprocess.STDOUT, start_new_session=True
+            ), log, timeout
+        ))
 
     def stop_environment(self):
-        del self.envdir
+        del self.envdir, self.venv
         
+@Exenv.register('docker')
 class Docker(Exenv):
     """Docker container execution environment"""
     _uid_regex = re.compile(r'(?P<type>docker)://(?P<uid>\w\S+)')
@@ -151,12 +566,28 @@ class Docker(Exenv):
     def env_working_dir(self):
         return '/app'
     
+    @property
+    def volumes(self):
+        return {
+            os.path.join(self.reco.path,'data'):{'bind':'/app/data','mode':'ro'},
+            os.path.join(self.reco.path,'results'):{'bind':'/app/results','mode':'rw'},
+        }
+
+    def fingerprint(self):
+        return '{}@{}'.format(self.envuid,self.pool.resolve_image(self.uid).id)
+
+    def prepare_environment(self):
+        self.pool.resolve_image(self.uid)
+        if self.pool.pooled:
+            self.pool.container(self)
+
     def load_environment(self):
-        import docker
-        self.client = docker.from_env()
+        self.client = self.pool.client
+        if self.pool.pooled:
+            self.container = self.pool.container(self)
 
-    def execute_command(self, command, *args):
-        from docker.errors import ImageNotFound
+    def shell_command(self, command, *args):
+        """the container command string"""
         if args and type(command) is str:
             command += ' '+' '.join(args)
         elif type(command) is not str:
@@ -164,20 +595,63 @@ class Docker(Exenv):
             if escape_command: command = self.reset_escaped_annotations(command)
             command = ' '.join(command) + ' ' + ' '.join(args)
             command = 'sh -c "{}"'.format(command.replace('"',r'\"'))
-        try:
-            self.image = self.client.images.get(self.uid)
-        except ImageNotFound:
-            self.image = self.client.images.pull(self.uid)
-        self.container = self.client.containers.create(
-            self.uid, command,
-            volumes={
-                os.path.join(self.reco.path,'data'):{'bind':'/app/data','mode':'ro'},
-                os.path.join(self.reco.path,'results'):{'bind':'/app/results','mode':'rw'},
-            },
-            working_dir = '/app'
-        )
-        self.container.start()
+        return command
+
+    def submit_command(self, command, *args, log=None, timeout=None):
+        from reconto.waiter import Waiter, StreamJob
+        command = self.shell_command(command, *args)
+        api = self.client.api
+        if self.pool.pooled:
+            # the exec runs in its own process group and records its pid until
+            # it exits, so that it can be killed on timeout with all processes
+            # it started
+            pidfile = '/tmp/reconto-{}.pid'.format(uuid.uuid4().hex)
+            container = self.container
+            exec_id = api.exec_create(
+                container.id,
+                ['setsid','sh','-c',
+                 'echo $$ > {0}; sh -c "$0"; status=$?; rm -f {0}; exit $status'.format(pidfile),
+                 command],
+                workdir=self.env_working_dir, environment=self.resource_environment()
+            )['Id']
+            sock = api.exec_start(exec_id, socket=True)
+            poll = lambda: api.exec_inspect(exec_id)['ExitCode']
+            # blocking docker call, kept off the waiter thread
+            kill = lambda: threading.Thread(
+                target=container.exec_run,
+                args=(['sh','-c','kill -9 -$(cat {0}); rm -f {0}'.format(pidfile)],),
+                daemon=True
+            ).start()
+        else:
+            self.image = self.pool.resolve_image(self.uid)
+            tracer = self.reco.tracer
+            limits = {}
+            if self.resources and self.resources.cpus:
+                limits['nano_cpus'] = int(self.resources.cpus*1e9)
+            if self.resources and self.resources.memory:
+                limits['mem_limit'] = self.resources.memory
+            with tracer.span('container_create', self.step):
+                self.container = self.client.containers.create(
+                    self.image.id, command,
+                    volumes=self.volumes,
+                    working_dir = self.env_working_dir,
+                    environment=self.resource_environment(),
+                    **limits
+                )
+            sock = api.attach_socket(
+                self.container.id, params={'stdout':1,'stderr':1,'stream':1,'logs':1}
+            )
+            with tracer.span('container_start', self.step):
+                self.container.start()
+            poll = lambda: self.container.wait()['StatusCode']
+            kill = self.container.kill
+        return Waiter.shared().watch(StreamJob(sock, poll, kill, log, timeout))
 
     def stop_environment(self):
-        self.container.stop()
-        del self.client, self.image, self.container
+        if not self.pool.pooled:
+            if hasattr(self,'container'):
+                with self.reco.tracer.span('container_remove', self.step):
+                    self.container.remove(force=True)
+            self.__dict__.pop('image',None)
+        self.__dict__.pop('container',None)
+        del self.client
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""fetch: retrieval of annotated datasources
+
+Datasources annotated with an external location (`@https://...@file`)
+that are not yet present in the reco data folder are downloaded on a
+bounded thread pool. Downloads are streamed to disk in chunks, into a
+`.part` file that is resumed with a range request when a previous
+download was interrupted, and are verified against the optional checksum
+recorded in the `checksums` section of `reconto.yml`, e.g.:
+
+    checksums:
+      archive.tar.gz: sha256:9f86d081884c7d659a2feaa0c55ad015...
+
+Identical locations are only downloaded once.
+"""
+import os, hashlib, shutil, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+class Fetcher(object):
+    """Fetcher object
+
+    Args:
+        reco (Reconto): the research compendium whose datasources are fetched.
+        workers (int): maximum number of concurrent downloads.
+        chunksize (int): bytes read and written at once.
+        retries (int): attempts per download, interrupted attempts are resumed.
+        timeout (float): seconds without response after which an attempt fails.
+    """
+    def __init__(self,reco,workers=4,chunksize=1<<20,retries=3,timeout=60.):
+        self.reco = reco
+        self.workers = workers
+        self.chunksize = chunksize
+        self.retries = retries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.downloads = {}
+        self.fetches = {}
+        self.stats = {'files_fetched': 0, 'bytes_fetched': 0}
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    @staticmethod
+    def location(datasource,filepath,include):
+        """the external location of an annotated datasource"""
+        return datasource+filepath if include else datasource
+
+    def checksum(self,filepath):
+        """checksum recorded in the configuration for a datasource, or None"""
+        return (self.reco.config.get('checksums') or {}).get(filepath)
+
+    def fetch(self,datasource,filepath,include=''):
+        """start retrieving a datasource into the reco data folder
+
+        Args:
+            datasource (str): external location of the datasource.
+            filepath (str): relative path in the data folder.
+            include (str): if not empty, `filepath` completes the `datasource` location.
+
+        Returns:
+            a `concurrent.futures.Future` resolving to the datasource path.
+        """
+        url = self.location(datasource,filepath,include)
+        destination = os.path.join(self.reco.path,'data',filepath)
+        with self.lock:
+            if filepath in self.fetches:
+                return self.fetches[filepath]
+            if url not in self.downloads:
+                self.downloads[url] = self.pool.submit(
+                    self.download, url, destination, self.checksum(filepath)
+                )
+                self.fetches[filepath] = self.downloads[url]
+            else:
+                self.fetches[filepath] = self.pool.submit(
+                    self.duplicate, self.downloads[url], destination,
+                    self.checksum(filepath)
+                )
+            return self.fetches[filepath]
+
+    def fetch_missing(self,plan):
+        """start retrieving all missing datasources of a workflow plan
+
+        Args:
+            plan (Plan): the compiled workflow.
+
+        Returns:
+            dict mapping the datasource filepaths to their futures.
+        """
+        futures = {}
+        for step in plan:
+            for _,datasource,filepath,include in step.datasources:
+                if datasource and filepath not in futures and not os.path.exists(
+                        os.path.join(self.reco.path,'data',filepath)
+                ):
+                    futures[filepath] = self.fetch(datasource,filepath,include)
+        return futures
+
+    def duplicate(self,download,destination,checksum=None):
+        """link or copy a file downloaded for another datasource with the same location"""
+        source = download.result()
+        if checksum:
+            self.verify(source,checksum)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            os.link(source,destination)
+        except OSError:
+            shutil.copyfile(source,destination)
+        return destination
+
+    def verify(self,path,checksum):
+        """check a file against a checksum, raising RuntimeError on mismatch
+
+        Args:
+            path (str): file path.
+            checksum (str): expected `algorithm:hexdigest`, or a sha256 hexdigest.
+        """
+        algorithm, _, expected = checksum.rpartition(':')
+        h = hashlib.new(algorithm or 'sha256')
+        with open(path,'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunksize), b''):
+                h.update(chunk)
+        if h.hexdigest() != expected.lower():
+            raise RuntimeError('datasource checksum mismatch',path,checksum,h.hexdigest())
+
+    def download(self,url,destination,checksum=None):
+        """stream a location to a file, resuming a previous partial download
+
+        Args:
+            url (str): `http(s)://` or `file://` location.
+            destination (str): file path.
+            checksum (str): expected `algorithm:hexdigest`, or a sha256 hexdigest.
+        """
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        partfile = destination+'.part'
+        for attempt in range(self.retries):
+            try:
+                self._stream(url,partfile)
+                break
+            except OSError:
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(2**attempt)
+        if checksum:
+            try:
+                self.verify(partfile,checksum)
+            except RuntimeError:
+                os.remove(partfile)
+                raise
+        os.replace(partfile,destination)
+        with self.lock:
+            self.stats['files_fetched'] += 1
+        return destination
+
+    def _stream(self,url,partfile):
+        offset = os.path.getsize(partfile) if os.path.exists(partfile) else 0
+        expected = None
+        if url.startswith('file://'):
+            from urllib.request import url2pathname
+            source = open(url2pathname(url[len('file://'):]),'rb')
+            source.seek(offset)
+        else:
+            from urllib.error import HTTPError
+            from urllib.request import Request, urlopen
+            request = Request(url)
+            if offset:
+                request.add_header('Range','bytes={}-'.format(offset))
+            try:
+                source = urlopen(request, timeout=self.timeout)
+            except HTTPError as e:
+                if offset and e.code == 416:
+                    return # partial download was already complete
+                raise
+            if offset and source.status != 206:
+                # server does not support resuming
+                offset = 0
+            elif offset:
+                start = (source.headers.get('Content-Range') or '').partition(' ')[2]
+                if start.partition('-')[0] != str(offset):
+                    source.close()
+                    os.remove(partfile) # restarted by the next attempt
+                    raise OSError('unexpected content range', url, start, offset)
+            if source.headers.get('Content-Length') is not None:
+                expected = int(source.headers['Content-Length'])
+        from http.client import HTTPException
+        received = 0
+        with source, open(partfile,'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            try:
+                for chunk in iter(lambda: source.read(self.chunksize), b''):
+                    f.write(chunk)
+                    received += len(chunk)
+                    with self.lock:
+                        self.stats['bytes_fetched'] += len(chunk)
+            except HTTPException as e:
+                raise OSError('download interrupted', url, e) from e
+        if expected is not None and received < expected:
+            # the next attempt resumes from the bytes received
+            raise OSError('download truncated', url, offset+received, offset+expected)
+
+    def close(self):
+        """wait for the running downloads and shut down the pool"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        with self.lock:
+            self.downloads, self.fetches = {}, {}
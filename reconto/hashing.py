@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""hashing: content hashing of data and result files
+
+Large files are hashed in fixed size chunks, each chunk memory-mapped
+and hashed on a thread pool; the file digest is the sha256 of the
+concatenated chunk digests. Directories are hashed as Merkle trees over
+their sorted entries. Symbolic links within a directory are not
+followed, they are hashed as leaves by their target path.
+
+File digests are kept in an on-disk index keyed by the file's
+(size, mtime_ns, inode), so files that did not change since they were
+last hashed are never read again.
+"""
+import os, json, mmap, hashlib, threading, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+
+class Hasher(object):
+    """Hasher object
+
+    Args:
+        root (str): directory relative to which paths are indexed.
+        indexfile (str): path of the stat index, if None nothing is persisted.
+        workers (int): number of hashing threads, defaults to the cpu count.
+        chunksize (int): bytes per hashed chunk, rounded to the mmap granularity.
+    """
+    #: files modified this recently are not indexed, as a later
+    #  modification could go unnoticed within the mtime resolution
+    racy_interval = 2
+
+    def __init__(self,root,indexfile=None,workers=None,chunksize=1<<24):
+        self.root = os.path.abspath(root)
+        self.indexfile = indexfile
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = max(
+            mmap.ALLOCATIONGRANULARITY,
+            chunksize - chunksize % mmap.ALLOCATIONGRANULARITY
+        )
+        self.lock = threading.Lock()
+        self.stats = {
+            'files_hashed': 0, 'files_skipped': 0,
+            'bytes_read': 0, 'bytes_skipped': 0
+        }
+        self._pool = None
+        self.index = {}
+        if indexfile:
+            try:
+                with open(indexfile) as f:
+                    self.index = json.load(f)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def pool(self):
+        with self.lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def key(self,path):
+        """index key of an absolute path"""
+        if path.startswith(self.root+os.sep):
+            return os.path.relpath(path,self.root)
+        return path
+
+    def hash(self,path):
+        """digest of a file or directory
+
+        Args:
+            path (str): file or directory path.
+        """
+        return self.hash_many([path])[path]
+
+    def hash_many(self,paths):
+        """digests of several files or directories, all changed files
+        are hashed concurrently
+
+        Args:
+            paths (str list): file or directory paths.
+
+        Returns:
+            dict mapping each path to its hexdigest.
+        """
+        files, trees, links = {}, {}, {}
+        for path in paths:
+            self._collect(os.path.abspath(path),files,trees,links)
+        digests = self._hash_files(files)
+        digests.update(links)
+        for tree in sorted(trees, key=len, reverse=True):
+            h = hashlib.sha256()
+            for name,entrypath in trees[tree]:
+                h.update('{} {}\n'.format(
+                    'tree' if entrypath in trees else
+                    'link' if entrypath in links else 'file', name
+                ).encode())
+                h.update(digests[entrypath].encode())
+            digests[tree] = h.hexdigest()
+        return {path: digests[os.path.abspath(path)] for path in paths}
+
+    def _collect(self,path,files,trees,links):
+        if os.path.isdir(path):
+            entries = []
+            for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                entries.append((entry.name,entry.path))
+                if entry.is_symlink():
+                    links[entry.path] = hashlib.sha256(
+                        os.readlink(entry.path).encode()
+                    ).hexdigest()
+                else:
+                    self._collect(entry.path,files,trees,links)
+            trees[path] = entries
+        else:
+            files[path] = os.stat(path)
+
+    def _hash_files(self,files):
+        digests, chunkjobs = {}, {}
+        now = time.time_ns()
+        pool = self.pool
+        with self.lock:
+            for path,st in files.items():
+                entry = self.index.get(self.key(path))
+                if entry and entry[:3] == [st.st_size,st.st_mtime_ns,st.st_ino]:
+                    digests[path] = entry[3]
+                    self.stats['files_skipped'] += 1
+                    self.stats['bytes_skipped'] += st.st_size
+                else:
+                    chunkjobs[path] = [
+                        pool.submit(self._hash_chunk,path,offset,
+                                    min(self.chunksize,st.st_size-offset))
+                        for offset in range(0,st.st_size,self.chunksize)
+                    ] if st.st_size else []
+        for path,chunks in chunkjobs.items():
+            st = files[path]
+            digests[path] = hashlib.sha256(
+                b''.join(chunk.result() for chunk in chunks)
+            ).hexdigest()
+            with self.lock:
+                self.stats['files_hashed'] += 1
+                self.stats['bytes_read'] += st.st_size
+                if now - st.st_mtime_ns > self.racy_interval * 10**9:
+                    self.index[self.key(path)] = [
+                        st.st_size, st.st_mtime_ns, st.st_ino, digests[path]
+                    ]
+        return digests
+
+    def remember(self,path,digest):
+        """index the known digest of a file, e.g. one restored from a store,
+        so that it is not read to be hashed"""
+        st = os.stat(path)
+        if time.time_ns() - st.st_mtime_ns > self.racy_interval * 10**9:
+            with self.lock:
+                self.index[self.key(os.path.abspath(path))] = [
+                    st.st_size, st.st_mtime_ns, st.st_ino, digest
+                ]
+
+    @staticmethod
+    def _hash_chunk(path,offset,length):
+        with open(path,'rb') as f:
+            with mmap.mmap(f.fileno(), length, offset=offset, access=mmap.ACCESS_READ) as m:
+                return hashlib.sha256(m).digest()
+
+    def save(self):
+        """atomically write the stat index"""
+        if not self.indexfile: return
+        dirname = os.path.dirname(self.indexfile)
+        os.makedirs(dirname, exist_ok=True)
+        with self.lock:
+            fd, tmpfile = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            with os.fdopen(fd,'wt') as f:
+                json.dump(self.index,f)
+        os.replace(tmpfile,self.indexfile)
+
+    def close(self):
+        """save the index and shut down the hashing threads"""
+        self.save()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,547 @@
+# -*- coding: utf-8 -*-
+"""plan: compiled representation of a reconto workflow
+
+The annotations of every workflow step are parsed once into a compact
+`Step`, and the steps with their dependency graph into a `Plan`. The
+plan is cached as json, together with the configuration it was compiled
+from, in `.reconto/plan.json`, keyed by the hash of `reconto.yml`, so
+that repeated invocations skip yaml parsing and annotation matching.
+"""
+import os, re, json, hashlib, tempfile
+
+#: bump when the cached plan layout changes, to invalidate cached plans
+PLAN_VERSION = 4
+
+def wildcard_pattern(filepath):
+    """regular expression matching the filepaths a filepath with wildcards
+    expands to, with a named group for each wildcard"""
+    from reconto import Reconto
+    pattern, names, end = '', set(), 0
+    for match in Reconto.annotations['wildcard'].finditer(filepath):
+        name = match.group('wildcard')
+        pattern += re.escape(filepath[end:match.start()]) + (
+            '(?P={})'.format(name) if name in names else '(?P<{}>[^/]+)'.format(name)
+        )
+        names.add(name)
+        end = match.end()
+    return re.compile(pattern + re.escape(filepath[end:]))
+
+def load_yaml(source):
+    """parse the reconto yaml configuration, with libyaml if available"""
+    import yaml
+    return yaml.load(source, Loader=getattr(yaml,'CSafeLoader',yaml.SafeLoader))
+
+def dump_yaml(config):
+    """serialize the reconto configuration
+
+    The configuration only holds strings, numbers, lists and dicts, which
+    are emitted in the block style of `yaml.dump` without importing yaml,
+    as this is on the path of every `reconto add`. Other values fall back
+    to yaml, with libyaml if available.
+    """
+    try:
+        return '\n'.join(_yaml_block(config,'')) + '\n'
+    except TypeError:
+        import yaml
+        return yaml.dump(config, Dumper=getattr(yaml,'CSafeDumper',yaml.SafeDumper))
+
+_plain = re.compile(r'([A-Za-z_/=]|\.(?!\d))[\w./=+-]*(:[\w./=+-]+)*')
+_reserved = {'=', 'y', 'n', 'yes', 'no', 'on', 'off', 'true', 'false', 'null', 'nan', 'inf'}
+
+def _yaml_scalar(value):
+    if value is None:
+        return 'null'
+    if isinstance(value,bool):
+        return 'true' if value else 'false'
+    if isinstance(value,int):
+        return str(value)
+    if isinstance(value,float) and value == value and abs(value) != float('inf'):
+        # yaml 1.1 only resolves floats with a dot, e.g. 1.0e+20 and not 1e+20
+        mantissa, e, exponent = repr(value).partition('e')
+        return mantissa + ('' if '.' in mantissa else '.0') + e + exponent
+    if isinstance(value,dict) and not value:
+        return '{}'
+    if isinstance(value,list) and not value:
+        return '[]'
+    if not isinstance(value,str):
+        raise TypeError('no yaml scalar for value', value)
+    if _plain.fullmatch(value) and value.lower().lstrip('.') not in _reserved:
+        return value
+    if value.isprintable():
+        return "'" + value.replace("'","''") + "'"
+    return json.dumps(value)
+
+def _yaml_block(node,indent):
+    if isinstance(node,dict) and node:
+        lines = []
+        for key in sorted(node):
+            value = node[key]
+            if isinstance(value,(dict,list)) and value:
+                lines.append(indent+_yaml_scalar(key)+':')
+                lines.extend(_yaml_block(value, indent+'  ' if isinstance(value,dict) else indent))
+            else:
+                lines.append(indent+_yaml_scalar(key)+': '+_yaml_scalar(value))
+        return lines
+    if isinstance(node,list) and node:
+        lines = []
+        for value in node:
+            if isinstance(value,(dict,list)) and value:
+                block = _yaml_block(value, indent+'  ')
+                lines.append(indent+'- '+block[0][len(indent)+2:])
+                lines.extend(block[1:])
+            else:
+                lines.append(indent+'- '+_yaml_scalar(value))
+        return lines
+    return [indent+_yaml_scalar(node)]
+
+class Step(object):
+    """Step object
+
+    A parsed workflow step.
+
+    Args:
+        index (int): position of the step in the workflow.
+        annotated (tuple): the annotated workflow command.
+        exenv (str): uid of the step execution environment.
+        command (tuple): the command with its script unannotated.
+        datasources (tuple): (position, datasource, filepath, include) of each
+          datasource annotation.
+        results (tuple): (position, result, filepath, include) of each
+          result annotation.
+
+    A step with `{name}` wildcards in its datasource or result annotations
+    is a scatter step, expanded by `build` into one step per wildcard
+    value. A `{name*}` wildcard is gathered, expanded into one command
+    element per value.
+    """
+    __slots__ = (
+        'index', 'annotated', 'exenv', 'command', 'datasources', 'results',
+        'produces', 'dependencies', 'wildcards', 'gathers', 'template'
+    )
+
+    def __init__(self,index,annotated,exenv,command,datasources,results):
+        self.index = index
+        self.annotated = annotated
+        self.exenv = exenv
+        self.command = command
+        self.datasources = datasources
+        self.results = results
+        self.produces = ()
+        self.dependencies = ()
+        self.wildcards = () # names of the scattered wildcards
+        self.gathers = () # names of the gathered wildcards
+        self.template = None # index of the scatter step this step expands
+
+    def state(self):
+        """the attributes of the step, as json serializable list"""
+        return [getattr(self,a) for a in self.__slots__]
+
+    @classmethod
+    def from_state(cls,state):
+        """the step with the attributes of `state`"""
+        (index, annotated, exenv, command, datasources, results, produces,
+         dependencies, wildcards, gathers, template) = state
+        step = cls(
+            index, tuple(annotated), exenv, tuple(command),
+            tuple(map(tuple,datasources)), tuple(map(tuple,results))
+        )
+        step.produces, step.dependencies = tuple(produces), tuple(dependencies)
+        step.wildcards, step.gathers = tuple(wildcards), tuple(gathers)
+        step.template = template
+        return step
+
+    @classmethod
+    def parse(cls,index,step):
+        """parse the annotations of a workflow step, matching each
+        command element only once
+
+        Args:
+            index (int): position of the step in the workflow.
+            step (str list): an annotated workflow command.
+        """
+        from reconto import Reconto
+        annotations = Reconto.annotations
+        exenv, script = annotations['script'].fullmatch(step[0]).groups()
+        datasources, results = [], []
+        for i,se in enumerate(step):
+            if not i: continue
+            annot = annotations['datasource'].fullmatch(se)
+            if annot:
+                datasources.append((i,)+annot.groups())
+                continue
+            annot = annotations['result'].fullmatch(se)
+            if annot:
+                results.append((i,)+annot.groups())
+        parsed = cls(
+            index, tuple(step), exenv, (script,)+tuple(step[1:]),
+            tuple(datasources), tuple(results)
+        )
+        wildcards = {
+            (match.group('wildcard'), bool(match.group('gather')))
+            for annot in datasources + results
+            for match in annotations['wildcard'].finditer(step[annot[0]])
+        }
+        if wildcards:
+            parsed.wildcards = tuple(sorted(n for n,gather in wildcards if not gather))
+            parsed.gathers = tuple(sorted(n for n,gather in wildcards if gather))
+        return parsed
+
+    def assignments(self,values):
+        """the wildcard values of each expansion of the step, all
+        combinations of the values of its scattered wildcards
+
+        Args:
+            values (dict): maps each wildcard name to its values.
+        """
+        import itertools
+        for name in self.wildcards + self.gathers:
+            if name not in values:
+                raise ValueError('no values for wildcard', name)
+        for combination in itertools.product(*(values[n] for n in self.wildcards)):
+            yield dict(zip(self.wildcards,combination))
+
+    def expand(self,assignment,values):
+        """the annotated command of one expansion of the step
+
+        Args:
+            assignment (dict): value of each scattered wildcard.
+            values (dict): maps each wildcard name to its values, for the
+              gathered wildcards.
+        """
+        command = []
+        for e in self.annotated:
+            elements = [e]
+            for name in self.gathers:
+                gather = '{'+name+'*}'
+                if gather in e:
+                    elements = [x.replace(gather,v) for x in elements for v in values[name]]
+            for x in elements:
+                for name,value in assignment.items():
+                    x = x.replace('{'+name+'}',value)
+                command.append(x)
+        return command
+
+    @property
+    def consumes(self):
+        """result filepaths produced by upstream steps"""
+        return tuple(r[2] for r in self.results if r[2] not in self.produces)
+
+    def __repr__(self):
+        return 'Step({}, {!r})'.format(self.index,' '.join(self.annotated))
+
+class Plan(object):
+    """Plan object
+
+    The compiled workflow: its steps and the index tables linking results
+    to the step producing them and the steps consuming them, and
+    datasources to the steps using them.
+    The first step annotating a result produces it, every later step
+    annotating the same result consumes it and depends on the producer.
+
+    Args:
+        digest (str): hash of the `reconto.yml` the plan was compiled from.
+    """
+    __slots__ = ('digest', 'steps', 'producers', 'consumers', 'datasources')
+
+    def __init__(self,digest=None):
+        self.digest = digest
+        self.steps = []
+        self.producers = {}
+        self.consumers = {}
+        self.datasources = {}
+
+    def state(self):
+        """the plan, as json serializable list"""
+        return [
+            self.digest, [step.state() for step in self.steps],
+            self.producers, self.consumers, self.datasources
+        ]
+
+    @classmethod
+    def from_state(cls,state):
+        """the plan with the steps and index tables of `state`"""
+        digest, steps, producers, consumers, datasources = state
+        plan = cls(digest)
+        plan.steps = [Step.from_state(step) for step in steps]
+        plan.producers, plan.consumers, plan.datasources = producers, consumers, datasources
+        return plan
+
+    @classmethod
+    def compile(cls,workflow,digest=None):
+        """compile all steps of a workflow
+
+        Args:
+            workflow (list): the `workflow` section of the reconto configuration.
+            digest (str): hash of the source configuration.
+        """
+        plan = cls(digest)
+        for step in workflow:
+            plan.append(step)
+        return plan
+
+    def append(self,step):
+        """compile and add a workflow step
+
+        Args:
+            step (str list): an annotated workflow command.
+
+        Returns:
+            the compiled `Step`.
+        """
+        step = Step.parse(len(self.steps),step)
+        produces, dependencies = [], set()
+        for _,_,filepath,_ in step.results:
+            if step.gathers: # gathered results depend on their scatter step
+                filepath = re.sub(r'\{(\w+)\*\}', r'{\1}', filepath)
+            producer = self.producers.setdefault(filepath,step.index)
+            if producer == step.index:
+                if filepath not in produces:
+                    produces.append(filepath)
+            else:
+                dependencies.add(producer)
+                consumers = self.consumers.setdefault(filepath,[])
+                if step.index not in consumers:
+                    consumers.append(step.index)
+        for _,_,filepath,_ in step.datasources:
+            self.datasources.setdefault(filepath,[]).append(step.index)
+        step.produces = tuple(produces)
+        step.dependencies = tuple(sorted(dependencies))
+        self.steps.append(step)
+        return step
+
+    @property
+    def wildcards(self):
+        """names of all wildcards of the workflow"""
+        return {n for step in self.steps for n in step.wildcards + step.gathers}
+
+    def expand(self,values):
+        """the plan with its scatter steps expanded into one step per
+        combination of their wildcard values, and their gathered
+        elements into one element per value
+
+        Args:
+            values (dict): maps each wildcard name to its values.
+
+        Returns:
+            the expanded `Plan`, or this plan if it has no wildcards, and a dict
+            mapping each step index to the indices of the steps it expanded into.
+        """
+        if not self.wildcards:
+            return self, {i: [i] for i in range(len(self.steps))}
+        plan, expansions = Plan(self.digest), {}
+        for step in self.steps:
+            expansions[step.index] = []
+            for assignment in step.assignments(values):
+                expanded = plan.append(step.expand(assignment,values))
+                expanded.template = step.index
+                expansions[step.index].append(expanded.index)
+        return plan, expansions
+
+    def dependencies(self,selection=None,pipelines=None):
+        """dict mapping each step index to the set of step indices it depends on
+
+        Args:
+            selection (set): if provided, only these step indices are included.
+            pipelines (dict): if provided, the steps of each pipeline are merged
+              into one node, keyed by the first step of the pipeline.
+        """
+        if selection is None:
+            selection = set(range(len(self.steps)))
+        node = {i: i for i in selection}
+        for head,members in (pipelines or {}).items():
+            for i in members:
+                node[i] = head
+        dependencies = {}
+        for i in sorted(selection):
+            dependencies.setdefault(node[i],set()).update(
+                node[d] for d in self.steps[i].dependencies if d in selection
+            )
+        for n,d in dependencies.items():
+            d.discard(n)
+        return dependencies
+
+    def streams(self,transient):
+        """transient results that can be streamed from their producer to
+        their consumer through a named pipe, instead of being written to disk
+
+        A transient result is streamed when exactly one step consumes it,
+        and the consumer does not also depend on the producer through
+        other steps, as both steps have to run at the same time.
+
+        Args:
+            transient (iterable): result filepaths marked as transient.
+
+        Returns:
+            dict mapping the streamed results to their (producer, consumer) indices.
+        """
+        streams = {}
+        for filepath in transient:
+            consumers = self.consumers.get(filepath,())
+            if filepath not in self.producers or len(consumers) != 1:
+                continue
+            producer, consumer = self.producers[filepath], consumers[0]
+            downstream = self.downstream([producer])
+            if not any(
+                    d != producer and d in downstream
+                    for d in self.steps[consumer].dependencies
+            ):
+                streams[filepath] = (producer, consumer)
+        return streams
+
+    def pipelines(self,streams,selection):
+        """group the selected steps connected by streams into pipelines
+
+        Args:
+            streams (dict): as returned by `streams`.
+            selection (set): indices of the steps being built, streams between
+              a selected and an unselected step are not used.
+
+        Returns:
+            dict mapping the first step of each pipeline to its sorted step indices,
+            empty if merging the pipelines would make the workflow cyclic.
+        """
+        group = {}
+        for producer,consumer in streams.values():
+            if producer in selection and consumer in selection:
+                merged = group.get(producer,{producer}) | group.get(consumer,{consumer})
+                for i in merged:
+                    group[i] = merged
+        pipelines = {min(g): sorted(g) for g in group.values()}
+        # steps of different pipelines could depend on each other in both directions
+        dependencies = self.dependencies(selection,pipelines)
+        pending = {n: len(d) for n,d in dependencies.items()}
+        dependents = {n: [] for n in dependencies}
+        for n,d in dependencies.items():
+            for u in d:
+                dependents[u].append(n)
+        ready = [n for n,c in pending.items() if not c]
+        while ready:
+            for d in dependents[ready.pop()]:
+                pending[d] -= 1
+                if not pending[d]:
+                    ready.append(d)
+        return {} if any(pending.values()) else pipelines
+
+    def producer(self,target):
+        """index of the step producing a result
+
+        Args:
+            target (str): result filepath, relative to the results folder or
+              prefixed with `results/`.
+        """
+        filepath = os.path.normpath(target)
+        if filepath not in self.producers and filepath.startswith('results'+os.sep):
+            filepath = filepath[len('results'+os.sep):]
+        if filepath not in self.producers:
+            raise Exception('no workflow step produces target', target)
+        return self.producers[filepath]
+
+    def closure(self,targets):
+        """minimal set of steps needed to produce the targets
+
+        Args:
+            targets (str list): result filepaths.
+
+        Returns:
+            set of step indices, the producers of the targets and all their upstream steps.
+        """
+        return self.upstream(self.producer(target) for target in targets)
+
+    def upstream(self,indices):
+        """the steps and all steps they directly or indirectly depend on
+
+        Args:
+            indices (iterable): step indices.
+        """
+        selection, stack = set(), list(indices)
+        while stack:
+            i = stack.pop()
+            if i not in selection:
+                selection.add(i)
+                stack.extend(self.steps[i].dependencies)
+        return selection
+
+    def downstream(self,indices):
+        """the steps and all steps directly or indirectly depending on them
+
+        Args:
+            indices (iterable): step indices.
+        """
+        selection = set(indices)
+        for step in self.steps:
+            if selection.intersection(step.dependencies):
+                selection.add(step.index)
+        return selection
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __getitem__(self,index):
+        return self.steps[index]
+
+    @staticmethod
+    def cachefile(reco):
+        return os.path.join(reco.path,'.reconto','plan.json')
+
+    @classmethod
+    def load(cls,reco):
+        """load the configuration and plan of a reconto, from the plan
+        cache if `reconto.yml` did not change since it was compiled
+
+        Args:
+            reco (Reconto): the research compendium.
+
+        Returns:
+            the configuration dict and the compiled `Plan`.
+        """
+        with open(reco.yamlfile,'rb') as f:
+            source = f.read()
+        digest = hashlib.sha256(source).hexdigest()
+        try:
+            with open(cls.cachefile(reco),'rb') as f:
+                version, cached_digest, config, plan = json.load(f)
+            if version == PLAN_VERSION and cached_digest == digest:
+                return config, cls.from_state(plan)
+        except (OSError, ValueError, TypeError, KeyError, IndexError):
+            pass
+        config = load_yaml(source)
+        plan = cls.compile(config['workflow'],digest)
+        cls.save(reco,config,plan)
+        return config, plan
+
+    @classmethod
+    def save(cls,reco,config,plan):
+        """atomically write the plan cache, a configuration that json
+        does not preserve is not cached
+
+        Args:
+            reco (Reconto): the research compendium.
+            config (dict): the configuration the plan was compiled from.
+            plan (Plan): the compiled plan, with the digest of `reconto.yml`.
+        """
+        cachefile = cls.cachefile(reco)
+        try:
+            if not _jsonable(config):
+                raise TypeError('configuration not preserved by json')
+            data = json.dumps([PLAN_VERSION, plan.digest, config, plan.state()])
+        except (TypeError, ValueError):
+            if os.path.exists(cachefile):
+                os.remove(cachefile)
+            return
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(cachefile), suffix='.tmp')
+        with os.fdopen(fd,'wt') as f:
+            f.write(data)
+        os.replace(tmpfile,cachefile)
+
+def _jsonable(node):
+    """if json preserves a configuration node: its dicts only have string
+    keys, and it has no tuples. Other values json cannot encode raise on dumping"""
+    if isinstance(node,dict):
+        return all(isinstance(k,str) and _jsonable(v) for k,v in node.items())
+    if isinstance(node,list):
+        return all(isinstance(v,str) or _jsonable(v) for v in node)
+    return not isinstance(node,tuple)
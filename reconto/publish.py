@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""publish: upload of annotated results to their external locations
+
+Results annotated with an external location (`=https://...=file`) are
+uploaded on a bounded thread pool, streamed in chunks: to a `.part`
+file renamed into place for `file://` locations, and with a `PUT`
+request for `http(s)://` locations. An upload is skipped when the
+remote already has the same content, compared by the digests of the
+compendium hasher: computed for `file://` locations, and read from the
+`X-Reconto-Digest` header, sent along with each upload, for
+`http(s)://` locations. Directory results are uploaded file by file.
+
+`StandIn` is a minimal local HTTP server accepting such uploads, to try
+out or test publishing without a real server.
+"""
+import os, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+class Publisher(object):
+    """Publisher object
+
+    Args:
+        reco (Reconto): the research compendium whose results are published.
+        workers (int): maximum number of concurrent uploads.
+        chunksize (int): bytes read and sent at once.
+        retries (int): attempts per upload, with exponential backoff.
+        timeout (float): seconds without response after which an attempt fails.
+    """
+    def __init__(self,reco,workers=4,chunksize=1<<20,retries=3,timeout=60.):
+        self.reco = reco
+        self.workers = workers
+        self.chunksize = chunksize
+        self.retries = retries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.uploads = {}
+        self.stats = {'files_published': 0, 'files_unchanged': 0, 'bytes_published': 0}
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def publish(self,result,filepath,include=''):
+        """start publishing a result to its annotated location
+
+        Args:
+            result (str): external location of the result.
+            filepath (str): relative path in the results folder.
+            include (str): if not empty, `filepath` completes the `result` location.
+
+        Returns:
+            dict mapping the locations of the result files to futures resolving
+            to 'uploaded', or 'unchanged' if the remote already had the content.
+        """
+        from reconto.fetch import Fetcher
+        location = Fetcher.location(result,filepath,include)
+        path = os.path.join(self.reco.path,'results',filepath)
+        files = {location: path}
+        if os.path.isdir(path):
+            files = {
+                location.rstrip('/')+'/'+os.path.relpath(
+                    os.path.join(root,name),path
+                ).replace(os.sep,'/'): os.path.join(root,name)
+                for root,dirs,names in os.walk(path) for name in names
+            }
+        with self.lock:
+            for location,path in files.items():
+                if location not in self.uploads:
+                    self.uploads[location] = self.pool.submit(self.upload,path,location)
+            return {location: self.uploads[location] for location in files}
+
+    def publish_step(self,step,streamed=()):
+        """start publishing the annotated results a workflow step produces
+
+        Args:
+            step (Step): compiled workflow step.
+            streamed (iterable): results the step streamed, which are not published.
+
+        Returns:
+            dict as returned by `publish`.
+        """
+        futures = {}
+        for _,result,filepath,include in step.results:
+            if result and filepath in step.produces and filepath not in streamed:
+                futures.update(self.publish(result,filepath,include))
+        return futures
+
+    def upload(self,path,location):
+        """upload a file unless the remote already has its content
+
+        Args:
+            path (str): file path.
+            location (str): `http(s)://` or `file://` location.
+        """
+        digest = self.reco.hasher.hash(path)
+        for attempt in range(self.retries):
+            try:
+                if self.remote_digest(location) == digest:
+                    status = 'unchanged'
+                else:
+                    self._stream(path,location,digest)
+                    status = 'uploaded'
+                break
+            except OSError:
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(2**attempt)
+        with self.lock:
+            self.stats['files_published' if status == 'uploaded' else 'files_unchanged'] += 1
+        return status
+
+    def remote_digest(self,location):
+        """digest of the content at a location, or None if it is not known"""
+        if location.startswith('file://'):
+            from urllib.request import url2pathname
+            path = url2pathname(location[len('file://'):])
+            return self.reco.hasher.hash(path) if os.path.isfile(path) else None
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+        try:
+            with urlopen(Request(location, method='HEAD'), timeout=self.timeout) as response:
+                return response.headers.get('X-Reconto-Digest')
+        except HTTPError as e:
+            if e.code in (404, 405):
+                return None
+            raise
+
+    def chunks(self,f):
+        """read a file by chunks, counting the published bytes"""
+        for chunk in iter(lambda: f.read(self.chunksize), b''):
+            yield chunk
+            with self.lock:
+                self.stats['bytes_published'] += len(chunk)
+
+    def _stream(self,path,location,digest):
+        with open(path,'rb') as f:
+            if location.startswith('file://'):
+                from urllib.request import url2pathname
+                destination = url2pathname(location[len('file://'):])
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                with open(destination+'.part','wb') as part:
+                    for chunk in self.chunks(f):
+                        part.write(chunk)
+                os.replace(destination+'.part',destination)
+                return
+            from urllib.request import Request, urlopen
+            request = Request(location, data=self.chunks(f), method='PUT', headers={
+                'Content-Length': str(os.fstat(f.fileno()).st_size),
+                'Content-Type': 'application/octet-stream',
+                'X-Reconto-Digest': digest
+            })
+            urlopen(request, timeout=self.timeout).close()
+
+    def wait(self):
+        """wait for the started uploads
+
+        Returns:
+            dict mapping the published locations to their status.
+
+        Raises RuntimeError with the exception of each failed upload.
+        """
+        with self.lock:
+            uploads = dict(self.uploads)
+        status, failed = {}, {}
+        for location,future in uploads.items():
+            try:
+                status[location] = future.result()
+            except Exception as e:
+                failed[location] = e
+        if failed:
+            raise RuntimeError('results could not be published',failed)
+        return status
+
+    def close(self):
+        """wait for the running uploads and shut down the pool"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        with self.lock:
+            self.uploads = {}
+
+class StandIn(ThreadingHTTPServer):
+    """StandIn object
+
+    Local HTTP server storing the files uploaded with `PUT` in a directory
+    and serving them back, with the digest sent with each upload, e.g.:
+
+        server = StandIn('/tmp/remote', ('127.0.0.1', 8000))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    Args:
+        directory (str): directory the uploaded files are stored in.
+        address (tuple): (host, port) to listen on, port 0 for any free port.
+    """
+    def __init__(self,directory,address=('127.0.0.1',0)):
+        self.directory = directory
+        self.digests = {}
+        super().__init__(address,StandInHandler)
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """request handler of `StandIn`"""
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args, directory=args[2].directory, **kwargs)
+
+    def end_headers(self):
+        digest = self.server.digests.get(self.translate_path(self.path))
+        if digest is not None and self.command in ('GET', 'HEAD'):
+            self.send_header('X-Reconto-Digest', digest)
+        super().end_headers()
+
+    def do_PUT(self):
+        path = self.translate_path(self.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        length = int(self.headers.get('Content-Length') or 0)
+        with open(path+'.part','wb') as f:
+            while length:
+                chunk = self.rfile.read(min(length,1<<20))
+                if not chunk:
+                    break
+                f.write(chunk)
+                length -= len(chunk)
+        if length:
+            os.remove(path+'.part')
+            self.send_error(400, 'upload interrupted')
+            return
+        os.replace(path+'.part',path)
+        self.server.digests[path] = self.headers.get('X-Reconto-Digest')
+        self.send_response(201)
+        self.send_header('Content-Length','0')
+        self.end_headers()
+
+    def log_message(self,format,*args):
+        pass
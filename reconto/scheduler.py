@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""scheduler: dependency-aware execution of workflow steps
+
+The workflow steps of a reconto form a directed acyclic graph, derived
+from the datasource and result annotations by the compiled `Plan`.
+
+The scheduler submits every step as soon as all the steps it depends
+on have finished, keeping at most `jobs` steps running at any time.
+Steps declaring the cpus and memory they need are bin-packed against
+the machine capacity, largest demands first. A run can be cancelled,
+e.g. when its inputs changed again in watch mode. Nodes can wait on
+futures before they start, e.g. the preparation of their execution
+environment, while the other ready nodes are started.
+"""
+import os, re, logging
+from collections import deque, namedtuple
+from concurrent.futures import wait, FIRST_COMPLETED
+
+size_units = {'': 1, 'b': 1, 'k': 1<<10, 'm': 1<<20, 'g': 1<<30, 't': 1<<40}
+
+def parse_size(size):
+    """bytes of a size given as a number or as a string with a unit,
+    e.g. `512m` or `4g`"""
+    if isinstance(size,str):
+        match = re.fullmatch(r'\s*([\d.]+)\s*([bkmgt]?)i?b?\s*', size.lower())
+        if not match:
+            raise ValueError('invalid size', size)
+        size = float(match.group(1))*size_units[match.group(2)]
+    return int(size)
+
+class Resources(namedtuple('Resources', ('cpus', 'memory'))):
+    """Resources needed by a workflow step, or available on the machine
+
+    Args:
+        cpus (float): number of cores, 0 if not declared.
+        memory (int): bytes of memory, 0 if not declared.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls,spec,default=None):
+        """resources from a `reconto.yml` declaration
+
+        Args:
+            spec (dict): with optional `cpus` and `memory`, the memory in bytes
+              or as a string with a unit, e.g. `512m` or `4g`.
+            default (Resources): for what spec does not declare.
+        """
+        default = default or cls(0,0)
+        return cls(
+            float(spec.get('cpus',default.cpus)),
+            parse_size(spec.get('memory',default.memory))
+        )
+
+    @classmethod
+    def available(cls):
+        """cores and physical memory of the machine"""
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 1
+        try:
+            memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (AttributeError, ValueError, OSError):
+            memory = 0
+        return cls(cpus, memory)
+
+    def __add__(self,other):
+        return Resources(self.cpus+other.cpus, self.memory+other.memory)
+
+    def fits(self,capacity):
+        """if these resources fit in capacity, where 0 capacity is unlimited"""
+        return all(
+            not available or needed <= available
+            for needed,available in zip(self,capacity)
+        )
+
+class Scheduler(object):
+    """Scheduler object
+
+    Runs nodes of a dependency graph concurrently, starting
+    a node only when all its dependencies have succeeded.
+
+    Args:
+        dependencies (dict): maps each node to the set of nodes it depends on.
+        jobs (int): maximum number of nodes running concurrently.
+        keep_going (bool): if True, independent nodes keep being scheduled after a
+          failure, only the downstream nodes of a failed node are skipped.
+          If False (fail-fast), no new nodes are started after the first failure.
+        resources (dict): maps nodes to the `Resources` they need, nodes not
+          in it need none.
+        capacity (Resources): resources available to the running nodes,
+          defaults to the machine's.
+    """
+    def __init__(self,dependencies,jobs=1,keep_going=False,resources=None,capacity=None):
+        self.dependencies = {n: set(d) for n,d in dependencies.items()}
+        self.dependents = {n: set() for n in self.dependencies}
+        for n,d in self.dependencies.items():
+            for u in d:
+                self.dependents[u].add(n)
+        self.jobs = max(1,int(jobs))
+        self.keep_going = keep_going
+        self.resources = resources or {}
+        self.capacity = capacity or Resources.available()
+
+    def downstream(self,node):
+        """all nodes that directly or indirectly depend on `node`"""
+        nodes, stack = set(), [node]
+        while stack:
+            for d in self.dependents[stack.pop()]:
+                if d not in nodes:
+                    nodes.add(d)
+                    stack.append(d)
+        return nodes
+
+    def pack(self,ready,running):
+        """pop the ready nodes that can start next
+
+        Nodes are considered largest memory and cpu demands first, and
+        started while they fit in the capacity left by the running nodes.
+        A node that does not fit in the whole capacity starts on its own.
+
+        Args:
+            ready (deque): nodes whose dependencies have finished.
+            running (iterable): nodes that are running.
+
+        Returns:
+            list of the nodes to start.
+        """
+        if not self.resources:
+            started = []
+            while ready and len(started) + len(running) < self.jobs:
+                started.append(ready.popleft())
+            return started
+        demand = lambda n: self.resources.get(n,Resources(0,0))
+        used = Resources(0,0)
+        for n in running:
+            used += demand(n)
+        started, busy = [], bool(running)
+        for n in sorted(ready, key=lambda n: demand(n)[::-1], reverse=True):
+            if len(started) + len(running) >= self.jobs:
+                break
+            if not busy or (used + demand(n)).fits(self.capacity):
+                started.append(n)
+                used += demand(n)
+                busy = True
+        for n in started:
+            ready.remove(n)
+        return started
+
+    def run(self,submit,cancel=None,on_cancel=None,waiting=None):
+        """run all nodes
+
+        Args:
+            submit (callable): called with a node, should start executing it
+              and return a `concurrent.futures.Future`.
+            cancel (threading.Event): when set, no new nodes are started, and
+              the run ends once the running nodes have ended.
+            on_cancel (callable): called once when the cancel event is noticed,
+              to stop the running nodes.
+            waiting (callable): called with a ready node, returns the futures
+              that have to be done before it starts.
+
+        Returns:
+            dict mapping each node to its future's result.
+
+        Raises the exception of the failed node in fail-fast mode, or a
+        RuntimeError listing all failed and skipped nodes in keep-going mode.
+        A cancelled run raises a RuntimeError listing the nodes that did complete.
+        """
+        pending = {n: len(d) for n,d in self.dependencies.items()}
+        ready = deque(n for n,c in pending.items() if not c)
+        done, skipped, failed, results = set(), set(), {}, {}
+        running, cancelled = {}, False
+        while True:
+            if cancel is not None and cancel.is_set() and not cancelled:
+                cancelled = True
+                if on_cancel is not None:
+                    on_cancel()
+            held = set()
+            if not cancelled and (self.keep_going or not failed):
+                if waiting is not None:
+                    waits = {n: [f for f in waiting(n) if not f.done()] for n in ready}
+                    held = {f for futures in waits.values() for f in futures}
+                    blocked = deque(n for n in ready if waits[n])
+                    ready = deque(n for n in ready if not waits[n])
+                for n in self.pack(ready, list(running.values())):
+                    running[submit(n)] = n
+                if held:
+                    ready.extend(blocked)
+            if not running and not held:
+                break
+            finished, _ = wait(
+                set(running) | held, timeout=None if cancel is None or cancelled else .1,
+                return_when=FIRST_COMPLETED
+            )
+            for future in finished:
+                if future not in running:
+                    continue # a node can start
+                n = running.pop(future)
+                exception = future.exception()
+                if exception is not None:
+                    if not cancelled:
+                        logging.error('workflow step %s failed: %s', n, exception)
+                    failed[n] = exception
+                    skipped |= self.downstream(n)
+                    continue
+                done.add(n)
+                results[n] = future.result()
+                for d in self.dependents[n]:
+                    pending[d] -= 1
+                    if not pending[d] and d not in skipped:
+                        ready.append(d)
+        if cancelled:
+            raise RuntimeError('workflow build cancelled',sorted(done))
+        if failed:
+            if not self.keep_going:
+                raise next(iter(failed.values()))
+            raise RuntimeError(
+                'workflow steps have failed',
+                failed, sorted(skipped - set(failed))
+            )
+        unreachable = set(self.dependencies) - done
+        if unreachable:
+            raise RuntimeError('workflow contains a dependency cycle',sorted(unreachable))
+        return results
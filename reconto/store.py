@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""store: machine-wide content-addressed store of step results
+
+The results of built steps are kept once per content digest under
+`objects/`, and indexed by step fingerprint under `steps/`, in a
+directory shared by the compendia of a machine, set with
+`RECONTO_STORE`. A step whose fingerprint is in the store is restored
+instead of executed, e.g. after checking out another commit, in a clone
+or in a sibling compendium: by reflink where the filesystem supports
+it, otherwise by hardlink, or by copy across filesystems.
+
+Objects are read-only, as restored hardlinks share them with the
+results folders. Results sharing their files with the store are
+unlinked before their step executes again, and an object that got
+changed in place anyway is detected by its size and mtime, and
+discarded. The store is kept under `RECONTO_STORE_SIZE` by evicting
+the least recently used objects.
+"""
+import os, json, time, uuid, shutil, tempfile
+
+#: linux ioctl sharing the extents of a file with another (reflink)
+FICLONE = 0x40049409
+
+def clone(source,destination):
+    """create destination with the content of source, sharing its storage
+    when possible
+
+    Returns:
+        how the file was cloned: 'reflink', 'hardlink' or 'copy'.
+    """
+    try:
+        import fcntl
+        with open(source,'rb') as src, open(destination,'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        if os.path.lexists(destination):
+            os.remove(destination)
+    try:
+        os.link(source,destination)
+        return 'hardlink'
+    except OSError:
+        shutil.copyfile(source,destination)
+        return 'copy'
+
+def remove(path):
+    """remove a file or directory, if it exists"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def unshare(path):
+    """unlink the files of a result that have other links, such as store
+    objects, so that executing its step again writes new files instead of
+    changing the linked ones in place"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root,dirs,files in os.walk(path):
+            for name in files:
+                unshare(os.path.join(root,name))
+    elif os.path.isfile(path) and os.lstat(path).st_nlink > 1:
+        os.remove(path)
+
+class ObjectStore(object):
+    """ObjectStore object
+
+    Args:
+        directory (str): root directory of the store.
+        size (int): bytes the objects of the store are kept under, by
+          evicting the least recently used ones, 0 for unbounded.
+    """
+    def __init__(self,directory,size=0):
+        self.directory = directory
+        self.size = size
+
+    @classmethod
+    def configured(cls):
+        """the store set with `RECONTO_STORE` and bounded by `RECONTO_STORE_SIZE`
+        (e.g. `50g`), or None if `RECONTO_STORE` is not set"""
+        from reconto.scheduler import parse_size
+        directory = os.environ.get('RECONTO_STORE')
+        if not directory:
+            return None
+        return cls(
+            os.path.expanduser(directory), parse_size(os.environ.get('RECONTO_STORE_SIZE') or 0)
+        )
+
+    def object_path(self,digest):
+        return os.path.join(self.directory,'objects',digest[:2],digest)
+
+    def entry_path(self,fingerprint):
+        return os.path.join(self.directory,'steps',fingerprint[:2],fingerprint+'.json')
+
+    def get(self,fingerprint):
+        """store entry of a step, or None"""
+        try:
+            with open(self.entry_path(fingerprint)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self,fingerprint,root,digests,hasher,wall_time=None):
+        """store the results of a built step
+
+        Args:
+            fingerprint (str): the step fingerprint.
+            root (str): the results folder.
+            digests (dict): maps the result filepaths the step produced to
+              their digests.
+            hasher (Hasher): hashes the files of result directories.
+            wall_time (float): seconds the step execution took.
+        """
+        entry = {
+            'outputs': {
+                filepath: self.ingest(os.path.join(root,filepath),digest,hasher)
+                for filepath,digest in digests.items()
+            },
+            'digests': digests,
+            'wall_time': wall_time
+        }
+        entryfile = self.entry_path(fingerprint)
+        os.makedirs(os.path.dirname(entryfile), exist_ok=True)
+        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(entryfile), suffix='.tmp')
+        with os.fdopen(fd,'wt') as f:
+            json.dump(entry,f)
+        os.replace(tmpfile,entryfile)
+
+    def ingest(self,path,digest,hasher):
+        """store a result file or directory
+
+        Returns:
+            its tree: ['dir', {name: tree}] for a directory, or
+            ['file', digest, size, mtime_ns, executable] for a file.
+        """
+        if os.path.isdir(path):
+            return ['dir', {
+                entry.name: self.ingest(
+                    entry.path, None if entry.is_dir() else hasher.hash(entry.path), hasher
+                ) for entry in os.scandir(path)
+            }]
+        obj = self.object_path(digest)
+        executable = bool(os.stat(path).st_mode & 0o100)
+        if not os.path.exists(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            tmpfile = '{}.{}.tmp'.format(obj,uuid.uuid4().hex)
+            clone(path,tmpfile)
+            os.chmod(tmpfile, 0o555 if executable else 0o444)
+            os.replace(tmpfile,obj)
+        st = os.stat(obj)
+        os.utime(obj, ns=(time.time_ns(), st.st_mtime_ns))
+        return ['file', digest, st.st_size, st.st_mtime_ns, executable]
+
+    def complete(self,tree):
+        """if all objects of a tree are in the store and unaltered,
+        altered objects are discarded"""
+        if tree[0] == 'dir':
+            return all(self.complete(child) for child in tree[1].values())
+        _, digest, size, mtime, executable = tree
+        obj = self.object_path(digest)
+        try:
+            st = os.stat(obj)
+        except FileNotFoundError:
+            return False
+        if (st.st_size, st.st_mtime_ns) != (size, mtime):
+            remove(obj)
+            return False
+        return True
+
+    def has(self,fingerprint,outputs):
+        """if the results of a step can be restored"""
+        entry = self.get(fingerprint)
+        return entry is not None and set(entry['outputs']) == set(outputs) and all(
+            self.complete(tree) for tree in entry['outputs'].values()
+        )
+
+    def restore(self,fingerprint,root,outputs,hasher=None):
+        """restore the results of a step from the store
+
+        Args:
+            fingerprint (str): the step fingerprint.
+            root (str): the results folder.
+            outputs (iterable): the result filepaths the step produces.
+            hasher (Hasher): if provided, indexes the digests of the restored files.
+
+        Returns:
+            the store entry, with the `digests` and `wall_time` of the step,
+            or None if the step is not in the store.
+        """
+        entry = self.get(fingerprint)
+        if entry is None or set(entry['outputs']) != set(outputs) or not all(
+                self.complete(tree) for tree in entry['outputs'].values()
+        ):
+            return None
+        try:
+            for filepath,tree in entry['outputs'].items():
+                self.materialize(tree,os.path.join(root,filepath),hasher)
+        except FileNotFoundError:
+            return None # evicted meanwhile
+        return entry
+
+    def materialize(self,tree,path,hasher=None):
+        """recreate a stored file or directory at path"""
+        remove(path)
+        if tree[0] == 'dir':
+            os.makedirs(path)
+            for name,child in tree[1].items():
+                self.materialize(child,os.path.join(path,name),hasher)
+            return
+        _, digest, size, mtime, executable = tree
+        obj = self.object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if clone(obj,path) != 'hardlink':
+            os.chmod(path, 0o755 if executable else 0o644)
+            os.utime(path, ns=(time.time_ns(), mtime))
+        os.utime(obj, ns=(time.time_ns(), mtime)) # last use, for eviction
+        if hasher is not None:
+            hasher.remember(path,digest)
+
+    def objects(self):
+        """all objects, as (last use, size, path), least recently used first"""
+        objects = []
+        for root,dirs,files in os.walk(os.path.join(self.directory,'objects')):
+            for name in files:
+                path = os.path.join(root,name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                objects.append((st.st_atime_ns, st.st_size, path))
+        return sorted(objects)
+
+    def entries(self):
+        """fingerprints and paths of all step entries"""
+        for root,dirs,files in os.walk(os.path.join(self.directory,'steps')):
+            for name in files:
+                if name.endswith('.json'):
+                    yield name[:-len('.json')], os.path.join(root,name)
+
+    def stats(self):
+        """number of step entries, objects and bytes in the store"""
+        objects = self.objects()
+        return {
+            'steps': sum(1 for _ in self.entries()), 'objects': len(objects),
+            'bytes': sum(size for _,size,_ in objects)
+        }
+
+    def gc(self,size=None,tmp_age=3600):
+        """collect garbage: evict the least recently used objects until the
+        store holds at most size bytes, remove the step entries missing
+        objects, and the temporary files left by interrupted writes
+
+        Args:
+            size (int): bytes to keep the objects under, defaults to the
+              store's size, 0 for unbounded.
+            tmp_age (float): seconds after which a temporary file is left over.
+
+        Returns:
+            dict with the numbers of removed objects, bytes and step entries.
+        """
+        size = self.size if size is None else size
+        removed = {'objects': 0, 'bytes': 0, 'steps': 0}
+        objects = []
+        for atime,objsize,path in self.objects():
+            if path.endswith('.tmp'):
+                if time.time() - os.stat(path).st_mtime > tmp_age:
+                    remove(path)
+                continue
+            objects.append((atime,objsize,path))
+        total = sum(objsize for _,objsize,_ in objects)
+        for atime,objsize,path in objects:
+            if not size or total <= size:
+                break
+            remove(path)
+            total -= objsize
+            removed['objects'] += 1
+            removed['bytes'] += objsize
+        for fingerprint,entryfile in list(self.entries()):
+            entry = self.get(fingerprint)
+            if entry is None or not all(
+                    self.complete(tree) for tree in entry['outputs'].values()
+            ):
+                remove(entryfile)
+                removed['steps'] += 1
+        return removed
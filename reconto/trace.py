@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""trace: timing spans and I/O counters of builds
+
+During a build, every phase of every step (preparing inputs, loading the
+execution environment, pulling images, creating containers, executing,
+stopping, checking results) is recorded as a span. The trace is saved
+per build in `.reconto/traces/`, where only the last `KEEP_TRACES` are
+kept, and can be summarized with `reconto profile`, or exported as
+Chrome trace-event JSON to be inspected in chrome://tracing or Perfetto.
+"""
+import os, json, time, threading
+
+#: number of build traces kept, older traces are removed when one is saved
+KEEP_TRACES = 50
+
+class Span(object):
+    """Span object
+
+    A timed phase, recorded in its tracer when ended.
+
+    Args:
+        tracer (Tracer): the tracer to record the span in.
+        name (str): name of the phase.
+        step (int): index of the workflow step, or None for build level spans.
+        args (dict): extra information on the span.
+    """
+    __slots__ = ('tracer', 'name', 'step', 'args', 'start')
+
+    def __init__(self,tracer,name,step=None,args=None):
+        self.tracer = tracer
+        self.name = name
+        self.step = step
+        self.args = args
+        self.start = time.perf_counter_ns()
+
+    def end(self,**args):
+        """end the span, recording extra args"""
+        if args:
+            self.args = dict(self.args or {}, **args)
+        self.tracer.spans.append((
+            self.name, self.step, (self.start-self.tracer.origin)/1000,
+            (time.perf_counter_ns()-self.start)/1000, threading.get_ident(), self.args
+        ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end()
+
+class Tracer(object):
+    """Tracer object
+
+    Collects the spans and counters of one build. Recording a span only
+    appends a tuple to a list, so tracing can stay enabled on the hot path.
+    """
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.started = time.time()
+        self.spans = []
+        self.counters = {}
+        self.steps = {}
+        self.lock = threading.Lock()
+
+    def span(self,name,step=None,**args):
+        """start a span, to be ended with `end()` or used as context manager"""
+        return Span(self,name,step,args or None)
+
+    def count(self,name,value=1):
+        """add to an I/O counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name,0) + value
+
+    def add_step(self,step):
+        """record a workflow step and its dependencies"""
+        self.steps[step.index] = {
+            'command': ' '.join(step.annotated),
+            'dependencies': list(step.dependencies)
+        }
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'spans': [
+                {'name': n, 'step': s, 'ts': ts, 'dur': dur, 'tid': tid, 'args': a}
+                for n,s,ts,dur,tid,a in self.spans
+            ],
+            'counters': self.counters,
+            'steps': {str(i): step for i,step in self.steps.items()}
+        }
+
+    def save(self,directory,keep=None):
+        """save the trace as json in directory, removing the oldest traces
+
+        Args:
+            directory (str): the traces directory.
+            keep (int): number of traces kept, defaults to `KEEP_TRACES`.
+
+        Returns:
+            the trace file path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        tracefile = os.path.join(
+            directory, time.strftime('%Y%m%d-%H%M%S',time.localtime(self.started))
+            + '-{}.json'.format(os.getpid())
+        )
+        with open(tracefile,'wt') as f:
+            json.dump(self.to_dict(),f)
+        traces = sorted(f for f in os.listdir(directory) if f.endswith('.json'))
+        for name in traces[:max(0,len(traces)-(keep or KEEP_TRACES))]:
+            if name != os.path.basename(tracefile):
+                try:
+                    os.remove(os.path.join(directory,name))
+                except FileNotFoundError:
+                    pass # removed by a concurrent build
+        return tracefile
+
+class NullTracer(object):
+    """Tracer that records nothing"""
+    class NullSpan(object):
+        def end(self,**args): pass
+        def __enter__(self): return self
+        def __exit__(self, exc_type, exc_value, traceback): pass
+    _span = NullSpan()
+
+    def span(self,name,step=None,**args):
+        return self._span
+
+    def count(self,name,value=1):
+        pass
+
+    def add_step(self,step):
+        pass
+
+def latest_trace(directory):
+    """path of the most recent trace in directory"""
+    traces = sorted(f for f in os.listdir(directory) if f.endswith('.json'))
+    if not traces:
+        raise FileNotFoundError('no build traces available', directory)
+    return os.path.join(directory,traces[-1])
+
+def step_durations(trace):
+    """wall time of each step from its first span start to its last span end,
+    in microseconds, together with the time spent per span name"""
+    extents, phases = {}, {}
+    for span in trace['spans']:
+        if span['step'] is None: continue
+        step = str(span['step'])
+        start, end = extents.get(step,(span['ts'],span['ts']+span['dur']))
+        extents[step] = (min(start,span['ts']), max(end,span['ts']+span['dur']))
+        phases.setdefault(step,{})
+        phases[step][span['name']] = phases[step].get(span['name'],0) + span['dur']
+    return {s: e[1]-e[0] for s,e in extents.items()}, phases
+
+def critical_path(trace):
+    """longest chain of dependent steps, weighted by their durations
+
+    Returns:
+        the list of step indices on the critical path, and its total duration.
+    """
+    durations, _ = step_durations(trace)
+    # steps only depend on earlier steps, so workflow order is topological
+    totals, previous = {}, {}
+    for step in sorted(trace['steps'], key=int):
+        upstream = [
+            str(d) for d in trace['steps'][step]['dependencies'] if str(d) in totals
+        ]
+        previous[step] = max(upstream, key=totals.get, default=None)
+        totals[step] = durations.get(step,0) + (
+            totals[previous[step]] if previous[step] is not None else 0
+        )
+    if not totals:
+        return [], 0
+    step = max(totals, key=totals.get)
+    total, path = totals[step], []
+    while step is not None:
+        path.append(step)
+        step = previous[step]
+    return path[::-1], total
+
+def chrome_events(trace):
+    """the trace as a Chrome trace-event list"""
+    events = [
+        {
+            'name': span['name'], 'ph': 'X', 'ts': span['ts'], 'dur': span['dur'],
+            'pid': 0, 'tid': 0 if span['step'] is None else span['step']+1,
+            'args': span['args'] or {}
+        } for span in trace['spans']
+    ]
+    for step,info in trace['steps'].items():
+        events.append({
+            'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': int(step)+1,
+            'args': {'name': 'step {}: {}'.format(step,info['command'])}
+        })
+    events.append({
+        'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': 0, 'args': {'name': 'build'}
+    })
+    for name,value in trace['counters'].items():
+        events.append({
+            'name': name, 'ph': 'C', 'ts': 0, 'pid': 0, 'args': {name: value}
+        })
+    return events
+
+def report(trace,top=10):
+    """print the critical path and the slowest steps of a trace"""
+    durations, phases = step_durations(trace)
+    build = [s['dur'] for s in trace['spans'] if s['name'] == 'build']
+    if build:
+        print('build: {:.3f}s'.format(build[0]/1e6))
+    path, total = critical_path(trace)
+    print('critical path: {:.3f}s'.format(total/1e6))
+    for step in path:
+        print('  {:>5} {:>10.3f}s  {}'.format(
+            step, durations.get(step,0)/1e6, trace['steps'][step]['command']
+        ))
+    print('slowest steps:')
+    for step in sorted(durations, key=durations.get, reverse=True)[:top]:
+        print('  {:>5} {:>10.3f}s  {}'.format(
+            step, durations[step]/1e6, trace['steps'][step]['command']
+        ))
+        for name,dur in sorted(phases[step].items(), key=lambda p: -p[1]):
+            print('          {:>10.3f}s  {}'.format(dur/1e6,name))
+    if trace['counters']:
+        print('counters:')
+        for name,value in sorted(trace['counters'].items()):
+            print('  {}: {}'.format(name,value))
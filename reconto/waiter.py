@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""waiter: asynchronous waiting on running workflow step executions
+
+A single background thread multiplexes all running executions: it
+streams their output to their log files as it becomes available,
+enforces their timeouts and resolves their futures with an
+`ExecResult` once they exit. Cancelling the future of an execution
+kills it. This way many concurrently running
+containers or processes do not each need a blocked thread.
+"""
+import collections, os, selectors, struct, sys, threading, time
+from concurrent.futures import Future
+
+ExecResult = collections.namedtuple(
+    'ExecResult', ('exit_code', 'wall_time', 'log', 'timed_out')
+)
+ExecResult.__doc__ = """Result of executing a workflow step command
+
+Args:
+    exit_code (int): exit code of the command.
+    wall_time (float): seconds between start and exit.
+    log (str): path of the file with the streamed stdout/stderr, or None.
+    timed_out (bool): True if the command was killed after its timeout.
+"""
+
+class Job(object):
+    """Job object
+
+    A running execution watched by the `Waiter`.
+    Inheriting jobs define `poll` and `kill`, and if their output needs
+    to be streamed by the waiter, a selectable `fileobj` and `read`.
+
+    Args:
+        log (str): path of the log file, if None output goes to stdout.
+        timeout (float): seconds after which the job is killed.
+    """
+    fileobj = None
+
+    def __init__(self,log=None,timeout=None):
+        self.log = log
+        self.start = time.monotonic()
+        self.deadline = self.start + timeout if timeout else None
+        self.timed_out = False
+        self.killed = False
+        self.eof = self.fileobj is None
+        self.future = Future()
+        self.logfile = open(log,'wb') if log else None
+
+    def write(self,data):
+        """write execution output to the log"""
+        if self.logfile:
+            self.logfile.write(data)
+            self.logfile.flush()
+        else:
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+
+    def read(self):
+        """read available output, should return False at end of stream"""
+        return False
+
+    def poll(self):
+        """exit code, or None if still running"""
+        raise NotImplementedError
+
+    def kill(self):
+        raise NotImplementedError
+
+    def close(self):
+        if self.logfile:
+            self.logfile.close()
+
+    def result(self,exit_code):
+        return ExecResult(
+            exit_code, time.monotonic()-self.start, self.log, self.timed_out
+        )
+
+class ProcessJob(Job):
+    """Job for a local subprocess, whose output is directly
+    redirected by the OS to the log file. Where available, a pidfd of
+    the process is selected on, so that its exit is noticed immediately
+    instead of at the next poll.
+
+    Args:
+        popen (callable): called with the stdout file object, should
+          start and return the `subprocess.Popen` process.
+    """
+    def __init__(self,popen,log=None,timeout=None):
+        super().__init__(log,timeout)
+        self.process = popen(self.logfile)
+        try:
+            self.fileobj = os.pidfd_open(self.process.pid)
+            self.eof = False
+        except (AttributeError, OSError):
+            pass
+
+    def poll(self):
+        return self.process.poll()
+
+    def close(self):
+        super().close()
+        if self.fileobj is not None:
+            os.close(self.fileobj)
+
+    def kill(self):
+        import os, signal
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            self.process.kill()
+
+class StreamJob(Job):
+    """Job whose output is read from a docker attach/exec socket,
+    demultiplexing the docker stream frames.
+
+    Args:
+        sock: the docker raw stream socket.
+        poll (callable): returns the exit code, called once the stream ended.
+        kill (callable): kills the execution.
+        tty (bool): if True the stream is not multiplexed.
+    """
+    header = struct.Struct('>BxxxL')
+
+    def __init__(self,sock,poll,kill,log=None,timeout=None,tty=False):
+        self.fileobj = sock
+        super().__init__(log,timeout)
+        self.poll, self.kill = poll, kill
+        self.tty = tty
+        self.buffer = b''
+
+    def recv(self):
+        try:
+            from docker.utils.socket import read
+            return read(self.fileobj, 65536)
+        except ImportError:
+            return self.fileobj.recv(65536)
+
+    def read(self):
+        data = self.recv()
+        if not data:
+            return False
+        if self.tty:
+            self.write(data)
+            return True
+        self.buffer += data
+        while len(self.buffer) >= self.header.size:
+            _, size = self.header.unpack_from(self.buffer)
+            if len(self.buffer) < self.header.size + size:
+                break
+            self.write(self.buffer[self.header.size:self.header.size+size])
+            self.buffer = self.buffer[self.header.size+size:]
+        return True
+
+    def close(self):
+        super().close()
+        self.fileobj.close()
+
+class Waiter(object):
+    """Waiter object
+
+    Background thread watching all running jobs.
+
+    Args:
+        interval (float): seconds between polls of jobs without pending output.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self,interval=.05):
+        self.interval = interval
+        self.jobs = set()
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.thread = None
+
+    @classmethod
+    def shared(cls):
+        """the process wide waiter"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def watch(self,job):
+        """start watching a job
+
+        Returns:
+            the job's future, resolving to an `ExecResult`.
+        """
+        with self.lock:
+            self.jobs.add(job)
+            if job.fileobj is not None:
+                self.selector.register(job.fileobj, selectors.EVENT_READ, job)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='reconto-waiter', daemon=True
+                )
+                self.thread.start()
+        return job.future
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.jobs:
+                    self.thread = None
+                    return
+                jobs = list(self.jobs)
+                streaming = bool(self.selector.get_map())
+            if streaming:
+                events = self.selector.select(self.interval)
+            else:
+                events = ()
+                time.sleep(self.interval)
+            for key, _ in events:
+                self.handle(key.data, key.data.read)
+            now = time.monotonic()
+            for job in jobs:
+                cancelled = job.future.cancelled()
+                if job.future.done() and not cancelled:
+                    continue
+                if not job.killed and (
+                        cancelled or job.deadline and now > job.deadline
+                ):
+                    job.killed = True
+                    job.timed_out = not cancelled
+                    self.handle(job, job.kill)
+                if job.eof:
+                    self.handle(job, lambda: self.finish(job, job.poll()))
+
+    def handle(self,job,action):
+        """run a job action, failing the job if it raises"""
+        try:
+            if action() is False:
+                self.unregister(job)
+                job.eof = True
+        except Exception as e:
+            self.finish(job, None, e)
+
+    def unregister(self,job):
+        with self.lock:
+            if job.fileobj is not None and job.fileobj in self.selector.get_map():
+                self.selector.unregister(job.fileobj)
+
+    def finish(self,job,exit_code,exception=None):
+        if exception is None and exit_code is None:
+            return
+        self.unregister(job)
+        with self.lock:
+            self.jobs.discard(job)
+        try:
+            job.close()
+        except Exception:
+            pass
+        if job.future.cancelled():
+            return
+        if exception is not None:
+            job.future.set_exception(exception)
+        else:
+            job.future.set_result(job.result(exit_code))
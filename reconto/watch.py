@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""watch: incremental rebuilds on file changes
+
+`reconto watch` monitors the data folder, the scripts kept in the
+compendium and `reconto.yml`, with inotify when available and by
+polling file stats otherwise. Bursts of changes are debounced, and
+only the steps downstream of what changed are rebuilt. A rebuild that
+is still running when new changes arrive is cancelled, and its steps
+are rebuilt together with the newly affected ones.
+"""
+import os, time, select, struct, logging, threading
+
+class Watcher(object):
+    """Watcher object
+
+    Reports changed files in a set of watched directories.
+
+    Args:
+        directories (dict): maps each directory to watch to True if its
+          subdirectories are watched as well.
+        interval (float): seconds between polls when inotify is not available.
+        poll (bool): if True, poll even when inotify is available.
+    """
+    def __init__(self,directories,interval=.5,poll=False):
+        self.directories = directories
+        self.interval = interval
+        self.inotify = None if poll else Inotify.create()
+        if self.inotify is not None:
+            for directory,recursive in directories.items():
+                self.inotify.watch(directory,recursive)
+        else:
+            self.snapshot = self.scan()
+
+    def scan(self):
+        """stat signature of every watched file"""
+        stats = {}
+        for directory,recursive in self.directories.items():
+            for root,dirs,files in os.walk(directory):
+                for f in files:
+                    path = os.path.join(root,f)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    stats[path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+                if not recursive:
+                    break
+        return stats
+
+    def changes(self,timeout=None):
+        """wait for changes
+
+        Args:
+            timeout (float): maximum seconds to wait, forever if None.
+
+        Returns:
+            set of the changed file paths, empty if none changed before the timeout.
+        """
+        if self.inotify is not None:
+            return self.inotify.read(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.scan()
+            changed = {
+                p for p in set(snapshot) | set(self.snapshot)
+                if snapshot.get(p) != self.snapshot.get(p)
+            }
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            time.sleep(self.interval if deadline is None else max(
+                0, min(self.interval, deadline-time.monotonic())
+            ))
+
+    def debounced(self,quiet=.3):
+        """wait for a burst of changes to end
+
+        Args:
+            quiet (float): seconds without changes that end a burst.
+
+        Returns:
+            set of all file paths changed during the burst.
+        """
+        changed = self.changes()
+        while True:
+            more = self.changes(quiet)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+class Inotify(object):
+    """Linux inotify instance, through ctypes
+
+    Args:
+        fd (int): the inotify file descriptor.
+        libc: the ctypes C library.
+    """
+    IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_ISDIR = 0x40000000
+    mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO \
+        | IN_CREATE | IN_DELETE
+    event = struct.Struct('iIII')
+
+    def __init__(self,fd,libc):
+        self.fd = fd
+        self.libc = libc
+        self.watches = {}
+
+    @classmethod
+    def create(cls):
+        """an inotify instance, or None if inotify is not available"""
+        try:
+            import ctypes, ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(fd,libc) if fd >= 0 else None
+
+    def watch(self,directory,recursive=False):
+        """watch a directory, and if recursive its subdirectories"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.mask)
+        if wd < 0:
+            return
+        self.watches[wd] = (directory, recursive)
+        if recursive:
+            for entry in os.scandir(directory):
+                if entry.is_dir(follow_symlinks=False):
+                    self.watch(entry.path, True)
+
+    def read(self,timeout=None):
+        """changed file paths, waiting at most timeout seconds for the first"""
+        if not select.select([self.fd],[],[],timeout)[0]:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 1<<16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.event.unpack_from(data,offset)
+            offset += self.event.size
+            name = data[offset:offset+length].rstrip(b'\0')
+            offset += length
+            if wd not in self.watches or not name:
+                continue
+            directory, recursive = self.watches[wd]
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                if recursive and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.watch(path, True)
+                    changed.update(
+                        os.path.join(root,f) for root,_,files in os.walk(path) for f in files
+                    )
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def affected_steps(reco,changed,previous=None):
+    """indices of the workflow steps affected by changed files
+
+    Args:
+        reco (Reconto): the research compendium, with its current plan.
+        changed (iterable): changed file paths.
+        previous (Plan): the plan before `reconto.yml` changed, if it did.
+
+    Returns:
+        set of the steps whose inputs, script or annotations changed.
+    """
+    from reconto.plan import wildcard_pattern
+    steps = set()
+    datadir = os.path.join(reco.path,'data')+os.sep
+    for path in changed:
+        if path == reco.yamlfile:
+            for step in reco.plan:
+                if previous is None or step.index >= len(previous) or \
+                   previous[step.index].annotated != step.annotated:
+                    steps.add(step.index)
+        elif path.startswith(datadir):
+            filepath = path[len(datadir):]
+            for datasource,users in reco.plan.datasources.items():
+                if filepath == datasource or filepath.startswith(datasource+os.sep) or (
+                        '{' in datasource and wildcard_pattern(datasource).fullmatch(filepath)
+                ):
+                    steps.update(users)
+        else:
+            script = os.path.relpath(path,reco.path)
+            steps.update(
+                step.index for step in reco.plan
+                if os.path.normpath(step.command[0]) == script
+            )
+    return steps
+
+def watched_directories(reco):
+    """directories to watch for a compendium: the data folder, the
+    compendium itself for `reconto.yml`, and the folders of its scripts"""
+    directories = {reco.path: False, os.path.join(reco.path,'data'): True}
+    for step in reco.plan:
+        script = os.path.join(reco.path,step.command[0])
+        if os.path.isfile(script):
+            directories.setdefault(os.path.dirname(os.path.abspath(script)), False)
+    return directories
+
+def ignored(reco,path):
+    """changes of reconto's own files, the results and hidden files
+    (e.g. the temporary file `reconto.yml` is atomically replaced with)
+    do not trigger rebuilds"""
+    relative = os.path.relpath(path,reco.path)
+    return os.path.basename(path).startswith('.') or relative.split(os.sep)[0] in (
+        'results', '.reconto', '.git'
+    )
+
+def watch(reco,debounce=.3,interval=.5,poll=False,**build_args):
+    """rebuild the workflow each time its files change, until interrupted
+
+    Args:
+        reco (Reconto): the research compendium.
+        debounce (float): seconds without changes after which a rebuild starts.
+        interval (float): seconds between polls when inotify is not available.
+        poll (bool): if True, poll even when inotify is available.
+        build_args: passed on to `Reconto.build`.
+    """
+    from reconto import Reconto
+    state = {'pending': set(range(len(reco.plan)))}
+    def rebuild(reco,steps,cancel):
+        print('building {} steps'.format(len(steps)))
+        try:
+            results = reco.build(steps=steps,cancel=cancel,**build_args)
+        except RuntimeError as e:
+            if e.args and e.args[0] == 'workflow build cancelled':
+                return
+            logging.error('build failed: %s', e)
+        except Exception as e:
+            logging.error('build failed: %s', e)
+        else:
+            print('built {} steps, {} from cache'.format(
+                len(results), sum(r is None for r in results.values())
+            ))
+        state['pending'] = set()
+    watcher = Watcher(watched_directories(reco),interval,poll)
+    running = None
+    try:
+        while True:
+            if state['pending']:
+                cancel = threading.Event()
+                running = (cancel, threading.Thread(
+                    target=rebuild, args=(reco, reco.plan.upstream(
+                        reco.plan.downstream(state['pending'])
+                    ), cancel), daemon=True
+                ))
+                running[1].start()
+            changed = {p for p in watcher.debounced(debounce) if not ignored(reco,p)}
+            while not changed:
+                changed = {p for p in watcher.debounced(debounce) if not ignored(reco,p)}
+            if running is not None:
+                running[0].set()
+                running[1].join()
+            previous = None
+            if reco.yamlfile in changed:
+                previous = reco.plan
+                reco = Reconto(reco.path)
+                watcher.close()
+                watcher = Watcher(watched_directories(reco),interval,poll)
+            steps = affected_steps(reco,changed,previous)
+            state['pending'] = {i for i in state['pending'] if i < len(reco.plan)} | steps
+            print('changed: {}'.format(', '.join(
+                sorted(os.path.relpath(p,reco.path) for p in changed)
+            )))
+    except KeyboardInterrupt:
+        if running is not None:
+            running[0].set()
+            running[1].join()
+    finally:
+        watcher.close()
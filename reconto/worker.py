@@ -0,0 +1,771 @@
+# -*- coding: utf-8 -*-
+"""worker: distributed execution of workflow steps
+
+`reconto worker` serves a checkout of a compendium on a socket, and
+executes the workflow steps that a coordinating `reconto build --worker`
+dispatches to it. Messages are json headers, each optionally followed
+by a binary payload, a tar archive of compendium files that is streamed
+from and to temporary files on both ends.
+
+For each step the coordinator ships its annotated command, its
+fingerprint and the digests of its inputs. A worker sharing the storage
+of the coordinator (detected on connecting, through a token file the
+coordinator writes in its `.reconto` folder) executes the step in place.
+Any other worker asks for the inputs it lacks or holds a different
+version of, and returns the results and the log of the step. It keeps
+its own step cache, so a step it already built with the same
+fingerprint is not executed again, and restores the steps in the
+machine's object store.
+
+Workers send heartbeats; a worker that misses them, or whose connection
+breaks, is dropped and the steps it was executing are retried on the
+remaining workers. Workers do not authenticate coordinators and should
+only listen on trusted interfaces, by default on 127.0.0.1.
+"""
+import os, json, time, uuid, shutil, socket, struct, tarfile, logging, tempfile, threading
+from collections import deque
+
+#: bump when the messages change, workers refuse coordinators of other versions
+PROTOCOL_VERSION = 2
+_prefix = struct.Struct('!IQ') # header and payload lengths
+_chunksize = 1<<20
+
+def parse_address(address):
+    """socket family and address of `host:port`, or of a unix socket path"""
+    if os.sep in address:
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+def send(sock,lock,header,payload=None):
+    """send a message, the lock serializes the messages of threads sharing sock
+
+    Args:
+        sock (socket.socket): the connection.
+        lock (threading.Lock): lock of the connection.
+        header (dict): json serializable header.
+        payload (file): binary file streamed after the header, from its start.
+    """
+    data = json.dumps(header).encode()
+    size = 0
+    if payload is not None:
+        size = os.fstat(payload.fileno()).st_size
+        payload.seek(0)
+    with lock:
+        sock.sendall(_prefix.pack(len(data),size) + data)
+        if size:
+            sock.sendfile(payload,0,size)
+
+def receive(sock,progress=None):
+    """next message as (header, payload), or (None, None) once the peer closed
+
+    The payload is streamed to an anonymous temporary file, or is None if
+    the message has none. The caller closes it.
+
+    Args:
+        sock (socket.socket): the connection.
+        progress (callable): called after each received payload chunk.
+    """
+    prefix = _receive_exactly(sock,_prefix.size)
+    if prefix is None:
+        return None, None
+    headersize, payloadsize = _prefix.unpack(prefix)
+    header = json.loads(_receive_exactly(sock,headersize,True).decode())
+    if not payloadsize:
+        return header, None
+    payload = tempfile.TemporaryFile()
+    try:
+        buffer = bytearray(min(payloadsize,_chunksize))
+        view, remaining = memoryview(buffer), payloadsize
+        while remaining:
+            n = sock.recv_into(view[:min(remaining,len(buffer))])
+            if not n:
+                raise ConnectionError('connection closed within a message')
+            payload.write(view[:n])
+            remaining -= n
+            if progress is not None:
+                progress()
+        payload.seek(0)
+    except BaseException:
+        payload.close()
+        raise
+    return header, payload
+
+def _receive_exactly(sock,size,required=False):
+    data = bytearray(size)
+    view, received = memoryview(data), 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            if received or required:
+                raise ConnectionError('connection closed within a message')
+            return None
+        received += n
+    return bytes(data)
+
+def relative_path(path):
+    """normalized compendium relative path, raising ValueError for
+    absolute paths and paths leading outside of the compendium"""
+    normalized = os.path.normpath(path)
+    if os.path.isabs(normalized) or normalized.split(os.sep)[0] == '..':
+        raise ValueError('path outside of the compendium', path)
+    return normalized
+
+def pack(root,paths,extra=None):
+    """tar archive of files or directories, written to an anonymous
+    temporary file that the caller closes
+
+    Args:
+        root (str): directory the paths are relative to.
+        paths (iterable): relative paths to archive.
+        extra (dict): extra members, mapping their names to the files
+          they are archived from.
+    """
+    archive = tempfile.TemporaryFile()
+    try:
+        with tarfile.open(fileobj=archive,mode='w') as tar:
+            for path in paths:
+                tar.add(os.path.join(root,path),arcname=path)
+            for name,path in (extra or {}).items():
+                tar.add(path,arcname=name)
+    except BaseException:
+        archive.close()
+        raise
+    return archive
+
+def unpack(root,payload,paths,extra=None):
+    """extract a `pack` archive, replacing the earlier versions of its paths
+
+    Args:
+        root (str): directory to extract in.
+        payload (file): the archive.
+        paths (iterable): the archived relative paths.
+        extra (dict): maps the names of the extra members to extract to
+          the files they are written to, the others are skipped.
+    """
+    paths = {relative_path(path) for path in paths}
+    for path in paths:
+        target = os.path.join(root,path)
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        elif os.path.lexists(target):
+            os.remove(target)
+    extra, members = extra or {}, []
+    payload.seek(0)
+    with tarfile.open(fileobj=payload,mode='r') as tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if any(name == path or name.startswith(path+os.sep) for path in paths):
+                if not (member.isfile() or member.isdir()):
+                    raise ValueError('unexpected archive member', member.name)
+                members.append(member)
+            elif member.isfile() and member.name in extra:
+                with tar.extractfile(member) as source, \
+                     open(extra[member.name],'wb') as target:
+                    shutil.copyfileobj(source,target,_chunksize)
+        for member in members:
+            tar.extract(member,root,set_attrs=member.isfile())
+
+class Worker(object):
+    """Worker object
+
+    Executes the workflow steps that coordinators send it.
+
+    Args:
+        reco (Reconto): the checkout of the compendium the worker serves.
+        jobs (int): number of steps the worker executes concurrently.
+        capacity (Resources): cpus and memory offered to the steps declaring
+          resources, defaults to the machine's.
+        pooled (bool): If True, docker steps are executed in one warm
+          container per exenv.
+    """
+    def __init__(self,reco,jobs=1,capacity=None,pooled=False):
+        from concurrent.futures import ThreadPoolExecutor
+        from reconto.exenv import ExenvPool
+        from reconto.scheduler import Resources
+        self.reco = reco
+        self.jobs = max(1,int(jobs))
+        self.capacity = capacity or Resources.available()
+        self.pool = ExenvPool(reco,pooled=pooled,processes=self.jobs)
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs+2)
+        self.name = '{}:{}'.format(socket.gethostname(),os.getpid())
+
+    def serve(self,address='127.0.0.1:0',ready=None):
+        """accept coordinators until interrupted
+
+        Args:
+            address (str): `host:port` or unix socket path to listen on,
+              port 0 listens on a free port.
+            ready (callable): called with the address once listening.
+        """
+        family, address = parse_address(address)
+        server, bound = socket.socket(family,socket.SOCK_STREAM), False
+        try:
+            if family == socket.AF_INET:
+                server.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+            server.bind(address)
+            bound = True
+            server.listen()
+            if ready is not None:
+                ready(server.getsockname())
+            while True:
+                connection, _ = server.accept()
+                threading.Thread(
+                    target=self.handle, args=(connection,), daemon=True
+                ).start()
+        finally:
+            server.close()
+            if family == socket.AF_UNIX and bound:
+                os.remove(address)
+            self.executor.shutdown(wait=False)
+            self.pool.close()
+            self.reco.cache.save()
+            self.reco.hasher.save()
+
+    def handle(self,connection):
+        """serve the requests of one coordinator, until it disconnects"""
+        lock, closed, tasks = threading.Lock(), threading.Event(), {}
+        def reply(header,payload=None):
+            if not closed.is_set(): # the results of a gone coordinator are dropped
+                send(connection,lock,header,payload)
+        def beat(interval):
+            while not closed.wait(interval):
+                try:
+                    reply({'type': 'heartbeat'})
+                except OSError:
+                    return
+        try:
+            connection.setsockopt(socket.SOL_SOCKET,socket.SO_KEEPALIVE,1)
+            header, _ = receive(connection)
+            if header is None or header.get('type') != 'hello':
+                return
+            if header.get('version') != PROTOCOL_VERSION:
+                reply({'type': 'error', 'error': 'protocol version mismatch'})
+                return
+            shared = os.path.exists(os.path.join(
+                self.reco.path,'.reconto','coordinators',os.path.basename(header['token'])
+            ))
+            reply({
+                'type': 'hello', 'version': PROTOCOL_VERSION, 'name': self.name,
+                'jobs': self.jobs, 'cpus': self.capacity.cpus,
+                'memory': self.capacity.memory, 'shared': shared
+            })
+            threading.Thread(target=beat, args=(header['heartbeat'],), daemon=True).start()
+            while True:
+                header, payload = receive(connection)
+                if header is None:
+                    break
+                if header['type'] == 'execute':
+                    tasks[header['id']] = header
+                    self.executor.submit(self.accept, header, shared, reply)
+                elif header['type'] == 'files':
+                    with payload:
+                        unpack(self.reco.path, payload, header['paths'])
+                    self.executor.submit(self.execute, tasks[header['id']], shared, reply)
+                elif header['type'] == 'cancel' and header['id'] in tasks:
+                    task = tasks[header['id']]
+                    task['cancelled'] = True
+                    if 'execution' in task:
+                        task['execution'].cancel()
+                elif header['type'] == 'done':
+                    tasks.pop(header['id'],None)
+        except (OSError, ValueError, struct.error) as e:
+            logging.error('coordinator connection failed: %s', e)
+        finally:
+            closed.set()
+            for task in list(tasks.values()):
+                task['cancelled'] = True
+                if 'execution' in task:
+                    task['execution'].cancel()
+            connection.close()
+
+    def accept(self,task,shared,reply):
+        """start a step, once the inputs it lacks have been received"""
+        try:
+            if not shared:
+                need = [
+                    path for path,digest in task['inputs'].items()
+                    if not os.path.exists(os.path.join(self.reco.path,path))
+                    or self.reco.hasher.hash(os.path.join(self.reco.path,path)) != digest
+                ]
+                if need:
+                    reply({'type': 'need', 'id': task['id'], 'paths': need})
+                    return
+            self.execute(task,shared,reply)
+        except Exception as e:
+            self.fail(task,e,reply)
+
+    def execute(self,task,shared,reply):
+        """execute a step, replying its result once it exits"""
+        from reconto.exenv import Exenv
+        from reconto.plan import Step
+        from reconto.scheduler import Resources
+        try:
+            if task.get('cancelled'):
+                reply({'type': 'result', 'id': task['id'], 'cancelled': True})
+                return
+            step = Step.parse(task['index'],task['step'])
+            step.produces = tuple(task['produces'])
+            if not shared and (
+                    self.reco.cache.hit(task['fingerprint'],step.produces)
+                    or self.reco.restore_step(step,task['fingerprint'])
+            ):
+                paths = self.results(step)
+                with pack(self.reco.path, paths) as payload:
+                    reply(
+                        {'type': 'result', 'id': task['id'], 'exit_code': 0,
+                         'wall_time': 0., 'timed_out': False, 'cached': True,
+                         'paths': paths}, payload
+                    )
+                return
+            if not shared:
+                self.reco.prepare_results(step)
+            exenv = Exenv.get_env(step.exenv,self.reco,self.pool)
+            exenv.step, exenv.resources = step.index, Resources(*task['resources'])
+            log = os.path.join(self.reco.path,'.reconto','logs','{}.log'.format(step.index))
+            os.makedirs(os.path.dirname(log), exist_ok=True)
+            exenv.load_environment()
+            try:
+                execution = exenv.submit_command(
+                    self.reco.step_command(step,exenv), log=log, timeout=task['timeout']
+                )
+            except BaseException:
+                exenv.stop_environment()
+                raise
+            task['execution'] = execution
+            if task.get('cancelled'):
+                execution.cancel()
+            execution.add_done_callback(lambda execution: self.executor.submit(
+                self.finish, task, step, exenv, execution, shared, reply
+            ))
+        except Exception as e:
+            self.fail(task,e,reply)
+
+    def finish(self,task,step,exenv,execution,shared,reply):
+        """reply the result of an executed step, with its results and log
+        if the coordinator does not share the storage"""
+        try:
+            exenv.stop_environment()
+            if execution.cancelled():
+                reply({'type': 'result', 'id': task['id'], 'cancelled': True})
+                return
+            result = execution.result()
+            paths, extra = [], {}
+            if not shared:
+                succeeded = not (result.exit_code or result.timed_out) and all(
+                    os.path.exists(os.path.join(self.reco.path,'results',filepath))
+                    for filepath in step.produces
+                )
+                if succeeded:
+                    self.reco.record_step(step,task['fingerprint'],result.wall_time)
+                    paths = self.results(step)
+                if result.log and os.path.exists(result.log):
+                    extra['log'] = result.log
+            payload = pack(self.reco.path, paths, extra) if paths or extra else None
+            try:
+                reply(
+                    {'type': 'result', 'id': task['id'], 'exit_code': result.exit_code,
+                     'wall_time': result.wall_time, 'timed_out': result.timed_out,
+                     'cached': False, 'paths': paths}, payload
+                )
+            finally:
+                if payload is not None:
+                    payload.close()
+        except Exception as e:
+            self.fail(task,e,reply)
+
+    def results(self,step):
+        """paths of the results a step produced"""
+        return [
+            os.path.join('results',filepath) for filepath in step.produces
+            if os.path.exists(os.path.join(self.reco.path,'results',filepath))
+        ]
+
+    def fail(self,task,error,reply):
+        """reply that a step could not be executed"""
+        try:
+            reply({'type': 'result', 'id': task['id'], 'error': repr(error)})
+        except OSError:
+            return # the coordinator is gone, and retries the step elsewhere
+        logging.error('workflow step %s failed on worker: %s', task['index'], error)
+
+class Task(object):
+    """Task object
+
+    A workflow step execution dispatched by the coordinator.
+
+    Args:
+        step (Step): the compiled workflow step.
+        fingerprint (str): the step fingerprint.
+        inputs (dict): digests of the step inputs, keyed by their
+          compendium relative path.
+        resources (Resources): cpus and memory the step declares.
+        log (str): file to write the step output to.
+        timeout (float): seconds after which the step gets killed.
+    """
+    def __init__(self,step,fingerprint,inputs,resources,log=None,timeout=None):
+        from concurrent.futures import Future
+        self.id = uuid.uuid4().hex
+        self.step = step
+        self.fingerprint = fingerprint
+        self.inputs = inputs
+        self.resources = resources
+        self.log = log
+        self.timeout = timeout
+        self.future = Future()
+        self.attempts = 0
+        self.worker = None
+
+    def message(self):
+        return {
+            'type': 'execute', 'id': self.id, 'index': self.step.index,
+            'step': list(self.step.annotated), 'produces': list(self.step.produces),
+            'fingerprint': self.fingerprint, 'inputs': self.inputs,
+            'resources': list(self.resources), 'timeout': self.timeout
+        }
+
+class RemoteWorker(object):
+    """RemoteWorker object
+
+    The coordinator side of the connection with a worker.
+
+    Args:
+        address (str): the worker address.
+        sock (socket.socket): the connection.
+        hello (dict): the worker's reply to the coordinator's hello.
+    """
+    def __init__(self,address,sock,hello):
+        from reconto.scheduler import Resources
+        self.address = address
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.name = hello['name']
+        self.jobs = hello['jobs']
+        self.capacity = Resources(hello['cpus'],hello['memory'])
+        self.shared = hello['shared']
+        self.tasks = {}
+        self.alive = True
+        self.transfers = 0
+        self.last_seen = time.monotonic()
+
+    def seen(self):
+        """note that the worker is alive"""
+        self.last_seen = time.monotonic()
+
+    def fits(self,task):
+        """if the worker has a free slot and the resources for a task,
+        a task too large for its whole capacity only fits an idle worker"""
+        if len(self.tasks) >= self.jobs:
+            return False
+        used = task.resources
+        for running in self.tasks.values():
+            used += running.resources
+        return not self.tasks or used.fits(self.capacity)
+
+class RemoteExenv(object):
+    """stand-in for the exenv of a workflow step executed by a worker"""
+    def __init__(self,coordinator,step,exenv,fingerprint):
+        self.coordinator = coordinator
+        self.step = step
+        self.resources = exenv.resources
+        self.fingerprint = fingerprint
+
+    def load_environment(self):
+        pass
+
+    def submit_command(self, command, *args, log=None, timeout=None):
+        return self.coordinator.submit(
+            self.step, self.fingerprint, self.resources, log=log, timeout=timeout
+        )
+
+    def stop_environment(self):
+        pass
+
+class Coordinator(object):
+    """Coordinator object
+
+    Dispatches workflow step executions to workers, at most as many on
+    each as it has jobs, within the resources it offers.
+
+    Args:
+        reco (Reconto): the research compendium being built.
+        addresses (str list): `host:port` or unix socket paths of the workers.
+        timeout (float): seconds without heartbeat after which a worker is dropped.
+        retries (int): times a step is retried after losing the worker executing it.
+    """
+    def __init__(self,reco,addresses,timeout=10.,retries=2):
+        self.reco = reco
+        self.timeout = timeout
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.workers = []
+        self.closed = threading.Event()
+        self.token = uuid.uuid4().hex
+        self.tokenfile = os.path.join(reco.path,'.reconto','coordinators',self.token)
+        os.makedirs(os.path.dirname(self.tokenfile), exist_ok=True)
+        open(self.tokenfile,'w').close()
+        for address in addresses:
+            try:
+                self.workers.append(self.connect(address))
+            except (OSError, ValueError) as e:
+                logging.warning('worker %s not available: %s', address, e)
+        if not self.workers:
+            self.close()
+            raise RuntimeError('no workers available', list(addresses))
+        for worker in self.workers:
+            threading.Thread(target=self.listen, args=(worker,), daemon=True).start()
+        threading.Thread(target=self.monitor, daemon=True).start()
+
+    def connect(self,address):
+        """connect to a worker and exchange hellos"""
+        family, addr = parse_address(address)
+        sock = socket.socket(family,socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(addr)
+            sock.setsockopt(socket.SOL_SOCKET,socket.SO_KEEPALIVE,1)
+            send(sock, threading.Lock(), {
+                'type': 'hello', 'version': PROTOCOL_VERSION, 'token': self.token,
+                'heartbeat': self.timeout/4
+            })
+            hello, _ = receive(sock)
+            if hello is None or hello.get('type') != 'hello':
+                raise ValueError('worker refused connection', (hello or {}).get('error'))
+            sock.settimeout(None)
+        except BaseException:
+            sock.close()
+            raise
+        return RemoteWorker(address,sock,hello)
+
+    @property
+    def jobs(self):
+        """number of steps the workers execute concurrently"""
+        return sum(worker.jobs for worker in self.workers if worker.alive)
+
+    @property
+    def capacity(self):
+        """total resources of the workers"""
+        from reconto.scheduler import Resources
+        capacity = Resources(0,0)
+        for worker in self.workers:
+            if worker.alive:
+                capacity += worker.capacity
+        return capacity
+
+    def exenv(self,step,exenv,fingerprint):
+        """the exenv to execute a prepared step on the workers"""
+        return RemoteExenv(self,step,exenv,fingerprint)
+
+    def submit(self,step,fingerprint,resources,log=None,timeout=None):
+        """queue a workflow step for execution on a worker
+
+        Returns:
+            a `concurrent.futures.Future` resolving to the step `ExecResult`,
+            cancelling it kills the execution.
+        """
+        inputs = {}
+        if not all(worker.shared for worker in self.workers):
+            inputs = self.reco.input_digests(step)
+        task = Task(step,fingerprint,inputs,resources,log,timeout)
+        task.future.add_done_callback(lambda future: self.cancelled(task))
+        with self.lock:
+            self.queue.append(task)
+        self.dispatch()
+        return task.future
+
+    def dispatch(self):
+        """send queued tasks to the workers with free slots, in order"""
+        assigned, lost = [], []
+        with self.lock:
+            alive = [worker for worker in self.workers if worker.alive]
+            if not alive:
+                lost, self.queue = list(self.queue), deque()
+            for task in list(self.queue):
+                worker = max(
+                    (worker for worker in alive if worker.fits(task)),
+                    key=lambda worker: worker.jobs-len(worker.tasks), default=None
+                )
+                if worker is not None:
+                    self.queue.remove(task)
+                    worker.tasks[task.id], task.worker = task, worker
+                    assigned.append(task)
+        for task in lost:
+            task.future.set_exception(
+                RuntimeError('no workers left to execute step', task.step.index)
+            )
+        for task in assigned:
+            try:
+                send(task.worker.sock, task.worker.lock, task.message())
+            except OSError as e:
+                self.drop(task.worker, e)
+
+    def cancelled(self,task):
+        """kill the execution of a cancelled task"""
+        if not task.future.cancelled():
+            return
+        with self.lock:
+            if task in self.queue:
+                self.queue.remove(task)
+                return
+            worker = task.worker
+        if worker is not None and worker.alive:
+            try:
+                send(worker.sock, worker.lock, {'type': 'cancel', 'id': task.id})
+            except OSError as e:
+                self.drop(worker, e)
+
+    def listen(self,worker):
+        """handle the messages of a worker until its connection ends"""
+        error = 'connection closed'
+        try:
+            while True:
+                # a payload being received counts as a sign of life
+                header, payload = receive(worker.sock, worker.seen)
+                if header is None:
+                    break
+                worker.seen()
+                if header['type'] == 'need':
+                    with self.lock:
+                        task = worker.tasks.get(header['id'])
+                    if task is None:
+                        continue # cancelled meanwhile
+                    refused = self.refused(task, header['paths'])
+                    if refused:
+                        self.refuse(worker, task, refused)
+                        continue
+                    worker.transfers += 1
+                    try:
+                        with pack(self.reco.path, header['paths']) as files:
+                            send(worker.sock, worker.lock, {
+                                'type': 'files', 'id': header['id'],
+                                'paths': header['paths']
+                            }, files)
+                    finally:
+                        worker.transfers -= 1
+                        worker.seen()
+                elif header['type'] == 'result':
+                    try:
+                        self.complete(worker,header,payload)
+                    finally:
+                        if payload is not None:
+                            payload.close()
+        except (OSError, ValueError, struct.error) as e:
+            error = e
+        self.drop(worker, error)
+
+    @staticmethod
+    def refused(task,paths):
+        """the paths a worker asks for that are not inputs of its task
+        in the `data`, `results` or `scripts` folders"""
+        refused = []
+        for path in paths:
+            try:
+                normalized = relative_path(path)
+            except ValueError:
+                refused.append(path)
+                continue
+            if normalized not in task.inputs or normalized.split(os.sep)[0] not in (
+                    'data', 'results', 'scripts'
+            ):
+                refused.append(path)
+        return refused
+
+    def refuse(self,worker,task,paths):
+        """fail a task whose worker asked for files it should not receive"""
+        with self.lock:
+            worker.tasks.pop(task.id,None)
+        logging.error(
+            'worker %s asked for files outside of the inputs of step %s: %s',
+            worker.name, task.step.index, paths
+        )
+        try:
+            send(worker.sock, worker.lock, {'type': 'cancel', 'id': task.id})
+        except OSError:
+            pass # the listener notices the lost connection
+        if not task.future.done():
+            task.future.set_exception(RuntimeError(
+                'worker asked for files outside of the step inputs', worker.name, paths
+            ))
+        self.dispatch()
+
+    def complete(self,worker,header,payload):
+        """resolve the future of a task a worker replied the result of"""
+        from reconto.waiter import ExecResult
+        with self.lock:
+            task = worker.tasks.pop(header['id'],None)
+        try:
+            send(worker.sock, worker.lock, {'type': 'done', 'id': header['id']})
+        except OSError:
+            pass # the listener notices the lost connection
+        self.dispatch()
+        if task is None or task.future.done():
+            return
+        if 'error' in header:
+            task.future.set_exception(RuntimeError(
+                'workflow step failed on worker', worker.name, header['error']
+            ))
+            return
+        if payload is not None:
+            unpack(
+                self.reco.path, payload, header['paths'],
+                {'log': task.log} if task.log else None
+            )
+        if not task.future.cancelled():
+            task.future.set_result(ExecResult(
+                header['exit_code'], header['wall_time'], task.log, header['timed_out']
+            ))
+
+    def drop(self,worker,reason=None):
+        """stop using a lost worker, retrying its tasks on the others"""
+        retried, failed = [], []
+        with self.lock:
+            if not worker.alive:
+                return
+            worker.alive = False
+            tasks, worker.tasks = list(worker.tasks.values()), {}
+            for task in tasks:
+                if task.future.done():
+                    continue
+                task.attempts += 1
+                task.worker = None
+                (retried if task.attempts <= self.retries else failed).append(task)
+            self.queue.extendleft(reversed(retried))
+        try:
+            worker.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        worker.sock.close()
+        if not self.closed.is_set():
+            logging.warning(
+                'worker %s lost (%s), retrying %d steps', worker.name, reason, len(retried)
+            )
+        for task in failed:
+            task.future.set_exception(RuntimeError(
+                'workflow step lost with its workers', task.step.index, task.attempts
+            ))
+        self.dispatch()
+
+    def monitor(self):
+        """drop the workers that stop sending heartbeats"""
+        while not self.closed.wait(self.timeout/4):
+            for worker in list(self.workers):
+                if worker.alive and not worker.transfers and \
+                   time.monotonic() - worker.last_seen > self.timeout:
+                    self.drop(worker, 'missed heartbeats')
+
+    def close(self):
+        """disconnect from the workers"""
+        self.closed.set()
+        for worker in self.workers:
+            self.drop(worker, 'closed')
+        try:
+            os.remove(self.tokenfile)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -21,7 +21,7 @@ setup(name = package,
           'gitpython'
       ],
       extras_require = {
-          'dev':  ["ipython"],
+          'dev':  ["ipython", "pytest"],
       },
       package_data = {
           'reconto': [
@@ -36,8 +36,7 @@ setup(name = package,
               'reconto=reconto.__main__:main',
           ],
       },
-      test_suite = 'nose.collector',
-      tests_require = ['nose']
+      tests_require = ['pytest']
 )
 
 #To install with symlink, so that changes are immediately available:
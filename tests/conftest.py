@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+import pytest
+from reconto import Reconto
+
+@pytest.fixture
+def reco(tmp_path):
+    """a new, empty research compendium"""
+    return Reconto(str(tmp_path/'compendium'), init=True)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+
+class PullingDocker(object):
+    """docker client stand-in without local images, recording the pulls"""
+    def __init__(self):
+        self.images = self
+        self.pulls = []
+
+    def get(self,name):
+        from docker.errors import ImageNotFound
+        raise ImageNotFound(name)
+
+    def pull(self,name):
+        self.pulls.append(name)
+        raise AssertionError('image pulled')
+
+@pytest.fixture
+def data(reco):
+    with open(os.path.join(reco.path,'data','in.txt'),'wt') as f:
+        f.write('input\n')
+    return reco
+
+def test_dry_run_does_not_pull_images(data):
+    data.add(['@docker://tools@count','@@in.txt','%OUT%','==counts.txt'])
+    data.add(['@local://@cp','==counts.txt','==copy.txt'])
+    client = PullingDocker()
+    assert data.build(dry_run=True, docker_client=client) == {0: 'miss', 1: 'upstream'}
+    assert client.pulls == []
+
+def test_transient_result_is_streamed(data):
+    data.add(['@local://@cat','@@in.txt','%OUT%','==upper.tmp'], transient=['upper.tmp'])
+    data.add(['@local://@tr','a-z','A-Z','%IN%','==upper.tmp','%OUT%','==upper.txt'])
+    assert data.streams == {'upper.tmp': (0,1)}
+    results = data.build()
+    assert all(result.exit_code == 0 for result in results.values())
+    assert os.listdir(os.path.join(data.path,'results')) == ['upper.txt']
+    with open(os.path.join(data.path,'results','upper.txt')) as f:
+        assert f.read() == 'INPUT\n'
+    assert data.build() == {0: None, 1: None}
+
+def test_transient_result_with_consumers_is_written(data):
+    data.add(['@local://@cat','@@in.txt','%OUT%','==copy.tmp'], transient=['copy.tmp'])
+    data.add(['@local://@cp','==copy.tmp','==a.txt'])
+    data.add(['@local://@cp','==copy.tmp','==b.txt'])
+    assert data.streams == {}
+    data.build()
+    assert sorted(os.listdir(os.path.join(data.path,'results'))) == ['a.txt','b.txt','copy.tmp']
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+from reconto.cache import StepCache
+
+fingerprint = StepCache.fingerprint(
+    ['python scripts/a.py', 'data/in.txt', 'results/out.txt'],
+    'local://', {'data/in.txt': 'aa'}
+)
+
+@pytest.mark.parametrize('command,exenv,inputs', [
+    (['python scripts/b.py', 'data/in.txt', 'results/out.txt'], 'local://', {'data/in.txt': 'aa'}),
+    (['python scripts/a.py', 'data/in.txt', 'results/out.txt'], 'docker://python@sha256:bb', {'data/in.txt': 'aa'}),
+    (['python scripts/a.py', 'data/in.txt', 'results/out.txt'], 'local://', {'data/in.txt': 'bb'}),
+    (['python scripts/a.py', 'data/in.txt', 'results/out.txt'], 'local://', {'data/in.txt': 'aa', 'data/b.txt': 'aa'})
+])
+def test_fingerprint_changes(command, exenv, inputs):
+    assert StepCache.fingerprint(command, exenv, inputs) != fingerprint
+
+def test_fingerprint_ignores_whitespace():
+    assert StepCache.fingerprint(
+        [' python scripts/a.py ', 'data/in.txt', 'results/out.txt\n'],
+        'local://', {'data/in.txt': 'aa'}
+    ) == fingerprint
+
+def write_result(reco, content):
+    with open(os.path.join(reco.path,'results','out.txt'),'w') as f:
+        f.write(content)
+
+def test_journal_replay(reco):
+    write_result(reco, 'out')
+    cache = StepCache(reco)
+    cache.record(fingerprint, ['out.txt'], wall_time=1.)
+    cache.record('streamed', ['tmp.txt'], streamed=['tmp.txt'])
+    assert os.path.exists(cache.journalfile)
+    assert not os.path.exists(cache.manifestfile)
+
+    # an interrupted build leaves only the journal, with a torn last line
+    with open(cache.journalfile,'a') as f:
+        f.write('["torn", {"outp')
+    replayed = StepCache(reco)
+    assert replayed.get(fingerprint)['wall_time'] == 1.
+    assert replayed.get('torn') is None
+    assert replayed.hit(fingerprint, ['out.txt'])
+    assert replayed.hit('streamed', ['tmp.txt'])
+    assert not replayed.hit(fingerprint, ['out.txt', 'other.txt'])
+    assert not replayed.hit('unknown', ['out.txt'])
+
+def test_save_compacts_journal(reco):
+    write_result(reco, 'out')
+    cache = StepCache(reco)
+    cache.record(fingerprint, ['out.txt'])
+    cache.save()
+    assert not os.path.exists(cache.journalfile)
+    loaded = StepCache(reco)
+    assert loaded.manifest == cache.manifest
+    assert loaded.hit(fingerprint, ['out.txt'])
+    write_result(reco, 'altered')
+    assert not loaded.hit(fingerprint, ['out.txt'])
+    os.remove(os.path.join(reco.path,'results','out.txt'))
+    assert not loaded.hit(fingerprint, ['out.txt'])
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import os, time
+import pytest
+from reconto.exenv import ExenvPool, Local
+
+def test_local_command_output_and_exit_code(reco,tmp_path):
+    log = str(tmp_path/'step.log')
+    with ExenvPool(reco,pooled=False,processes=2) as pool:
+        exenv = pool.get_env('local://')
+        assert isinstance(exenv, Local)
+        result = exenv.execute_command(
+            ['sh','-c','pwd; exit 3'], log=log, timeout=30
+        )
+    assert result.exit_code == 3 and not result.timed_out
+    with open(log) as f:
+        assert f.read().strip() == os.path.realpath(reco.path)
+
+def test_local_timeout_kills_process_group(reco,tmp_path):
+    pidfile = str(tmp_path/'child.pid')
+    with ExenvPool(reco,pooled=False) as pool:
+        exenv = pool.get_env('local://')
+        start = time.monotonic()
+        result = exenv.execute_command(
+            ['sh','-c','sleep 60 & echo $! > {}; wait'.format(pidfile)], timeout=.5
+        )
+    assert result.timed_out and result.exit_code != 0
+    assert time.monotonic() - start < 10
+    with open(pidfile) as f:
+        assert not alive(int(f.read()))
+
+def test_local_cancel_kills_and_releases_slot(reco):
+    with ExenvPool(reco,pooled=False,processes=1) as pool:
+        exenv = pool.get_env('local://')
+        execution = exenv.submit_command(['sleep','60'])
+        assert execution.cancel()
+        # the single process slot is released once the process is killed
+        result = exenv.execute_command(['true'], timeout=10)
+    assert result.exit_code == 0
+
+def alive(pid):
+    """if a process exists and is not a zombie"""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            with open('/proc/{}/stat'.format(pid)) as f:
+                if f.read().split(')')[-1].split()[0] == 'Z':
+                    return False
+        except FileNotFoundError:
+            return False
+        time.sleep(.05)
+    return True
+
+class FakeDocker(object):
+    """docker client stand-in recording the images and containers used"""
+    def __init__(self):
+        self.images = self
+        self.containers = self
+        self.calls = []
+
+    def get(self,name):
+        self.calls.append(('get',name))
+        return FakeObject(name)
+
+    def run(self,image,**kwargs):
+        self.calls.append(('run',image))
+        return FakeObject(image,self.calls)
+
+class FakeObject(object):
+    def __init__(self,id,calls=None):
+        self.id = id
+        self.calls = calls
+
+    def remove(self,force=False):
+        self.calls.append(('remove',self.id))
+
+def test_warm_container_reused_per_exenv(reco):
+    client = FakeDocker()
+    with ExenvPool(reco,pooled=True,client=client) as pool:
+        for uid in ('docker://tools', 'docker://tools', 'docker://other'):
+            exenv = pool.get_env(uid)
+            exenv.load_environment()
+            assert exenv.container is pool.containers[exenv.envuid]
+            exenv.stop_environment()
+        assert client.calls == [
+            ('get','tools'), ('run','tools'), ('get','other'), ('run','other')
+        ]
+    assert client.calls[4:] == [('remove','tools'), ('remove','other')]
+
+class BrokenDocker(FakeDocker):
+    """docker client stand-in failing to get the `broken` image"""
+    def get(self,name):
+        if name == 'broken':
+            raise RuntimeError('registry unavailable')
+        return super().get(name)
+
+def test_warm_up_prepares_each_exenv_once(reco):
+    client = FakeDocker()
+    with ExenvPool(reco,pooled=False,client=client) as pool:
+        futures = pool.warm_up(['docker://tools','docker://other','docker://tools'])
+        assert sorted(f.result(timeout=10) for f in futures.values()) == [
+            'docker://other','docker://tools'
+        ]
+        assert pool.warm_up(['docker://tools']) == {'docker://tools': futures['docker://tools']}
+        pool.get_env('docker://tools').prepare_environment()
+    assert sorted(client.calls) == [('get','other'), ('get','tools')]
+
+def test_prepare_reports_failed_exenvs(reco,capsys):
+    reco.add(['@docker://tools@count'])
+    reco.add(['@docker://broken@count'])
+    reco.add(['@local://@true'])
+    failed = reco.prepare(docker_client=BrokenDocker())
+    assert list(failed) == ['docker://broken']
+    assert failed['docker://broken'].args == ('registry unavailable',)
+    output = capsys.readouterr().out
+    assert 'docker://tools ready' in output and 'local:// ready' in output
+    assert 'docker://broken failed: registry unavailable' in output
+
+class ExecDocker(FakeDocker):
+    """docker client stand-in running the execs of warm containers as
+    local processes, streaming their output through a socket"""
+    def __init__(self):
+        super().__init__()
+        self.api = self
+        self.execs = {}
+
+    def run(self,image,**kwargs):
+        super().run(image,**kwargs)
+        return ExecContainer(image,self.calls)
+
+    def exec_create(self,container,cmd,workdir=None,environment=None):
+        exec_id = str(len(self.execs))
+        self.execs[exec_id] = cmd
+        return {'Id': exec_id}
+
+    def exec_start(self,exec_id,socket=False):
+        import socket as sockets, subprocess
+        ours, theirs = sockets.socketpair()
+        self.execs[exec_id] = subprocess.Popen(
+            self.execs[exec_id], stdout=theirs, stderr=subprocess.STDOUT
+        )
+        theirs.close()
+        return ours
+
+    def exec_inspect(self,exec_id):
+        return {'ExitCode': self.execs[exec_id].poll()}
+
+class ExecContainer(FakeObject):
+    def exec_run(self,cmd):
+        import subprocess
+        return subprocess.run(cmd)
+
+def test_pooled_timeout_kills_children_of_step(reco,tmp_path):
+    import glob
+    pidfile = str(tmp_path/'child.pid')
+    pidfiles = set(glob.glob('/tmp/reconto-*.pid'))
+    with ExenvPool(reco,pooled=True,client=ExecDocker()) as pool:
+        exenv = pool.get_env('docker://tools')
+        exenv.load_environment()
+        try:
+            assert exenv.execute_command('exit 3', timeout=20).exit_code == 3
+            start = time.monotonic()
+            # the backgrounded child keeps the output stream open
+            result = exenv.submit_command(
+                'sleep 60 & echo $! > {}; wait'.format(pidfile), timeout=.5
+            ).result(timeout=20)
+        finally:
+            exenv.stop_environment()
+    assert result.timed_out
+    assert time.monotonic() - start < 10
+    with open(pidfile) as f:
+        assert not alive(int(f.read()))
+    deadline = time.monotonic() + 5
+    while set(glob.glob('/tmp/reconto-*.pid')) != pidfiles and time.monotonic() < deadline:
+        time.sleep(.05) # removed by the killing exec, which is not waited for
+    assert set(glob.glob('/tmp/reconto-*.pid')) == pidfiles
+
+@pytest.fixture
+def pipenv(tmp_path,monkeypatch):
+    """stand-in for pipenv, creating fake virtualenvs and recording its calls"""
+    import plumbum
+    from reconto.exenv import Pyenv
+    calls = []
+    def pipenv(self,*args,cwd=None):
+        cwd = cwd or self.envdir
+        calls.append((args[0],cwd))
+        if args[0] == '--venv':
+            raise plumbum.CommandNotFound('pipenv',[])
+        if args[0] == '--python':
+            os.makedirs(os.path.join(cwd,'.venv','bin'))
+            open(os.path.join(cwd,'.venv','bin','python'),'w').close()
+            if not os.path.exists(os.path.join(cwd,'Pipfile')):
+                with open(os.path.join(cwd,'Pipfile'),'wt') as f:
+                    f.write('[packages]\n')
+    monkeypatch.setattr(Pyenv,'pipenv',pipenv)
+    monkeypatch.setenv('RECONTO_PYENV_CACHE',str(tmp_path/'pyenv'))
+    return calls
+
+def test_unlocked_pyenvs_do_not_share_packages(reco,pipenv):
+    envdir = lambda uid: os.path.join(reco.path,'exenv','py3.11',uid)
+    os.makedirs(envdir('aa'))
+    with open(os.path.join(envdir('aa'),'Pipfile'),'wt') as f:
+        f.write('[packages]\nrequests = "*"\n')
+    with ExenvPool(reco,pooled=False) as pool:
+        for uid in ('aa','bb'):
+            exenv = pool.get_env('pyenv://py3.11/'+uid)
+            exenv.load_environment()
+            assert exenv.venv == os.path.join(envdir(uid),'.venv')
+            exenv.stop_environment()
+    with open(os.path.join(envdir('bb'),'Pipfile')) as f:
+        assert 'requests' not in f.read()
+    # the empty template is created once, aa's packages installed in its own clone
+    assert [call for call,cwd in pipenv] == ['--venv', '--python', 'install']
+    assert pipenv[2][1] == envdir('aa')
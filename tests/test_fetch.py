@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from reconto.fetch import Fetcher
+
+CONTENT = bytes(range(256))*4096 # 1 MiB
+
+class TruncatingHandler(BaseHTTPRequestHandler):
+    """serves CONTENT, truncating the body of the first response"""
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get('Range'))
+        offset = int((self.headers.get('Range') or 'bytes=0-')[6:].rstrip('-'))
+        self.send_response(206 if offset else 200)
+        if offset:
+            self.send_header('Content-Range','bytes {}-{}/{}'.format(
+                offset, len(CONTENT)-1, len(CONTENT)
+            ))
+        self.send_header('Content-Length',str(len(CONTENT)-offset))
+        self.end_headers()
+        if len(self.requests) == 1:
+            self.wfile.write(CONTENT[:1000])
+            self.close_connection = True
+        else:
+            self.wfile.write(CONTENT[offset:])
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    TruncatingHandler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1',0),TruncatingHandler)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    yield 'http://{}:{}/'.format(*server.server_address)
+    server.shutdown()
+    server.server_close()
+
+def test_truncated_body_is_resumed(reco,server):
+    fetcher = Fetcher(reco)
+    path = fetcher.fetch(server,'f.bin','@').result(timeout=30)
+    fetcher.close()
+    with open(path,'rb') as f:
+        assert f.read() == CONTENT
+    assert TruncatingHandler.requests == [None,'bytes=1000-']
+    assert not os.path.exists(path+'.part')
+
+def test_truncated_body_fails_without_retries(reco,server):
+    fetcher = Fetcher(reco,retries=1)
+    with pytest.raises(OSError):
+        fetcher.fetch(server,'f.bin','@').result(timeout=30)
+    fetcher.close()
+    assert not os.path.exists(os.path.join(reco.path,'data','f.bin'))
+    assert os.path.getsize(os.path.join(reco.path,'data','f.bin.part')) == 1000
+
+def test_file_location_and_checksum(reco,tmp_path):
+    import hashlib
+    source = tmp_path/'source.bin'
+    source.write_bytes(CONTENT)
+    reco.config['checksums'] = {'copy.bin': 'sha256:'+hashlib.sha256(CONTENT).hexdigest()}
+    fetcher = Fetcher(reco)
+    path = fetcher.fetch(source.as_uri(),'copy.bin').result(timeout=30)
+    fetcher.close()
+    with open(path,'rb') as f:
+        assert f.read() == CONTENT
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os, mmap
+from reconto.hashing import Hasher
+
+def test_symlinks_are_not_followed(tmp_path):
+    tree = tmp_path/'results'
+    (tree/'sub').mkdir(parents=True)
+    (tree/'sub'/'a.txt').write_text('a')
+    os.symlink('..', str(tree/'sub'/'up'))
+    hasher = Hasher(str(tmp_path))
+    digest = hasher.hash(str(tree))
+    assert hasher.stats['files_hashed'] == 1
+    os.remove(str(tree/'sub'/'up'))
+    os.symlink('.', str(tree/'sub'/'up'))
+    assert hasher.hash(str(tree)) != digest
+
+def age(path, seconds=60):
+    st = os.stat(str(path))
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns - seconds*10**9))
+
+def test_stat_index_reuse(tmp_path):
+    (tmp_path/'a.txt').write_text('a'*100)
+    age(tmp_path/'a.txt')
+    indexfile = str(tmp_path/'index.json')
+    hasher = Hasher(str(tmp_path), indexfile)
+    digest = hasher.hash(str(tmp_path/'a.txt'))
+    hasher.close()
+    assert hasher.index['a.txt'][3] == digest
+    hasher = Hasher(str(tmp_path), indexfile)
+    assert hasher.hash(str(tmp_path/'a.txt')) == digest
+    assert hasher.stats == {
+        'files_hashed': 0, 'files_skipped': 1, 'bytes_read': 0, 'bytes_skipped': 100
+    }
+
+def test_racy_files_not_indexed(tmp_path):
+    (tmp_path/'a.txt').write_text('a')
+    hasher = Hasher(str(tmp_path))
+    digest = hasher.hash(str(tmp_path/'a.txt'))
+    assert 'a.txt' not in hasher.index
+    # same size and, within the mtime resolution, possibly the same mtime
+    (tmp_path/'a.txt').write_text('b')
+    assert hasher.hash(str(tmp_path/'a.txt')) != digest
+    assert hasher.stats['files_hashed'] == 2
+
+def test_chunked_digest(tmp_path):
+    (tmp_path/'a.bin').write_bytes(os.urandom(3*mmap.ALLOCATIONGRANULARITY+1))
+    chunked = Hasher(str(tmp_path), chunksize=mmap.ALLOCATIONGRANULARITY)
+    whole = Hasher(str(tmp_path), chunksize=1<<30)
+    assert chunked.hash(str(tmp_path/'a.bin')) != whole.hash(str(tmp_path/'a.bin'))
+    assert chunked.hash(str(tmp_path/'a.bin')) == Hasher(
+        str(tmp_path), chunksize=mmap.ALLOCATIONGRANULARITY
+    ).hash(str(tmp_path/'a.bin'))
+
+def test_tree_digest_changes(tmp_path):
+    tree = tmp_path/'results'
+    (tree/'sub').mkdir(parents=True)
+    (tree/'sub'/'a.txt').write_text('a')
+    (tree/'b.txt').write_text('b')
+    hasher = Hasher(str(tmp_path))
+    digests = [hasher.hash(str(tree))]
+    os.rename(str(tree/'sub'/'a.txt'), str(tree/'sub'/'c.txt'))
+    digests.append(hasher.hash(str(tree)))
+    (tree/'sub'/'c.txt').write_text('c')
+    digests.append(hasher.hash(str(tree)))
+    os.rename(str(tree/'sub'/'c.txt'), str(tree/'c.txt'))
+    digests.append(hasher.hash(str(tree)))
+    assert len(set(digests)) == 4
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import os
+import yaml
+import pytest
+from reconto.plan import dump_yaml
+
+@pytest.mark.parametrize('value', [
+    1e20, 1e-5, -2.5e-300, 1.5e300, 0.5, 1.0, -0.0, 3, -7, True, False, None,
+    'yes', 'No', '1e5', '0.5', '=', '~', '', '.inf', 'a: b', "it's", 'tab\there',
+    '@docker://tools@count', '@@reads/{sample}.fq', '==counts/{sample*}.tsv', '%OUT%',
+    [], {}
+])
+def test_scalar_round_trip(value):
+    config = {'value': value, 'values': [value]}
+    loaded = yaml.safe_load(dump_yaml(config))
+    assert loaded == config
+    assert type(loaded['value']) is type(value)
+
+def test_config_round_trip():
+    config = {
+        'exenv': ['docker://python:3.7', 'local://'],
+        'data': ['@https://example.com/@archive.tar.gz@'],
+        'scripts': [['cat', 'local://']],
+        'workflow': [['@local://@cat', '@@archive.tar.gz', '%OUT%', '==copy.tar.gz']],
+        'results': ['==copy.tar.gz'],
+        'resources': {'default': {'cpus': 1.5, 'memory': '16g'}, 'docker://aligner': {}},
+        'wildcards': {'sample': ['s1', 's2']},
+        'threshold': 1e-08
+    }
+    assert yaml.safe_load(dump_yaml(config)) == config
+
+def test_plan_cache_round_trip(reco):
+    from reconto import Reconto
+    from reconto.plan import Plan
+    reco.add_many([
+        ['@local://@cp','@@reads/{sample}.fq','==counts/{sample}.tsv'],
+        ['@local://@cat','==counts/{sample*}.tsv','%OUT%','==counts.tsv']
+    ])
+    assert os.path.exists(Plan.cachefile(reco))
+    cached = Reconto(reco.path)
+    assert cached.config == reco.config
+    assert [s.state() for s in cached.plan] == [s.state() for s in reco.plan]
+    assert cached.plan.producers == reco.plan.producers
+    assert cached.plan[0].results == ((2, '', 'counts/{sample}.tsv', ''),)
+    assert cached.plan[1].dependencies == (0,)
+
+def test_plan_cache_is_not_executable(reco,tmp_path):
+    import pickle
+    from reconto import Reconto
+    planted = tmp_path/'planted'
+    class Payload(object):
+        def __reduce__(self):
+            return (open, (str(planted),'w'))
+    for name in ('plan.pickle', 'plan.json'):
+        with open(os.path.join(reco.path,'.reconto',name),'wb') as f:
+            pickle.dump(Payload(), f)
+    Reconto(reco.path)
+    assert not planted.exists()
+
+def test_config_not_preserved_by_json_is_not_cached(reco):
+    from reconto import Reconto
+    from reconto.plan import Plan
+    reco.config['wildcards'] = {1: ['a']}
+    reco.write_config()
+    assert not os.path.exists(Plan.cachefile(reco))
+    assert Reconto(reco.path).config['wildcards'] == {1: ['a']}
+
+@pytest.fixture
+def scatter(reco):
+    """compendium scattering a step over samples and gathering the results"""
+    os.makedirs(os.path.join(reco.path,'data','reads'))
+    for sample in ('s1','s2'):
+        with open(os.path.join(reco.path,'data','reads',sample+'.fq'),'wt') as f:
+            f.write(sample+'\n')
+    with open(os.path.join(reco.path,'data','reads','notes.txt'),'wt') as f:
+        f.write('unmatched\n')
+    reco.add_many([
+        ['@local://@cp','@@reads/{sample}.fq','==counts/{sample}.tsv'],
+        ['@local://@cat','==counts/{sample*}.tsv','%OUT%','==counts.tsv']
+    ])
+    return reco
+
+def test_wildcard_values(scatter):
+    assert scatter.wildcard_values() == {'sample': ['s1','s2']}
+    scatter.config['wildcards'] = {'sample': ['s2', 3]}
+    assert scatter.wildcard_values() == {'sample': ['s2','3']}
+
+def test_wildcard_without_values(reco):
+    reco.add(['@local://@cp','@@reads/{sample}.fq','==counts/{sample}.tsv'])
+    with pytest.raises(ValueError):
+        reco.expand()
+
+def test_expand(scatter):
+    plan, expansions = scatter.expand()
+    assert expansions == {0: [0,1], 1: [2]}
+    assert scatter.expanded is plan
+    assert [step.annotated for step in plan] == [
+        ('@local://@cp','@@reads/s1.fq','==counts/s1.tsv'),
+        ('@local://@cp','@@reads/s2.fq','==counts/s2.tsv'),
+        ('@local://@cat','==counts/s1.tsv','==counts/s2.tsv','%OUT%','==counts.tsv')
+    ]
+    assert [step.template for step in plan] == [0,0,1]
+    assert plan[2].dependencies == (0,1)
+    assert scatter.plan[1].dependencies == (0,)
+
+def test_gather_build(scatter):
+    results = scatter.build()
+    assert sorted(results) == [0,1,2]
+    with open(os.path.join(scatter.path,'results','counts.tsv')) as f:
+        assert f.read() == 's1\ns2\n'
+    with open(os.path.join(scatter.path,'data','reads','s3.fq'),'wt') as f:
+        f.write('s3\n')
+    results = scatter.build()
+    assert {i: r is None for i,r in results.items()} == {0: True, 1: True, 2: False, 3: False}
+    with open(os.path.join(scatter.path,'results','counts.tsv')) as f:
+        assert f.read() == 's1\ns2\ns3\n'
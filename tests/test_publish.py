@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os, threading
+import pytest
+from reconto.publish import StandIn
+
+@pytest.fixture
+def remote(tmp_path):
+    server = StandIn(str(tmp_path/'remote'))
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def published(reco,remote):
+    """compendium with a result annotated with a location on the stand-in"""
+    location = 'http://{}:{}/'.format(*remote.server_address)
+    reco.add(['@local://@cp','@@in.txt','={}=copy.txt='.format(location)])
+    with open(os.path.join(reco.path,'results','copy.txt'),'wt') as f:
+        f.write('result\n')
+    return reco
+
+def test_publish_skips_unchanged_content(published,remote):
+    assert published.publish() == {}
+    assert published.publisher.stats['files_published'] == 1
+    with open(os.path.join(remote.directory,'copy.txt')) as f:
+        assert f.read() == 'result\n'
+    assert published.publish() == {}
+    assert published.publisher.stats['files_published'] == 1
+    assert published.publisher.stats['files_unchanged'] == 1
+    with open(os.path.join(published.path,'results','copy.txt'),'wt') as f:
+        f.write('changed\n')
+    assert published.publish() == {}
+    assert published.publisher.stats['files_published'] == 2
+    with open(os.path.join(remote.directory,'copy.txt')) as f:
+        assert f.read() == 'changed\n'
+
+def test_publish_targets(published,remote):
+    assert published.publish(targets=['results/copy.txt']) == {}
+    assert published.publisher.stats['files_published'] == 1
+    with pytest.raises(Exception, match='no annotated result'):
+        published.publish(targets=['results/cpy.txt'])
+
+def test_publish_reports_missing_results(published):
+    os.remove(os.path.join(published.path,'results','copy.txt'))
+    failed = published.publish()
+    assert list(failed.values()) == [None]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from reconto.scheduler import Resources, Scheduler
+
+def run(scheduler,failing=()):
+    """run a scheduler, failing the nodes in `failing`
+
+    Returns:
+        the results or exception of the run, and the started nodes in order.
+    """
+    started = []
+    def execute(n):
+        if n in failing:
+            raise ValueError('failed', n)
+        return n*10
+    with ThreadPoolExecutor(max_workers=scheduler.jobs) as executor:
+        def submit(n):
+            started.append(n)
+            return executor.submit(execute,n)
+        try:
+            return scheduler.run(submit), started
+        except Exception as e:
+            return e, started
+
+def test_dependencies_run_in_order():
+    results, started = run(Scheduler({0: [], 1: [0], 2: [0], 3: [1,2]}, jobs=2))
+    assert results == {0: 0, 1: 10, 2: 20, 3: 30}
+    assert started[0] == 0 and started[-1] == 3
+
+def test_fail_fast_starts_no_new_nodes():
+    error, started = run(Scheduler({0: [], 1: [], 2: [1]}, jobs=1), failing={0})
+    assert isinstance(error, ValueError) and error.args == ('failed', 0)
+    assert started == [0]
+
+def test_keep_going_skips_only_downstream_nodes():
+    error, started = run(
+        Scheduler({0: [], 1: [0], 2: [1], 3: [], 4: [3]}, jobs=2, keep_going=True),
+        failing={1}
+    )
+    assert isinstance(error, RuntimeError)
+    message, failed, skipped = error.args
+    assert list(failed) == [1] and skipped == [2]
+    assert sorted(started) == [0, 1, 3, 4]
+
+def test_dependency_cycle():
+    error, started = run(Scheduler({0: [], 1: [2], 2: [1]}))
+    assert isinstance(error, RuntimeError) and error.args[1] == [1, 2]
+    assert started == [0]
+
+def test_resources_limit_concurrent_nodes():
+    scheduler = Scheduler(
+        {n: [] for n in range(4)}, jobs=4,
+        resources={n: Resources(2,0) for n in range(4)}, capacity=Resources(4,0)
+    )
+    from collections import deque
+    ready = deque(range(4))
+    assert scheduler.pack(ready,[]) == [0, 1]
+    assert scheduler.pack(ready,[0]) == [2]
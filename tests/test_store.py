@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import os, shutil
+import pytest
+from reconto import Reconto
+
+@pytest.fixture
+def chained(reco,tmp_path,monkeypatch):
+    """compendium of two chained local steps, built with an object store"""
+    monkeypatch.setenv('RECONTO_STORE',str(tmp_path/'store'))
+    with open(os.path.join(reco.path,'data','in.txt'),'wt') as f:
+        f.write('input\n')
+    reco.add(['@local://@cp','@@in.txt','==a.txt'])
+    reco.add(['@local://@cp','==a.txt','==b.txt'])
+    reco.build()
+    return reco
+
+def test_dry_run_after_build_hits(chained):
+    assert Reconto(chained.path).build(dry_run=True) == {0: 'hit', 1: 'hit'}
+
+def test_dry_run_reports_downstream_restores(chained):
+    shutil.rmtree(os.path.join(chained.path,'results'))
+    shutil.rmtree(os.path.join(chained.path,'.reconto','cache'))
+    os.mkdir(os.path.join(chained.path,'results'))
+    reco = Reconto(chained.path)
+    assert reco.build(dry_run=True) == {0: 'restore', 1: 'restore'}
+    assert reco.build() == {0: None, 1: None}
+    with open(os.path.join(reco.path,'results','b.txt')) as f:
+        assert f.read() == 'input\n'
+
+def test_dry_run_reports_changed_inputs(chained):
+    with open(os.path.join(chained.path,'data','in.txt'),'wt') as f:
+        f.write('changed\n')
+    assert Reconto(chained.path).build(dry_run=True) == {0: 'miss', 1: 'upstream'}
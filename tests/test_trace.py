@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import os
+from reconto.trace import Tracer, critical_path, latest_trace
+
+def test_save_keeps_last_traces(tmp_path):
+    directory = str(tmp_path/'traces')
+    os.makedirs(directory)
+    for k in range(5):
+        open(os.path.join(directory,'20200101-00000{}-1.json'.format(k)),'w').close()
+    tracefile = Tracer().save(directory, keep=3)
+    assert sorted(os.listdir(directory)) == [
+        '20200101-000003-1.json', '20200101-000004-1.json', os.path.basename(tracefile)
+    ]
+    assert latest_trace(directory) == tracefile
+
+def test_critical_path():
+    tracer = Tracer()
+    tracer.steps = {
+        0: {'command': 'a', 'dependencies': []},
+        1: {'command': 'b', 'dependencies': [0]},
+        2: {'command': 'c', 'dependencies': [0]}
+    }
+    for step,ts,dur in ((0,0,10),(1,10,5),(2,10,20)):
+        tracer.spans.append(('execute_command',step,ts,dur,0,None))
+    assert critical_path(tracer.to_dict()) == (['0','2'], 30)
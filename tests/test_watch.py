@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os, threading, _thread
+import pytest
+from reconto import Reconto
+from reconto.watch import Watcher, affected_steps, watched_directories, watch
+
+@pytest.fixture
+def workflow(reco):
+    """compendium with two copies joined by a third step"""
+    os.makedirs(os.path.join(reco.path,'scripts'))
+    with open(os.path.join(reco.path,'scripts','join.sh'),'wt') as f:
+        f.write('cat "$@"\n')
+    for name in ('a','b'):
+        with open(os.path.join(reco.path,'data',name+'.txt'),'wt') as f:
+            f.write(name+'\n')
+    reco.add(['@local://@cp','@@a.txt','==a.txt'])
+    reco.add(['@local://@cp','@@b.txt','==b.txt'])
+    reco.add(['@local://@sh','scripts/join.sh','==a.txt','==b.txt','%OUT%','==ab.txt'])
+    return reco
+
+def test_affected_steps(workflow):
+    path = lambda *p: os.path.join(workflow.path,*p)
+    workflow.add(['@local://@scripts/join.sh','@@reads/{sample}.fq','%OUT%','==reads/{sample}.txt'])
+    assert affected_steps(workflow,[path('data','a.txt')]) == {0}
+    assert affected_steps(workflow,[path('data','reads','s1.fq')]) == {3}
+    assert affected_steps(workflow,[path('data','reads','s1.txt')]) == set()
+    assert affected_steps(workflow,[path('scripts','join.sh')]) == {3}
+    previous = workflow.plan
+    with open(workflow.yamlfile) as f:
+        source = f.read()
+    with open(workflow.yamlfile,'wt') as f:
+        f.write(source.replace("'@@b.txt'","'@@c.txt'"))
+    edited = Reconto(workflow.path)
+    edited.add(['@local://@cat','==ab.txt','%OUT%','==abab.txt'])
+    assert affected_steps(edited,[edited.yamlfile],previous) == {1,4}
+
+def test_watched_directories(workflow):
+    workflow.add(['@local://@scripts/join.sh','==ab.txt'])
+    assert watched_directories(workflow) == {
+        workflow.path: False,
+        os.path.join(workflow.path,'data'): True,
+        os.path.join(workflow.path,'scripts'): False
+    }
+
+def test_polling_watcher(tmp_path):
+    (tmp_path/'sub').mkdir()
+    (tmp_path/'a.txt').write_text('a')
+    watcher = Watcher({str(tmp_path): False},interval=.01,poll=True)
+    assert watcher.changes(.05) == set()
+    (tmp_path/'a.txt').write_text('aa')
+    (tmp_path/'sub'/'b.txt').write_text('b')
+    assert watcher.changes(1) == {str(tmp_path/'a.txt')}
+    os.remove(str(tmp_path/'a.txt'))
+    assert watcher.debounced(.05) == {str(tmp_path/'a.txt')}
+
+def test_watch_rebuilds_downstream_steps(workflow,monkeypatch):
+    reco = workflow
+    builds, built = [], threading.Semaphore(0)
+    build = reco.build
+    def recorded(**kwargs):
+        try:
+            builds.append(build(**kwargs))
+            return builds[-1]
+        finally:
+            built.release()
+    monkeypatch.setattr(reco,'build',recorded)
+    def edit():
+        try:
+            assert built.acquire(timeout=30)
+            with open(os.path.join(reco.path,'data','a.txt'),'wt') as f:
+                f.write('edited\n')
+            assert built.acquire(timeout=30)
+        finally:
+            _thread.interrupt_main()
+    editor = threading.Thread(target=edit)
+    editor.start()
+    watch(reco,debounce=.05,interval=.01,poll=True)
+    editor.join()
+    assert len(builds) == 2
+    assert all(builds[0].values())
+    assert {i for i,result in builds[1].items() if result is not None} == {0,2}
+    with open(os.path.join(reco.path,'results','ab.txt')) as f:
+        assert f.read() == 'edited\nb\n'
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import os, time, socket, threading
+import pytest
+from reconto import Reconto
+from reconto.scheduler import Resources
+from reconto.worker import (
+    PROTOCOL_VERSION, Coordinator, Worker, pack, receive, send, unpack
+)
+
+def serve(worker):
+    """serve a worker on a free port in a background thread"""
+    ready = threading.Event()
+    addresses = []
+    def listening(address):
+        addresses.append('{}:{}'.format(*address))
+        ready.set()
+    threading.Thread(
+        target=worker.serve, args=('127.0.0.1:0',listening), daemon=True
+    ).start()
+    assert ready.wait(10)
+    return addresses[0]
+
+def silent_worker():
+    """a worker that accepts steps but never sends a heartbeat or result"""
+    server = socket.socket()
+    server.bind(('127.0.0.1',0))
+    server.listen()
+    def accept():
+        connection, _ = server.accept()
+        lock = threading.Lock()
+        receive(connection)
+        send(connection, lock, {
+            'type': 'hello', 'version': PROTOCOL_VERSION, 'name': 'silent',
+            'jobs': 4, 'cpus': 4, 'memory': 0, 'shared': False
+        })
+        while receive(connection)[0] is not None:
+            pass
+    threading.Thread(target=accept, daemon=True).start()
+    return '{}:{}'.format(*server.getsockname())
+
+def greedy_worker(paths,received):
+    """a worker that asks for `paths` for every step, appending the types
+    of the messages it receives to `received`"""
+    server = socket.socket()
+    server.bind(('127.0.0.1',0))
+    server.listen()
+    def accept():
+        connection, _ = server.accept()
+        lock = threading.Lock()
+        receive(connection)
+        send(connection, lock, {
+            'type': 'hello', 'version': PROTOCOL_VERSION, 'name': 'greedy',
+            'jobs': 1, 'cpus': 1, 'memory': 0, 'shared': False
+        })
+        while True:
+            header, payload = receive(connection)
+            if header is None:
+                break
+            received.append(header['type'])
+            if header['type'] == 'execute':
+                send(connection, lock, {'type': 'need', 'id': header['id'], 'paths': paths})
+    threading.Thread(target=accept, daemon=True).start()
+    return '{}:{}'.format(*server.getsockname())
+
+@pytest.fixture
+def step(reco):
+    with open(os.path.join(reco.path,'data','in.txt'),'wt') as f:
+        f.write('input\n')
+    reco.add(['@local://@cp','@@in.txt','==out.txt'])
+    return reco.plan[0]
+
+@pytest.fixture
+def worker(tmp_path):
+    return Worker(Reconto(str(tmp_path/'worker'),init=True))
+
+def test_message_round_trip_streams_payload(tmp_path):
+    data = os.urandom(3<<20)
+    (tmp_path/'big.bin').write_bytes(data)
+    left, right = socket.socketpair()
+    chunks = []
+    with pack(str(tmp_path),['big.bin']) as payload:
+        sender = threading.Thread(
+            target=send, args=(left,threading.Lock(),{'type':'files'},payload)
+        )
+        sender.start()
+        header, received = receive(right, lambda: chunks.append(1))
+        sender.join()
+    assert header == {'type': 'files'}
+    assert len(chunks) > 1
+    (tmp_path/'out').mkdir()
+    with received:
+        unpack(str(tmp_path/'out'),received,['big.bin'])
+    assert (tmp_path/'out'/'big.bin').read_bytes() == data
+    left.close()
+    assert receive(right) == (None, None)
+    right.close()
+
+def test_step_round_trip(reco,step,worker):
+    coordinator = Coordinator(reco,[serve(worker)],timeout=5.)
+    try:
+        log = os.path.join(str(reco.path),'step.log')
+        result = coordinator.submit(
+            step, 'f'*64, Resources(0,0), log=log
+        ).result(timeout=30)
+    finally:
+        coordinator.close()
+    assert result.exit_code == 0
+    with open(os.path.join(reco.path,'results','out.txt')) as f:
+        assert f.read() == 'input\n'
+    assert os.path.exists(log)
+    assert os.path.exists(os.path.join(worker.reco.path,'results','out.txt'))
+
+def test_lost_worker_step_is_requeued(reco,step,worker):
+    coordinator = Coordinator(reco,[silent_worker(),serve(worker)],timeout=1.)
+    try:
+        silent = coordinator.workers[0]
+        future = coordinator.submit(step, 'f'*64, Resources(0,0))
+        result = future.result(timeout=30)
+    finally:
+        coordinator.close()
+    assert result.exit_code == 0
+    assert not silent.alive
+    with open(os.path.join(reco.path,'results','out.txt')) as f:
+        assert f.read() == 'input\n'
+
+def test_lost_worker_step_fails_without_retries(reco,step):
+    coordinator = Coordinator(reco,[silent_worker()],timeout=1.,retries=0)
+    try:
+        with pytest.raises(RuntimeError):
+            coordinator.submit(step, 'f'*64, Resources(0,0)).result(timeout=30)
+    finally:
+        coordinator.close()
+
+@pytest.mark.parametrize('paths', [
+    ['/etc/passwd'], ['../worker/reconto.yml'], ['data/../../secret'],
+    ['reconto.yml'], ['data/other.txt'], ['data/in.txt', '.git/config']
+])
+def test_need_outside_of_step_inputs_is_refused(reco,step,paths):
+    with open(os.path.join(reco.path,'data','other.txt'),'wt') as f:
+        f.write('other\n')
+    received = []
+    coordinator = Coordinator(reco,[greedy_worker(paths,received)],timeout=5.)
+    try:
+        future = coordinator.submit(step, 'f'*64, Resources(0,0))
+        with pytest.raises(RuntimeError, match='outside of the step inputs'):
+            future.result(timeout=30)
+    finally:
+        coordinator.close()
+    assert 'files' not in received
+
+def test_need_of_step_inputs_is_answered(reco,step):
+    received = []
+    coordinator = Coordinator(reco,[greedy_worker(['data/in.txt'],received)],timeout=5.)
+    try:
+        coordinator.submit(step, 'f'*64, Resources(0,0))
+        deadline = time.monotonic() + 10
+        while 'files' not in received and time.monotonic() < deadline:
+            time.sleep(.05)
+    finally:
+        coordinator.close()
+    assert received == ['execute', 'files']